@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+
+import re
+import time
+
+
+MEM_UNITS = {"": 1, "m": 1, "mb": 1, "g": 1024, "gb": 1024,
+             "t": 1024**2, "tb": 1024**2}
+
+
+def parse_mem(value):
+    """Memory in MB from a value like MOLCAS_MEM, e.g. '4000', '2Gb'.
+    Plain numbers are in MB."""
+    mobj = re.fullmatch("\s*([\d\.]+)\s*([a-zA-Z]*)\s*", str(value))
+    if (mobj is None) or (mobj[2].lower() not in MEM_UNITS):
+        raise ValueError(f"Can't understand memory '{value}'.")
+    return float(mobj[1]) * MEM_UNITS[mobj[2].lower()]
+
+
+def load_average(loadavg_fn="/proc/loadavg"):
+    """Load average of the last minute or None, when it is not known."""
+    try:
+        with open(loadavg_fn) as handle:
+            return float(handle.read().split()[0])
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+def meminfo(meminfo_fn="/proc/meminfo"):
+    """Entries of /proc/meminfo in MB."""
+    info = dict()
+    try:
+        with open(meminfo_fn) as handle:
+            for line in handle:
+                key, value = line.split(":", 1)
+                info[key] = float(value.split()[0]) / 1024
+    except (OSError, ValueError):
+        pass
+    return info
+
+
+class Admission:
+    """Decides if another job may be started on this machine, so jobs of
+    other users and our own jobs are not slowed down or killed by an
+    oversubscribed machine.
+
+    A job is held back when the load average plus its cores would exceed
+    'max_load' or when the available memory is less than the 'job_mem' MB
+    it needs. Jobs started less than 'settle' seconds ago do not show up
+    in the load average or the used memory yet, so their cores and memory
+    are accounted for by the controller itself."""
+
+    def __init__(self, max_load=None, job_mem=None, settle=60.):
+        self.max_load = max_load
+        self.job_mem = job_mem
+        self.settle = settle
+        self.jobs = dict()
+
+    @property
+    def active(self):
+        return (self.max_load is not None) or (self.job_mem is not None)
+
+    def started(self, job_input, cores=1, mem=None):
+        self.jobs[job_input] = (time.time(), cores,
+                                self.job_mem if mem is None else mem)
+
+    def finished(self, job_input):
+        self.jobs.pop(job_input, None)
+
+    def check(self, cores=1, mem=None):
+        """Returns the reason, when a job with 'cores' cores and 'mem' MB
+        of memory has to wait."""
+        mem = self.job_mem if mem is None else mem
+        now = time.time()
+        own_cores = sum([cores_ for _, cores_, _ in self.jobs.values()])
+        settling = [mem_ for start, _, mem_ in self.jobs.values()
+                    if (now - start < self.settle) and mem_]
+
+        load = load_average()
+        if (self.max_load is not None) and (load is not None):
+            load = max(load, own_cores)
+            if load + cores > self.max_load:
+                return f"load {load:.1f} + {cores} > {self.max_load:.1f}"
+
+        info = meminfo()
+        if mem and ("MemAvailable" in info):
+            available = info["MemAvailable"] - sum(settling)
+            # A job that never fits would wait forever.
+            if (mem > info.get("MemTotal", mem)) and not self.jobs:
+                return None
+            if available < mem:
+                return f"{available:.0f} MB available < {mem:.0f} MB needed"
+        return None
@@ -0,0 +1,253 @@
+#!/usr/bin/env python3
+
+import os
+from pathlib import Path
+import re
+import shlex
+import subprocess
+import time
+
+import yaml
+
+from mcgridprep.templates import ENV
+
+
+BATCH_DIR = "batch"
+# Job dependencies for the array tasks, when no --deps file was given
+DEPS_FN = "job_deps.yaml"
+
+
+def pack_jobs(job_inputs, job_deps, pack=1):
+    """Group the job inputs into tasks of job arrays.
+
+    Every task runs up to 'pack' job inputs with mcgridrun. A job is put
+    into the task of the job it depends on, as long as there is room, so
+    short chains run within one task. Otherwise it goes into a task that
+    waits for the same tasks. Tasks waiting for the same tasks form one
+    job array.
+
+    Returns a list of dicts, holding the job inputs of every task and the
+    (array, task) indices of the tasks the array depends on. The arrays
+    are in submission order."""
+    tasks = list()
+    open_tasks = dict()
+    location = dict()
+    for job_input in job_inputs:
+        # Parents that are not in job_inputs, e.g. already finished jobs,
+        # are not waited for.
+        parents = [parent
+                   for parent in job_deps.get(job_input, dict()).get("after", [])
+                   if parent in location]
+        parent_tasks = tuple(sorted(set([location[parent]
+                                         for parent in parents])))
+        if (len(parent_tasks) == 1) \
+           and (len(tasks[parent_tasks[0]]["jobs"]) < pack):
+            task_ind = parent_tasks[0]
+        else:
+            task_ind = open_tasks.get(parent_tasks)
+            if (task_ind is None) or (len(tasks[task_ind]["jobs"]) == pack):
+                task_ind = len(tasks)
+                tasks.append({"jobs": list(), "after": parent_tasks})
+                open_tasks[parent_tasks] = task_ind
+        tasks[task_ind]["jobs"].append(job_input)
+        location[job_input] = task_ind
+
+    arrays = list()
+    array_inds = dict()
+    task_location = dict()
+    for task_ind, task in enumerate(tasks):
+        if task["after"] not in array_inds:
+            array_inds[task["after"]] = len(arrays)
+            arrays.append({
+                "tasks": list(),
+                "after": [task_location[after] for after in task["after"]],
+            })
+        array_ind = array_inds[task["after"]]
+        task_location[task_ind] = (array_ind, len(arrays[array_ind]["tasks"]))
+        arrays[array_ind]["tasks"].append(task["jobs"])
+    return arrays
+
+
+class Backend:
+    """Runs the job inputs of a grid on a batch system, by submitting
+    job arrays that depend on each other."""
+
+    tpl_fn = None
+    submit_cmd = None
+    queue_cmd = None
+
+    def __init__(self, cpus=1, pack=1, batch_opts=None, env_script=None,
+                 run_args="", batch_dir=BATCH_DIR, poll=60.):
+        self.cpus = cpus
+        self.pack = pack
+        self.batch_opts = batch_opts if batch_opts else list()
+        self.env_script = env_script
+        self.run_args = run_args
+        self.batch_dir = Path(batch_dir)
+        self.poll = poll
+        self.tpl = ENV.get_template(self.tpl_fn)
+
+    def array_args(self, num):
+        raise NotImplementedError
+
+    def dependency_args(self, job_ids):
+        raise NotImplementedError
+
+    def submit(self, script, num, after):
+        """Submit script as array with 'num' tasks. 'after' holds the IDs
+        of the array jobs and task indices to wait for."""
+        args = [self.submit_cmd, ] + self.array_args(num) \
+               + self.dependency_args(after) + [str(script), ]
+        output = subprocess.check_output(args, text=True)
+        return self.parse_job_id(output)
+
+    def parse_job_id(self, output):
+        return output.strip()
+
+    def queued(self, job_ids):
+        """IDs of the jobs that are still queued or running."""
+        raise NotImplementedError
+
+    def run(self, job_inputs, job_deps, deps_fn=None, name="mcgrid"):
+        """Submit the jobs. The array tasks read 'job_deps' from 'deps_fn'.
+        Without it, they are written to the batch folder."""
+        arrays = pack_jobs(job_inputs, job_deps, self.pack)
+        try:
+            os.mkdir(self.batch_dir)
+        except FileExistsError:
+            pass
+        cwd = Path(os.getcwd())
+        if deps_fn is None:
+            deps_fn = self.batch_dir / DEPS_FN
+            with open(deps_fn, "w") as handle:
+                yaml.dump(job_deps, handle)
+        deps_fn = Path(deps_fn).resolve()
+        env_script = Path(self.env_script).resolve() if self.env_script \
+                     else None
+
+        job_ids = list()
+        for i, array in enumerate(arrays):
+            array_name = f"{name}_{i:03d}"
+            for j, task in enumerate(array["tasks"]):
+                with open(self.batch_dir / f"{array_name}_task_{j}", "w") \
+                     as handle:
+                    handle.write("\n".join(task))
+            script = self.tpl.render(
+                name=array_name,
+                cpus=self.cpus,
+                batch_opts=self.batch_opts,
+                cwd=cwd,
+                env_script=env_script,
+                batch_dir=self.batch_dir.resolve(),
+                deps_fn=deps_fn,
+                run_args=self.run_args,
+            )
+            script_fn = self.batch_dir / f"{array_name}.sh"
+            with open(script_fn, "w") as handle:
+                handle.write(script)
+            after = [(job_ids[array_ind], task_ind)
+                     for array_ind, task_ind in array["after"]]
+            job_id = self.submit(script_fn, len(array["tasks"]), after)
+            job_ids.append(job_id)
+            print(f"Submitted '{script_fn}' with {len(array['tasks'])} "
+                  f"task(s) as job {job_id}.")
+        return job_ids
+
+    def wait(self, job_ids):
+        while True:
+            queued = self.queued(job_ids)
+            if not queued:
+                break
+            print(f"{len(queued)} of {len(job_ids)} job arrays are queued "
+                   "or running.")
+            time.sleep(self.poll)
+
+
+class SlurmBackend(Backend):
+
+    tpl_fn = "slurm.sh.tpl"
+    submit_cmd = "sbatch"
+    queue_cmd = "squeue"
+
+    def array_args(self, num):
+        return ["--parsable", f"--array=0-{num-1}"]
+
+    def dependency_args(self, after):
+        if not after:
+            return list()
+        # SLURM can wait for single tasks of an array, so a column only
+        # waits for the task that computes its seed.
+        deps = ":".join([f"{job_id}_{task}" for job_id, task in after])
+        return [f"--dependency=afterok:{deps}", "--kill-on-invalid-dep=yes"]
+
+    def parse_job_id(self, output):
+        # --parsable prints 'jobid[;cluster]'
+        return output.strip().split(";")[0]
+
+    def queued(self, job_ids):
+        # squeue fails for jobs that already left the queue, so its return
+        # code is not checked.
+        proc = subprocess.run(
+            [self.queue_cmd, "-h", "-o", "%F", "-j", ",".join(job_ids)],
+            text=True, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+        )
+        return sorted(set(proc.stdout.split()) & set(job_ids))
+
+
+class PBSBackend(Backend):
+
+    tpl_fn = "pbs.sh.tpl"
+    submit_cmd = "qsub"
+    queue_cmd = "qstat"
+
+    def array_args(self, num):
+        # PBS does not allow arrays with only one subjob.
+        return ["-J", f"0-{num-1}"] if num > 1 else list()
+
+    def dependency_args(self, after):
+        if not after:
+            return list()
+        # PBS can only wait for complete arrays.
+        job_ids = sorted(set([job_id for job_id, _ in after]))
+        return ["-W", f"depend=afterok:{':'.join(job_ids)}"]
+
+    def queued(self, job_ids):
+        proc = subprocess.run([self.queue_cmd, ] + job_ids, text=True,
+                              stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL)
+        return [job_id for job_id in job_ids
+                if re.search(re.escape(job_id.split(".")[0]), proc.stdout)]
+
+
+BACKENDS = {
+    "slurm": SlurmBackend,
+    "pbs": PBSBackend,
+}
+
+
+def run_args_from(args):
+    """Options of mcgridrun that are passed on to the array tasks."""
+    run_args = ["--poll", str(args.poll), "--retries", str(args.retries),
+                "--min-free", str(args.min_free)]
+    if args.resume:
+        run_args += ["--resume", ]
+    if args.scale_cores:
+        run_args += ["--scale-cores", args.scale_cores]
+    for dir_ in (args.scratch or list()):
+        run_args += ["--scratch", dir_]
+    if args.stream_out:
+        run_args += ["--stream-out", ]
+    if args.speculate:
+        run_args += ["--speculate", "--spec-de", str(args.spec_de),
+                     "--spec-dci", str(args.spec_dci)]
+    for opt in ("timeout", "stall", "point_factor", "cutoff", "rise",
+                "max_load", "job_mem", "mem_budget", "jump", "max_iter",
+                "steps"):
+        value = getattr(args, opt)
+        if value is not None:
+            run_args += [f"--{opt.replace('_', '-')}", str(value)]
+    for fn in (args.timings or list()):
+        run_args += ["--timings", str(Path(fn).resolve())]
+    if args.cache:
+        run_args += ["--cache", str(Path(args.cache).resolve())]
+    return " ".join([shlex.quote(arg) for arg in run_args])
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+
+import argparse
+from collections import Counter
+import hashlib
+import json
+import os
+from pathlib import Path
+import shutil
+import sqlite3
+import sys
+import time
+
+from mcgridprep.admission import parse_mem
+
+
+CACHE_FN = "mcgrid_cache.sqlite"
+LOG_EXT = ".log"
+# Orbital types in the #INDEX section of an orbital file
+ORB_TYPES = "fi123sd"
+
+
+def orbital_index(fn):
+    """Active space of an orbital file, from its #INDEX section: the number
+    of frozen, inactive, RAS1/2/3, secondary and deleted orbitals in every
+    irrep. The order of the orbitals is left out, as RASSCF sorts them by
+    type. Empty, when the file or the section is missing."""
+    try:
+        with open(fn) as handle:
+            lines = handle.read().split("\n")
+        start = lines.index("#INDEX") + 1
+    except (FileNotFoundError, ValueError):
+        return ""
+    irreps = list()
+    for line in lines[start:]:
+        if line.startswith("#"):
+            break
+        if line.startswith("*"):
+            irreps.append(Counter())
+        elif irreps:
+            # Lines hold a row number and the types, e.g. '0 i2222222ss'.
+            irreps[-1].update("".join(line.split()[1:]).lower())
+    return " ".join(["/".join([str(irrep[type_]) for type_ in ORB_TYPES])
+                     for irrep in irreps])
+
+
+def point_key(block, index=""):
+    """Hash of the input of one point: geometry, basis, charge, spin, ciroot
+    and the method blocks. Lines for the emil interpreter ('>>') hold the ID
+    and the paths of the point, which differ between projects, so they are
+    left out, as are blank lines and indentation at the end of lines.
+
+    The active space is not part of the input, but taken from the #INDEX
+    section of the starting orbitals, so it is given as 'index', see
+    orbital_index."""
+    lines = [line.rstrip() for line in block.strip().split("\n")
+             if line.strip() and not line.lstrip().startswith(">>")]
+    if index:
+        lines.append(f"#INDEX {index}")
+    return hashlib.sha256("\n".join(lines).encode()).hexdigest()
+
+
+class ResultCache:
+    """Results of points, shared between projects and keyed by point_key.
+
+    Every entry is a folder with the artifacts of the point from the backup
+    path, e.g. its RasOrb and HDF5 files, and its section of the OpenMolcas
+    log. The energy, the size and the time of the last use of every entry
+    are kept in a SQLite database in the cache folder."""
+
+    def __init__(self, cache_dir):
+        self.cache_dir = Path(cache_dir)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.con = sqlite3.connect(self.cache_dir / CACHE_FN, timeout=60)
+        self.con.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                exts TEXT,
+                energy REAL,
+                size INTEGER,
+                created REAL,
+                used REAL
+            )"""
+        )
+        self.con.commit()
+
+    def entry_dir(self, key):
+        return self.cache_dir / key[:2] / key
+
+    def get(self, key, touch=True):
+        cur = self.con.execute(
+            "SELECT exts, energy, size, created, used FROM entries WHERE key=?",
+            (key, )
+        )
+        row = cur.fetchone()
+        if row is None:
+            return None
+        entry = dict(zip(("exts", "energy", "size", "created", "used"), row))
+        entry["exts"] = json.loads(entry["exts"])
+        if touch:
+            with self.con:
+                self.con.execute("UPDATE entries SET used=? WHERE key=?",
+                                 (time.time(), key))
+        return entry
+
+    def store(self, key, id_, artifacts, energy=None, log=None):
+        """Store the artifacts of the point 'id_', named '{id_}.*', and its
+        log. Points that are already in the cache are kept as they are."""
+        if self.get(key, touch=False) is not None:
+            return False
+        entry_dir = self.entry_dir(key)
+        # Copy to a temporary folder first, so other projects never find
+        # an incomplete entry.
+        tmp_dir = Path(f"{entry_dir}.{os.getpid()}")
+        os.makedirs(tmp_dir)
+        exts = list()
+        for fn in artifacts:
+            ext = Path(fn).name[len(id_):]
+            shutil.copy(fn, tmp_dir / f"point{ext}")
+            exts.append(ext)
+        if log:
+            with open(tmp_dir / f"point{LOG_EXT}", "w") as handle:
+                handle.write(log)
+            exts.append(LOG_EXT)
+        size = sum([os.path.getsize(fn) for fn in tmp_dir.iterdir()])
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        os.rename(tmp_dir, entry_dir)
+        now = time.time()
+        with self.con:
+            self.con.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?)",
+                (key, json.dumps(exts), energy, size, now, now)
+            )
+        return True
+
+    def restore(self, key, backup_path, id_, out_path=None):
+        """Copy the artifacts of a cached point to backup_path, named after
+        'id_', and its log to out_path. Returns the entry or None, when the
+        point is not cached."""
+        entry = self.get(key)
+        if entry is None:
+            return None
+        entry_dir = self.entry_dir(key)
+        for ext in entry["exts"]:
+            if ext == LOG_EXT:
+                if out_path is not None:
+                    shutil.copy(entry_dir / f"point{ext}",
+                                Path(out_path) / f"cached_{id_}.out")
+                continue
+            shutil.copy(entry_dir / f"point{ext}",
+                        Path(backup_path) / f"{id_}{ext}")
+        return entry
+
+    def size(self):
+        """Number of entries and their size in bytes."""
+        cur = self.con.execute("SELECT COUNT(*), SUM(size) FROM entries")
+        num, size = cur.fetchone()
+        return num, size or 0
+
+    def evict(self, max_size=None, max_age=None):
+        """Delete entries that were not used for 'max_age' seconds and then
+        the least recently used entries, until the cache is at most
+        'max_size' bytes large. Returns the number of deleted entries and
+        the bytes freed."""
+        cur = self.con.execute("SELECT key, size, used FROM entries "
+                               "ORDER BY used")
+        entries = cur.fetchall()
+        _, total = self.size()
+        now = time.time()
+        evicted = list()
+        for key, size, used in entries:
+            too_old = (max_age is not None) and (now - used > max_age)
+            too_large = (max_size is not None) and (total > max_size)
+            if not (too_old or too_large):
+                continue
+            evicted.append(key)
+            total -= size
+        freed = 0
+        for key in evicted:
+            freed += self.get(key, touch=False)["size"]
+            with self.con:
+                self.con.execute("DELETE FROM entries WHERE key=?", (key, ))
+            shutil.rmtree(self.entry_dir(key), ignore_errors=True)
+        return len(evicted), freed
+
+    def close(self):
+        self.con.close()
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(
+        description="Show the size of a result cache and evict old entries."
+    )
+
+    parser.add_argument("cache_dir")
+    parser.add_argument("--max-size", default=None,
+        help="Delete the least recently used entries until the cache is at "
+             "most this large, e.g. '50G'. Plain numbers are in MB."
+    )
+    parser.add_argument("--max-age", type=float, default=None,
+        help="Delete entries that were not used for this many days."
+    )
+
+    return parser.parse_args(args)
+
+
+def run():
+    args = parse_args(sys.argv[1:])
+
+    cache = ResultCache(args.cache_dir)
+    num, size = cache.size()
+    print(f"Cache '{args.cache_dir}' holds {num} points, {size/1024**2:.1f} MB.")
+    max_size = None
+    if args.max_size is not None:
+        max_size = parse_mem(args.max_size) * 1024**2
+    max_age = None
+    if args.max_age is not None:
+        max_age = args.max_age * 24 * 3600
+    if (max_size is not None) or (max_age is not None):
+        evicted, freed = cache.evict(max_size, max_age)
+        print(f"Evicted {evicted} points, freed {freed/1024**2:.1f} MB.")
+    cache.close()
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+
+import argparse
+import asyncio
+from functools import partial
+import os
+from pathlib import Path
+import sys
+
+from mcgridprep.cost import CostModel
+from mcgridprep.ledger import Ledger, LEDGER_FN, FAILED, TIMEOUT
+from mcgridprep.run import barrier_deps, chain_lengths, job_ids, \
+                           load_job_deps, minutes, resume_jobs, run_dag, \
+                           run_job
+
+
+POLICIES = ("fair", "priority")
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(
+        description="Run the grids of several projects on one pool of cores."
+    )
+
+    parser.add_argument("projects", nargs="+",
+        help="Folders mcgridprep was run in. A weight can be appended after "
+             "a colon, e.g. 'tz:2'. The default weight is 1."
+    )
+    parser.add_argument("--cpus", type=int, default=1,
+        help="Number of jobs of all projects at a time."
+    )
+    parser.add_argument("--policy", choices=POLICIES, default="fair",
+        help="With 'fair' every project gets a share of the cores in "
+             "proportion to its weight, as long as it has jobs ready. With "
+             "'priority' the ready jobs of the project with the highest "
+             "weight are always started first. Cores a project can't use go "
+             "to the other projects in both cases."
+    )
+    parser.add_argument("--poll", type=float, default=5.,
+        help="Interval in seconds to check for finished jobs and seed files."
+    )
+    parser.add_argument("--resume", action="store_true",
+        help="Skip points that already finished successfully according to "
+             "the ledgers of the projects."
+    )
+    parser.add_argument("--retries", type=int, default=0,
+        help="Number of alternative starting orbitals tried for a failed "
+             "point, see mcgridrun."
+    )
+    parser.add_argument("--scale-cores", choices=("omp", "mpi"), default=None,
+        help="Split free cores between the remaining jobs, see mcgridrun."
+    )
+    parser.add_argument("--scratch", action="append", default=None,
+        help="Directory the jobs are run in, see mcgridrun."
+    )
+    parser.add_argument("--timeout", type=float, default=None,
+        help="Wall time in minutes after which a job is killed."
+    )
+
+    return parser.parse_args(args)
+
+
+def parse_project(spec):
+    """Folder and weight of a project given as 'folder[:weight]'."""
+    root, _, weight = spec.rpartition(":")
+    try:
+        weight = float(weight)
+    except ValueError:
+        root, weight = spec, 1.
+    if weight <= 0:
+        raise ValueError(f"The weight of '{root}' must be positive.")
+    return Path(root).resolve(), weight
+
+
+def load_project(root):
+    """Job inputs and dependencies of a project. The job inputs are given
+    with their full path, so the jobs of several projects can be told
+    apart in one DAG."""
+    job_inputs_fn = root / "job_inputs"
+    with open(job_inputs_fn) as handle:
+        names = handle.read().strip().split("\n")
+    job_deps = load_job_deps(job_inputs_fn)
+    if job_deps is None:
+        job_deps = barrier_deps(names)
+    full = lambda name: str(root / name)
+    job_inputs = [full(name) for name in names]
+    job_deps = {
+        full(name): dict(deps, after=[full(parent) for parent in
+                                      deps.get("after", list())])
+        for name, deps in job_deps.items()
+    }
+    return job_inputs, job_deps
+
+
+def project_costs(job_inputs, points, cost_model):
+    """Predicted runtime of every job of a project from its own timings, as
+    the points of different projects share their IDs."""
+    return {job_input: cost_model.job_cost(points[job_input])
+            for job_input in job_inputs}
+
+
+def fair_order(groups, weights, lengths):
+    """Order pending jobs by the cores their project uses relative to its
+    weight, and then by the length of the chains they head."""
+    def order(pending, cores):
+        usage = {group: 0 for group in weights}
+        for job_input, threads in cores.items():
+            usage[groups[job_input]] += threads
+        return sorted(pending, key=lambda job_input: (
+            usage[groups[job_input]] / weights[groups[job_input]],
+            -lengths[job_input]
+        ))
+    return order
+
+
+def priority_order(groups, weights, lengths):
+    """Order pending jobs by the weight of their project, and then by the
+    length of the chains they head."""
+    def order(pending, cores):
+        return sorted(pending, key=lambda job_input: (
+            -weights[groups[job_input]], -lengths[job_input]
+        ))
+    return order
+
+
+ORDERS = {
+    "fair": fair_order,
+    "priority": priority_order,
+}
+
+
+def run():
+    args = parse_args(sys.argv[1:])
+
+    job_inputs = list()
+    job_deps = dict()
+    groups = dict()
+    weights = dict()
+    parts = dict()
+    ledgers = dict()
+    finished = set()
+    run_inputs = dict()
+    ready_files = set()
+    job_ledgers = dict()
+    projects = dict()
+    costs = dict()
+    for spec in args.projects:
+        root, weight = parse_project(spec)
+        project_inputs, project_deps = load_project(root)
+        os.makedirs(root / "out", exist_ok=True)
+        ledger = Ledger(root / LEDGER_FN)
+        for job_input in project_inputs:
+            ledger.register(job_input, job_ids(job_input, project_deps))
+        seeds = dict()
+        for deps in project_deps.values():
+            seeds.update(deps.get("seeds", dict()))
+        parts[root] = partial(run_job, save_path=root / "out", ledger=ledger,
+                              poll=args.poll, seeds=seeds,
+                              retries=args.retries, scratch=args.scratch,
+                              timeout=minutes(args.timeout))
+        if args.resume:
+            done, resumed, ready = resume_jobs(project_inputs, project_deps,
+                                               ledger)
+            finished |= done
+            run_inputs.update(resumed)
+            ready_files |= ready
+        # The points every job computes, after resuming
+        points = {job_input: job_ids(run_inputs.get(job_input, job_input),
+                                     project_deps)
+                  for job_input in project_inputs}
+        cost_model = CostModel.from_ledgers([ledger, ])
+        costs.update(project_costs(project_inputs, points, cost_model))
+        projects[root] = (project_inputs, points, cost_model)
+        num_points = sum([len(ids) for ids in points.values()])
+        print(f"Project '{root}' with weight {weight}: {len(project_inputs)} "
+              f"jobs, {num_points} points.")
+        job_inputs.extend(project_inputs)
+        job_deps.update(project_deps)
+        groups.update({job_input: root for job_input in project_inputs})
+        weights[root] = weight
+        ledgers[root] = ledger
+        job_ledgers.update({job_input: ledger
+                            for job_input in project_inputs})
+
+    async def run_part(job_input, **kwargs):
+        # Resumed and retried inputs are written next to the original ones.
+        return await parts[Path(job_input).parent](job_input, **kwargs)
+
+    lengths = chain_lengths(job_inputs, job_deps, costs)
+    job_order = ORDERS[args.policy](groups, weights, lengths)
+
+    def on_done(job_input, result):
+        # Learn from the timings of the project the job belongs to.
+        root = groups[job_input]
+        project_inputs, points, cost_model = projects[root]
+        cost_model.update(ledgers[root].durations())
+        costs.update(project_costs(project_inputs, points, cost_model))
+        lengths.update(chain_lengths(job_inputs, job_deps, costs))
+
+    print(f"Running {len(job_inputs)} jobs of {len(weights)} projects with "
+          f"{args.cpus} jobs at a time and the '{args.policy}' policy.")
+    try:
+        asyncio.run(
+            run_dag(job_inputs, job_deps, args.cpus, run_part,
+                    poll=args.poll, finished=finished, run_inputs=run_inputs,
+                    ready_files=ready_files, scale_cores=args.scale_cores,
+                    job_order=job_order, on_done=on_done,
+                    ledgers=job_ledgers)
+        )
+    except KeyboardInterrupt:
+        print("Interrupted. Killed all running jobs. Continue with --resume.")
+    else:
+        print("Finished all calculations.")
+
+    failed = False
+    for root, ledger in ledgers.items():
+        counts = ledger.counts()
+        print(f"State of the points of '{root}': {counts}")
+        failed |= bool(counts.get(FAILED, 0) or counts.get(TIMEOUT, 0))
+        ledger.close()
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    run()
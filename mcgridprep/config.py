@@ -11,6 +11,9 @@ DEFAULTS = {
     "ciroot": None,
     "name": None,
     "inporb": None,
+    "seeds": None,
+    "points": None,
+    "regions": None,
     "id_fmt": "{:.2f}_{:.2f}",
     "coord1_lbl": "",
     "coord2_lbl": "",
@@ -34,7 +37,7 @@ def load_yaml():
 
     try:
         with open(yaml_path) as handle:
-            from_yaml = yaml.load(handle)
+            from_yaml = yaml.safe_load(handle)
     except:
         logging.exception(f"Tried to read parameters from '{yaml_fn}' "
                            "but something went wrong. Exiting!")
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+
+import heapq
+from pathlib import Path
+
+import numpy as np
+
+
+def id_coords(id_):
+    """Grid coordinates of a point ID like '101.00_0.95' or None, when
+    the ID has another format."""
+    try:
+        return tuple([float(coord) for coord in id_.split("_")])
+    except ValueError:
+        return None
+
+
+class CostModel:
+    """Estimates the runtime of every point from the timings of points
+    that already ran, e.g. in a previous or the current run.
+
+    A point without a timing gets the timing of the nearest timed point on
+    the grid, so columns at large bond lengths, that take longer to
+    converge, are recognized as expensive as soon as their seed points on
+    the equilibrium row ran. Without any timings every point costs one
+    unit and the cost of a job is its number of points."""
+
+    def __init__(self, durations=None):
+        self.durations = dict()
+        self.update(durations if durations else dict())
+
+    @classmethod
+    def from_ledgers(cls, ledgers):
+        durations = dict()
+        for ledger in ledgers:
+            durations.update(ledger.durations())
+        return cls(durations)
+
+    def update(self, durations):
+        self.durations.update(durations)
+        timed = [(id_coords(id_), duration)
+                 for id_, duration in self.durations.items()]
+        timed = [(coords, duration) for coords, duration in timed
+                 if (coords is not None) and (len(coords) == 2)]
+        self.coords = np.array([coords for coords, _ in timed]).reshape(-1, 2)
+        self.timings = np.array([duration for _, duration in timed])
+        # Bring both coordinates to a similar scale, so an angle in degree
+        # does not dominate a bond length in Å.
+        ranges = np.ptp(self.coords, axis=0) if len(timed) else np.ones(2)
+        self.scale = np.where(ranges > 0, ranges, 1.)
+        self.mean = np.mean(list(self.durations.values())) \
+                    if self.durations else 1.
+
+    @property
+    def timed(self):
+        return bool(self.durations)
+
+    def point_cost(self, id_):
+        try:
+            return self.durations[id_]
+        except KeyError:
+            pass
+        coords = id_coords(id_)
+        if (coords is None) or (len(coords) != 2) or (len(self.timings) == 0):
+            return self.mean
+        dists = np.linalg.norm((self.coords - coords) / self.scale, axis=1)
+        return self.timings[dists.argmin()]
+
+    def job_cost(self, ids):
+        return sum([self.point_cost(id_) for id_ in ids])
+
+
+def seed_id(fn):
+    """ID of the point a seed RasOrb belongs to."""
+    name = Path(fn).name
+    return name[:-len(".RasOrb")] if name.endswith(".RasOrb") else None
+
+
+def schedule_jobs(job_inputs, job_deps, points, model, cpus, priority,
+                  finished=()):
+    """Replay the runner with 'cpus' jobs at a time and the point costs
+    from 'model'.
+
+    Whenever a job finishes, the ready jobs with the highest 'priority' are
+    started. Like in the runner, a job is ready when all its parents
+    finished or when its seed RasOrbs were written. 'points' holds the IDs
+    of the points every job computes. Every job runs on one core.
+
+    Returns the start and end times of all jobs that were run."""
+    finished = set(finished)
+    # Time from the start of a job until each of its points is finished
+    offsets = dict()
+    costs = dict()
+    for job_input in job_inputs:
+        offsets[job_input] = dict()
+        cost = 0.
+        for id_ in points[job_input]:
+            cost += model.point_cost(id_)
+            offsets[job_input][id_] = cost
+        costs[job_input] = cost
+    produced_by = {id_: job_input for job_input in job_inputs
+                   for id_ in points[job_input]}
+    starts = dict()
+    ends = dict()
+
+    def ready_time(job_input):
+        deps = job_deps.get(job_input, dict())
+        after = [parent for parent in deps.get("after", list())
+                 if (parent in offsets) and (parent not in finished)]
+        if not after:
+            return 0.
+        parent_ends = [ends.get(parent) for parent in after]
+        ready = [max(parent_ends)] if None not in parent_ends else list()
+        needs = deps.get("needs", list())
+        landed = list()
+        for fn in needs:
+            parent = produced_by.get(seed_id(fn))
+            if (parent is None) or (parent in finished):
+                landed.append(0.)
+            elif parent in starts:
+                landed.append(starts[parent] + offsets[parent][seed_id(fn)])
+            else:
+                landed.append(None)
+        if needs and (None not in landed):
+            ready.append(max(landed))
+        return min(ready) if ready else None
+
+    pending = sorted([job_input for job_input in job_inputs
+                      if job_input not in finished],
+                     key=lambda job_input: -priority[job_input])
+    running = list()
+    now = 0.
+    while pending or running:
+        for job_input in list(pending):
+            if len(running) == cpus:
+                break
+            ready = ready_time(job_input)
+            if (ready is not None) and (ready <= now):
+                starts[job_input] = now
+                heapq.heappush(running, (now + costs[job_input], job_input))
+                pending.remove(job_input)
+        ready = [ready_time(job_input) for job_input in pending]
+        events = [end for end, _ in running] \
+                 + [time for time in ready if (time is not None) and (time > now)]
+        if not events:
+            break
+        now = min(events)
+        while running and (running[0][0] <= now):
+            end, job_input = heapq.heappop(running)
+            ends[job_input] = end
+    return starts, ends
+
+
+def predict_makespan(*args, **kwargs):
+    """Predict the wall time to run the job inputs. All arguments are
+    passed on to schedule_jobs."""
+    _, ends = schedule_jobs(*args, **kwargs)
+    return max(ends.values(), default=0.)
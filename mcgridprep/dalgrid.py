@@ -1,22 +1,24 @@
 #!/usr/bin/env python3
 
 import argparse
+import asyncio
 from collections import Counter
+from functools import partial
 import itertools as it
-import multiprocessing
 from pathlib import Path
 from pprint import pprint
 import os
 import shutil
-import subprocess
 import sys
 import time
 
 import numpy as np
 
 from mcgridprep.config import config as CONF
+from mcgridprep.admission import parse_mem
 from mcgridprep.elements import ELEMENTS
 from mcgridprep.main import setup_2d_scan, make_xyzs
+from mcgridprep.run import kill_job, place_file, run_dag
 from mcgridprep.templates import ENV
 
 MOL_TPL = ENV.get_template("dalton.mol.tpl")
@@ -29,8 +31,22 @@ def parse_args(args):
     parser = argparse.ArgumentParser()
 
     parser.add_argument("--run", action="store_true")
-    parser.add_argument("--cpus", type=int, default=4)
-    parser.add_argument("--mem", type=int, default=2000)
+    parser.add_argument("--cpus", type=int, default=4,
+        help="Number of Dalton calculations run at a time."
+    )
+    parser.add_argument("--mem", type=int, default=2000,
+        help="Memory in MB of every Dalton calculation."
+    )
+    parser.add_argument("--mem-budget", default=None,
+        help="Memory in MB (or with a unit, e.g. '64Gb') for all Dalton "
+             "calculations together, instead of --mem. Every calculation "
+             "gets its share as -mb. Memory freed by finished calculations "
+             "goes to the ones started later."
+    )
+    parser.add_argument("--omp", type=int, default=None,
+        help="Number of OpenMP threads of every Dalton calculation."
+    )
+    parser.add_argument("--poll", type=float, default=5.)
 
     return parser.parse_args(args)
 
@@ -156,7 +172,19 @@ def prepare_job_dirs():
     return job_dict
 
 
-def run_job(job_dir, prev_job_dir=None, reuse_path=None):
+def job_deps_for(job_dict, reuse=False):
+    """Every point depends on the point it starts from. When SIRIUS.RST
+    files from a previous grid are reused, all points can start at once."""
+    job_deps = dict()
+    for jobs, prev_jobs in job_dict.values():
+        for job, prev_job in zip(jobs, prev_jobs):
+            after = [prev_job, ] if (prev_job and not reuse) else list()
+            job_deps[job] = {"after": after, "ids": [job, ]}
+    return job_deps
+
+
+async def run_job(job_dir, prev_job_dir=None, reuse_path=None, mem=2000,
+                  omp=None, env=None):
     start = time.time()
     print(f"Running {job_dir}")
     if reuse_path:
@@ -170,10 +198,23 @@ def run_job(job_dir, prev_job_dir=None, reuse_path=None):
     cur_path = Path(job_dir).resolve()
     prev_path = Path(prev_job_dir).resolve()
     prev_sirius = prev_path / "SIRIUS.RST"
-    shutil.copy(prev_sirius, cur_path)
-    args = f"dalton -mb {MEM} -put SIRIUS.RST -get SIRIUS.RST {DAL_FN} {MOL_FN}".split()
-    proc = subprocess.Popen(args, cwd=cur_path)
-    proc.wait()
+    # SIRIUS.RST is replaced, not overwritten, after the calculation, so
+    # a hardlink to the previous file is enough.
+    place_file(prev_sirius, cur_path / "SIRIUS.RST")
+    omp_str = f"-omp {omp} " if omp else ""
+    args = (f"dalton -mb {int(mem)} {omp_str}-put SIRIUS.RST -get SIRIUS.RST "
+            f"{DAL_FN} {MOL_FN}").split()
+    proc_env = os.environ.copy()
+    if env:
+        proc_env.update(env)
+    proc = await asyncio.create_subprocess_exec(
+        *args, cwd=cur_path, env=proc_env, start_new_session=True
+    )
+    try:
+        await proc.wait()
+    except asyncio.CancelledError:
+        await kill_job(proc)
+        raise
     end = time.time()
     duration = end - start
     mins = duration / 60
@@ -182,21 +223,14 @@ def run_job(job_dir, prev_job_dir=None, reuse_path=None):
     shutil.move(cur_sirius, cur_path / "SIRIUS.RST")
 
 
-def run_part(args):
-    job_dirs, prev_job_dirs = args
-    reuse_path = None
-    if CONF["dal_reuse"]:
-        reuse_path = Path(CONF["dal_reuse"])
-    for job_dir, prev_dir in zip(job_dirs, prev_job_dirs):
-        run_job(job_dir, prev_dir, reuse_path=reuse_path)
+async def run_part(job_dir, prev_job_dirs, env=None, **kwargs):
+    await run_job(job_dir, prev_job_dirs[job_dir], env=env, **kwargs)
 
 
 def run():
     args = parse_args(sys.argv[1:])
 
     cpus = args.cpus
-    global MEM
-    MEM = args.mem
 
     job_dict = prepare_job_dirs()
     print(job_dict)
@@ -207,13 +241,27 @@ def run():
 
     if args.run:
         start = time.time()
-        left_right = (job_dict["left"], job_dict["right"])
-        with multiprocessing.Pool(2) as pool:
-            pool.map(run_part, left_right)
-
-        cols = [v for k, v in job_dict.items() if k not in ("left", "right")]
-        with multiprocessing.Pool(cpus) as pool:
-            pool.map(run_part, cols)
+        reuse_path = None
+        if CONF["dal_reuse"]:
+            reuse_path = Path(CONF["dal_reuse"])
+        # Every point is a job of its own, so a column starts as soon as
+        # its seed point on the equilibrium row is done.
+        job_dirs = list()
+        prev_job_dirs = dict()
+        for jobs, prev_jobs in job_dict.values():
+            job_dirs.extend(jobs)
+            prev_job_dirs.update(zip(jobs, prev_jobs))
+        job_deps = job_deps_for(job_dict, reuse=reuse_path is not None)
+        mem_budget = parse_mem(args.mem_budget) if args.mem_budget else None
+        part = partial(run_part, prev_job_dirs=prev_job_dirs,
+                       reuse_path=reuse_path, mem=args.mem, omp=args.omp)
+        try:
+            asyncio.run(
+                run_dag(job_dirs, job_deps, cpus, part, poll=args.poll,
+                        mem_budget=mem_budget)
+            )
+        except KeyboardInterrupt:
+            print("Interrupted. Killed all running calculations.")
         end = time.time()
         duration = end - start
         print(f"Calculations took {duration/60:.1f} min.")
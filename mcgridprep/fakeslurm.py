@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+
+"""Minimal local stand-in for SLURM's sbatch and squeue.
+
+Meant for testing the SLURM backend of mcgridrun without a cluster.
+Submitted jobs are recorded in $FAKESLURM_DIR (default: ./.fakeslurm).
+Array tasks are run right away, one after another, unless FAKESLURM_RUN=0
+is set. Then all jobs stay pending and show up in squeue. Jobs whose
+afterok dependencies are not completed are never run.
+
+    python -m mcgridprep.fakeslurm sbatch --parsable --array=0-3 job.sh
+    python -m mcgridprep.fakeslurm squeue -h -o %F -j 1,2
+"""
+
+import argparse
+import os
+from pathlib import Path
+import re
+import subprocess
+import sys
+
+import yaml
+
+
+PENDING = "PENDING"
+COMPLETED = "COMPLETED"
+FAILED = "FAILED"
+DEPENDENCY = "DependencyNeverSatisfied"
+
+
+def state_dir():
+    dir_ = Path(os.environ.get("FAKESLURM_DIR", ".fakeslurm"))
+    dir_.mkdir(parents=True, exist_ok=True)
+    return dir_
+
+
+def load_jobs():
+    jobs = dict()
+    for fn in sorted(state_dir().glob("*.yaml"), key=lambda fn: int(fn.stem)):
+        with open(fn) as handle:
+            jobs[fn.stem] = yaml.safe_load(handle)
+    return jobs
+
+
+def save_job(job_id, job):
+    with open(state_dir() / f"{job_id}.yaml", "w") as handle:
+        yaml.dump(job, handle)
+
+
+def dependencies_met(job, jobs):
+    """True/False if the dependencies are (not) met and None if they may
+    still be met later."""
+    met = True
+    for dep in job["dependency"]:
+        dep_job_id, _, task = dep.partition("_")
+        dep_job = jobs.get(dep_job_id)
+        if dep_job is None:
+            return False
+        states = dep_job["tasks"]
+        if task:
+            states = {task: states[task]}
+        if any([state in (FAILED, DEPENDENCY) for state in states.values()]):
+            return False
+        if any([state == PENDING for state in states.values()]):
+            met = None
+    return met
+
+
+def cpus_per_task(script):
+    with open(script) as handle:
+        mobj = re.search("^#SBATCH --cpus-per-task=(\d+)", handle.read(),
+                         re.MULTILINE)
+    return mobj[1] if mobj else "1"
+
+
+def run_job(job_id, job, jobs):
+    met = dependencies_met(job, jobs)
+    if met is None:
+        return
+    for task in job["tasks"]:
+        if not met:
+            job["tasks"][task] = DEPENDENCY
+            continue
+        env = os.environ.copy()
+        env.update({
+            "SLURM_JOB_ID": job_id,
+            "SLURM_ARRAY_JOB_ID": job_id,
+            "SLURM_ARRAY_TASK_ID": task,
+            "SLURM_CPUS_PER_TASK": cpus_per_task(job["script"]),
+        })
+        out_fn = Path(job["cwd"]) / f"slurm-{job_id}_{task}.out"
+        with open(out_fn, "w") as handle:
+            proc = subprocess.run(["bash", job["script"]], cwd=job["cwd"],
+                                  env=env, stdout=handle,
+                                  stderr=subprocess.STDOUT)
+        job["tasks"][task] = COMPLETED if proc.returncode == 0 else FAILED
+    save_job(job_id, job)
+
+
+def sbatch(args):
+    parser = argparse.ArgumentParser(prog="sbatch")
+    parser.add_argument("--parsable", action="store_true")
+    parser.add_argument("--array", default="0-0")
+    parser.add_argument("--dependency", default="")
+    parser.add_argument("--kill-on-invalid-dep", default=None)
+    parser.add_argument("script")
+    args = parser.parse_args(args)
+
+    jobs = load_jobs()
+    job_id = str(max([int(job_id) for job_id in jobs], default=0) + 1)
+    first, _, last = args.array.partition("-")
+    last = last if last else first
+    dependency = list()
+    if args.dependency:
+        kind, *dependency = args.dependency.split(":")
+        assert kind == "afterok", "Only afterok dependencies are supported!"
+    job = {
+        "script": str(Path(args.script).resolve()),
+        "cwd": os.getcwd(),
+        "dependency": dependency,
+        "tasks": {str(task): PENDING
+                  for task in range(int(first), int(last)+1)},
+    }
+    save_job(job_id, job)
+    print(job_id if args.parsable else f"Submitted batch job {job_id}")
+    sys.stdout.flush()
+    if os.environ.get("FAKESLURM_RUN", "1") != "0":
+        jobs[job_id] = job
+        run_job(job_id, job, jobs)
+
+
+def squeue(args):
+    parser = argparse.ArgumentParser(prog="squeue", add_help=False)
+    parser.add_argument("-h", "--noheader", action="store_true")
+    parser.add_argument("-o", "--format", default="%F")
+    parser.add_argument("-j", "--jobs", default=None)
+    args = parser.parse_args(args)
+
+    job_ids = args.jobs.split(",") if args.jobs else None
+    if not args.noheader:
+        print("JOBID STATE")
+    for job_id, job in load_jobs().items():
+        if (job_ids is not None) and (job_id not in job_ids):
+            continue
+        for task, state in job["tasks"].items():
+            if state == PENDING:
+                print(f"{job_id}" if args.format == "%F"
+                      else f"{job_id}_{task} {state}")
+
+
+def run():
+    # Works both as 'fakeslurm.py sbatch ...' and via symlinks named
+    # sbatch/squeue.
+    cmd = Path(sys.argv[0]).name
+    args = sys.argv[1:]
+    if cmd not in ("sbatch", "squeue"):
+        cmd, *args = args
+    {"sbatch": sbatch, "squeue": squeue}[cmd](args)
+
+
+if __name__ == "__main__":
+    run()
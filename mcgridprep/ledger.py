@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+
+import json
+import sqlite3
+import time
+
+
+LEDGER_FN = "mcgrid_ledger.sqlite"
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+TIMEOUT = "timeout"
+# Points that were not run, because the energy of their chain exceeded
+# the cutoff of mcgridrun.
+SKIPPED = "skipped"
+
+RC_OK = "RC_ALL_IS_WELL"
+
+
+class Ledger:
+    """Records the state of every grid point in a SQLite database, so an
+    interrupted mcgridrun can be resumed.
+
+    Every change is committed right away, so the ledger stays consistent
+    when the machine goes down while jobs are running."""
+
+    def __init__(self, db_fn=LEDGER_FN):
+        self.db_fn = db_fn
+        # Other processes may read the ledger while mcgridrun writes to it,
+        # e.g. mcgridparse or mcgridsim, so wait for their locks instead of
+        # failing right away.
+        self.con = sqlite3.connect(db_fn, timeout=60)
+        self.con.execute("""
+            CREATE TABLE IF NOT EXISTS points (
+                id TEXT PRIMARY KEY,
+                job TEXT,
+                state TEXT,
+                rc TEXT,
+                started REAL,
+                finished REAL,
+                artifacts TEXT,
+                energy REAL
+            )"""
+        )
+        self.con.commit()
+
+    def register(self, job_input, ids):
+        """Add new points as pending. Already known points are kept."""
+        with self.con:
+            self.con.executemany(
+                "INSERT OR IGNORE INTO points (id, job, state) VALUES (?, ?, ?)",
+                [(id_, job_input, PENDING) for id_ in ids]
+            )
+
+    def set_running(self, job_input, ids):
+        # All points of a job share its start time.
+        started = time.time()
+        with self.con:
+            self.con.executemany(
+                "UPDATE points SET job=?, state=?, rc=NULL, started=?, "
+                "finished=NULL WHERE id=?",
+                [(job_input, RUNNING, started, id_) for id_ in ids]
+            )
+
+    def set_finished(self, id_, state, rc, artifacts=(), energy=None):
+        with self.con:
+            self.con.execute(
+                "UPDATE points SET state=?, rc=?, finished=?, artifacts=?, "
+                "energy=? WHERE id=?",
+                (state, rc, time.time(), json.dumps([str(a) for a in artifacts]),
+                 energy, id_)
+            )
+
+    def set_pending(self, ids):
+        with self.con:
+            self.con.executemany(
+                "UPDATE points SET state=? WHERE id=?",
+                [(PENDING, id_) for id_ in ids]
+            )
+
+    def get(self, id_):
+        cur = self.con.execute(
+            "SELECT id, job, state, rc, started, finished, artifacts "
+            "FROM points WHERE id=?", (id_, )
+        )
+        row = cur.fetchone()
+        if row is None:
+            return None
+        keys = ("id", "job", "state", "rc", "started", "finished", "artifacts")
+        point = dict(zip(keys, row))
+        point["artifacts"] = json.loads(point["artifacts"] or "[]")
+        return point
+
+    def is_done(self, id_):
+        point = self.get(id_)
+        return (point is not None) and (point["state"] == DONE) \
+               and (point["rc"] == RC_OK)
+
+    def energies(self):
+        """Energy in Hartree of every point that finished successfully."""
+        cur = self.con.execute(
+            "SELECT id, energy FROM points WHERE state=? AND energy IS NOT NULL",
+            (DONE, )
+        )
+        return dict(cur.fetchall())
+
+    def ids_in_state(self, state):
+        cur = self.con.execute("SELECT id FROM points WHERE state=?", (state, ))
+        return [id_ for id_, in cur.fetchall()]
+
+    def durations(self):
+        """Runtime in seconds of every point that finished successfully.
+
+        The time from the start of a job until its last good point is split
+        evenly between its good points, as the points are only recorded
+        every few seconds while a job is running."""
+        cur = self.con.execute(
+            "SELECT id, job, started, finished FROM points WHERE state=? "
+            "AND started IS NOT NULL AND finished IS NOT NULL", (DONE, )
+        )
+        runs = dict()
+        for id_, job, started, finished in cur.fetchall():
+            runs.setdefault((job, started), list()).append((id_, finished))
+        durations = dict()
+        for (_, started), points in runs.items():
+            duration = max([finished for _, finished in points]) - started
+            for id_, _ in points:
+                durations[id_] = duration / len(points)
+        return durations
+
+    def counts(self, ids=None):
+        """Number of points in every state, optionally only for 'ids'."""
+        cur = self.con.execute("SELECT id, state FROM points")
+        counts = dict()
+        ids = None if ids is None else set(ids)
+        for id_, state in cur.fetchall():
+            if (ids is None) or (id_ in ids):
+                counts[state] = counts.get(state, 0) + 1
+        return counts
+
+    def close(self):
+        self.con.close()
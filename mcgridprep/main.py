@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 
+import argparse
 import itertools as it
 import os
 from pathlib import Path
@@ -9,9 +10,14 @@ import textwrap
 
 import jinja2
 import numpy as np
+import yaml
 
 from mcgridprep.config import config as CONF
-from mcgridprep.helpers import coords_from_spec, ind_for_spec
+from mcgridprep.helpers import coords_from_spec, id_for_fn, ind_for_spec
+from mcgridprep import plan
+from mcgridprep.cache import ResultCache, orbital_index, point_key
+from mcgridprep.cost import seed_id
+from mcgridprep.run import set_inporb, split_input
 
 
 TPL_STR = """
@@ -224,7 +230,619 @@ def make_xyzs(id_fmt, coords1, coords2):
     return ids, xyzs, coords_grid
 
 
+def seed_regions(coord1_spec, coord2_spec, seeds):
+    """Assign every grid point to its nearest seed point.
+
+    The distance is measured in grid steps along the rows and columns, as
+    this is the number of RASSCF runs needed to propagate the INPORB of a
+    seed to a point. Ties go to the seed given first.
+
+    Returns the coordinates along both axes, the grid indices of the seeds
+    and a dict, mapping the grid indices of every point to the number of
+    its seed."""
+    coords1, _ = coords_from_spec(*coord1_spec)
+    coords2, _ = coords_from_spec(*coord2_spec)
+    seed_inds = list()
+    for c1, c2 in seeds:
+        inside_grid = (coords1.min() <= c1 <= coords1.max()
+                       and coords2.min() <= c2 <= coords2.max()
+        )
+        assert inside_grid, f"Seed point ({c1}, {c2}) lies outside the grid!"
+        seed_inds.append((ind_for_spec(*coord1_spec, c1),
+                          ind_for_spec(*coord2_spec, c2)))
+
+    regions = dict()
+    for i1, i2 in it.product(range(coords1.size), range(coords2.size)):
+        dists = [abs(i1-s1) + abs(i2-s2) for s1, s2 in seed_inds]
+        regions[(i1, i2)] = dists.index(min(dists))
+    return coords1, coords2, seed_inds, regions
+
+
+def seed_tree(coord1_spec, coord2_spec, seeds):
+    """Predecessor of every grid point, when the INPORBs are propagated from
+    one or more seed points.
+
+    Every seed propagates its INPORB through its region, see seed_regions,
+    as shown in setup_2d_scan: to the left and to the right along its row
+    and from there down and up along the columns. So no chain of RASSCF
+    runs is longer than the distance of a point to its seed.
+
+    Returns a list of (point, prev, seed, part) tuples in propagation
+    order. point and prev are (c1, c2) tuples, with prev being the point
+    whose RasOrb is used as starting guess. prev is None for points that
+    start from the INPORB of their seed. part is one of left, right, down
+    and up."""
+    coords1, coords2, seed_inds, regions = seed_regions(coord1_spec,
+                                                        coord2_spec, seeds)
+
+    def part(i1, i2):
+        s1, s2 = seed_inds[regions[(i1, i2)]]
+        if i2 == s2:
+            return "left" if i1 < s1 else "right"
+        return "down" if i2 < s2 else "up"
+
+    def prev_ind(i1, i2):
+        s1, s2 = seed_inds[regions[(i1, i2)]]
+        if i2 != s2:
+            return (i1, i2 - int(np.sign(i2-s2)))
+        # Both halves of the row start from the INPORB, so they can be
+        # calculated in parallel.
+        if i1 in (s1, s1-1):
+            return None
+        return (i1 - int(np.sign(i1-s1)), i2)
+
+    # The rows of all seeds come first, followed by the down and up columns.
+    part_order = {"left": 0, "right": 0, "down": 1, "up": 2}
+    def propagation_order(inds):
+        i1, i2 = inds
+        seed = regions[inds]
+        s1, s2 = seed_inds[seed]
+        part_ = part(i1, i2)
+        if part_ in ("left", "right"):
+            return (part_order[part_], seed, part_ == "right", abs(i1-s1))
+        return (part_order[part_], seed, i1, abs(i2-s2))
+
+    point = lambda inds: (coords1[inds[0]], coords2[inds[1]])
+    tree = list()
+    for inds in sorted(regions, key=propagation_order):
+        prev = prev_ind(*inds)
+        tree.append((
+            point(inds),
+            None if prev is None else point(prev),
+            regions[inds],
+            part(*inds),
+        ))
+    return tree
+
+
+def points_from_config(points, regions, id_fmt):
+    """Points of an irregular point set.
+
+    'points' is a list of (c1, c2) pairs or the name of a file with two
+    columns. 'regions' is a list of rectangles, given by the 'coord1' and
+    'coord2' specs, like the full grid. The union of all is returned,
+    points with the same ID only once."""
+    if isinstance(points, str):
+        points = np.loadtxt(points, ndmin=2).tolist()
+    coords = [(float(c1), float(c2)) for c1, c2 in (points or list())]
+    for region in (regions or list()):
+        coords1, _ = coords_from_spec(*region["coord1"])
+        coords2, _ = coords_from_spec(*region["coord2"])
+        coords.extend([(float(c1), float(c2))
+                       for c1, c2 in it.product(coords1, coords2)])
+    unique = dict()
+    for point in coords:
+        unique.setdefault(id_fmt.format(*point), point)
+    return list(unique.values())
+
+
+def scaled_coords(points):
+    """Coordinates relative to the extent of the point set along every
+    coordinate, so distances don't depend on the units."""
+    coords = np.array(points, dtype=float)
+    span = np.ptp(coords, axis=0)
+    span[span == 0] = 1.
+    return coords / span
+
+
+def mst_tree(points, seeds, id_fmt, max_depth=None):
+    """Propagation tree over an arbitrary set of points.
+
+    The tree is a minimum spanning tree over the distances of the points,
+    see scaled_coords, grown from all seeds at once (Prim's algorithm), so
+    every point starts from a close point and every point belongs to the
+    region of one seed. With 'max_depth' no chain from a seed is longer
+    than 'max_depth' points and the tree is not minimal anymore. Seeds
+    that are not in 'points' are added.
+
+    The tuples in the tree are the same as from seed_tree with 'mst' as
+    part. Points are given in depth-first order and the child with the
+    largest subtree comes first, so tree_chains makes long chains."""
+    # Seeds have depth 0, so with a smaller depth nothing could be reached.
+    if (max_depth is not None) and (max_depth < 1):
+        raise ValueError(f"max_depth must be at least 1, got {max_depth}.")
+    points = list(points)
+    ids = [id_fmt.format(*point) for point in points]
+    seed_inds = list()
+    for seed in seeds:
+        seed_id = id_fmt.format(*seed)
+        if seed_id not in ids:
+            print(f"Adding seed point {seed_id} to the points.")
+            points.append(tuple(seed))
+            ids.append(seed_id)
+        seed_inds.append(ids.index(seed_id))
+
+    scaled = scaled_coords(points)
+    num = len(points)
+    in_tree = np.zeros(num, dtype=bool)
+    best = np.full(num, np.inf)
+    parents = np.full(num, -1)
+    depths = np.zeros(num, dtype=int)
+    regions = np.zeros(num, dtype=int)
+
+    def add(ind):
+        in_tree[ind] = True
+        if (max_depth is not None) and (depths[ind] >= max_depth):
+            return
+        dists = np.linalg.norm(scaled - scaled[ind], axis=1)
+        closer = ~in_tree & (dists < best)
+        best[closer] = dists[closer]
+        parents[closer] = ind
+
+    for seed, ind in enumerate(seed_inds):
+        regions[ind] = seed
+        add(ind)
+    added = list()
+    while not in_tree.all():
+        todo = np.flatnonzero(~in_tree)
+        ind = todo[best[todo].argmin()]
+        depths[ind] = depths[parents[ind]] + 1
+        regions[ind] = regions[parents[ind]]
+        add(ind)
+        added.append(ind)
+
+    children = {ind: list() for ind in range(num)}
+    for ind in added:
+        children[parents[ind]].append(ind)
+    sizes = np.ones(num, dtype=int)
+    for ind in added[::-1]:
+        sizes[parents[ind]] += sizes[ind]
+
+    tree = list()
+    for seed_ind in seed_inds:
+        stack = [seed_ind, ]
+        while stack:
+            ind = stack.pop()
+            prev = parents[ind]
+            tree.append((
+                points[ind],
+                None if prev < 0 else points[prev],
+                regions[ind],
+                "mst",
+            ))
+            stack.extend(sorted(children[ind], key=lambda c: sizes[c]))
+    return tree
+
+
+def existing_points(backup_path):
+    """Points that already have a RasOrb in backup_path."""
+    points = list()
+    for fn in Path(backup_path).glob("*.RasOrb"):
+        try:
+            points.append(id_for_fn(fn.name))
+        except AttributeError:
+            continue
+    return points
+
+
+def extension_tree(points, existing, id_fmt, max_depth=None):
+    """Propagation tree for the points of an enlarged or refined grid that
+    were not computed yet.
+
+    The tree is grown from all 'existing' points at once, see mst_tree, so
+    every new point starts from the closest existing point or from a new
+    point closer to it. New points next to an existing point start from
+    its RasOrb, so they have no predecessor in the tree and the index of
+    the existing point as seed.
+
+    Returns the tree of the new points and the full tree including the
+    existing points."""
+    existing_ids = set([id_fmt.format(*point) for point in existing])
+    new = [point for point in points
+           if id_fmt.format(*point) not in existing_ids]
+    full_tree = mst_tree(new + list(existing), existing, id_fmt, max_depth)
+    tree = list()
+    for point, prev, seed, _ in full_tree:
+        if id_fmt.format(*point) in existing_ids:
+            continue
+        if id_fmt.format(*prev) in existing_ids:
+            prev = None
+        tree.append((point, prev, seed, "extend"))
+    return tree, full_tree
+
+
+def tree_retry_seeds(tree, id_fmt, same_region=True):
+    """Alternative starting points for the points of a propagation tree,
+    like retry_seeds. These are the two closest points that are closer to
+    the seed in the tree than the failed point, so they don't depend on
+    it. With 'same_region' only points of the same region are used."""
+    points = [point for point, *_ in tree]
+    depths = dict()
+    for point, prev, *_ in tree:
+        depths[point] = 0 if prev is None else depths[prev] + 1
+    scaled = scaled_coords(points)
+    retry = dict()
+    for i, (point, prev, seed, _) in enumerate(tree):
+        dists = np.linalg.norm(scaled - scaled[i], axis=1)
+        neighbours = [points[j] for j in dists.argsort()
+                      if ((tree[j][2] == seed) or not same_region)
+                      and (depths[points[j]] < depths[point])
+                      and (points[j] != prev)][:2]
+        retry[id_fmt.format(*point)] = (
+            [id_fmt.format(*neighbour) for neighbour in neighbours], seed
+        )
+    return retry
+
+
+def snake_order(inds, seed_ind, size2):
+    """Walk the row of the seed to the right and back to the left, then
+    snake through the rows above and finally through the rows below."""
+    (i1, i2), (s1, s2) = inds, seed_ind
+    if i2 == s2:
+        return (0, 0, i1) if i1 >= s1 else (0, 1, -i1)
+    rank = i2 - s2 if i2 > s2 else (size2 - 1 - s2) + (s2 - i2)
+    return (rank, 0, -i1 if rank % 2 else i1)
+
+
+def spiral_order(inds, seed_ind, size2):
+    """Walk around the seed on rings of growing distance."""
+    (i1, i2), (s1, s2) = inds, seed_ind
+    ring = max(abs(i1-s1), abs(i2-s2))
+    angle = np.arctan2(i2-s2, i1-s1) % (2*np.pi)
+    return (ring, angle)
+
+
+TOPOLOGIES = {
+    "cross": None,
+    "snake": snake_order,
+    "spiral": spiral_order,
+    "mst": None,
+}
+
+
+def topology_tree(coord1_spec, coord2_spec, seeds, topology="cross",
+                  id_fmt="{:.2f}_{:.2f}", max_depth=None):
+    """Propagation tree for one of the TOPOLOGIES.
+
+    'cross' is the left/right/down/up propagation from seed_tree and 'mst'
+    the minimum spanning tree from mst_tree. For the other topologies the
+    points of every region are visited in the order given by the topology
+    and every point starts from the most recently visited neighbouring
+    point of its region. The tuples in the tree are the same as from
+    seed_tree, with the topology as part."""
+    if topology == "cross":
+        return seed_tree(coord1_spec, coord2_spec, seeds)
+    elif topology == "mst":
+        coords1, _ = coords_from_spec(*coord1_spec)
+        coords2, _ = coords_from_spec(*coord2_spec)
+        points = [(float(c1), float(c2))
+                  for c1, c2 in it.product(coords1, coords2)]
+        return mst_tree(points, seeds, id_fmt, max_depth)
+
+    coords1, coords2, seed_inds, regions = seed_regions(coord1_spec,
+                                                        coord2_spec, seeds)
+    order_func = TOPOLOGIES[topology]
+    point = lambda inds: (coords1[inds[0]], coords2[inds[1]])
+    tree = list()
+    for seed, seed_ind in enumerate(seed_inds):
+        region = sorted([inds for inds, seed_ in regions.items()
+                         if seed_ == seed],
+                        key=lambda inds: order_func(inds, seed_ind,
+                                                    coords2.size))
+        visited = dict()
+        for inds in region:
+            i1, i2 = inds
+            neighbours = [(i1-1, i2), (i1+1, i2), (i1, i2-1), (i1, i2+1)]
+            neighbours = [n for n in neighbours if n in visited]
+            # Fall back to the nearest visited point of the region, when
+            # the walk jumps.
+            if not neighbours:
+                neighbours = sorted(
+                    visited,
+                    key=lambda n: abs(n[0]-i1) + abs(n[1]-i2)
+                )[:1]
+            prev = max(neighbours, key=lambda n: visited[n]) \
+                   if neighbours else None
+            tree.append((
+                point(inds),
+                None if prev is None else point(prev),
+                seed,
+                topology,
+            ))
+            visited[inds] = len(visited)
+    return tree
+
+
+def tree_chains(tree):
+    """Split the tree into chains of points, that are calculated one after
+    another in one job. A point continues the chain of its predecessor, when
+    the predecessor is the last point of the chain and both belong to the
+    same part. So there is one chain for every half row and every half
+    column of a region.
+
+    Returns a list of (points, parent) tuples. points are taken from the
+    tree. parent is the index of the chain holding the predecessor of the
+    first point, or None."""
+    chains = list()
+    chain_inds = dict()
+    for point, prev, seed, part in tree:
+        if prev is not None:
+            prev_chain = chain_inds[prev]
+            chain, _ = chains[prev_chain]
+            if (chain[-1][0] == prev) and (chain[-1][3] == part):
+                chain.append((point, prev, seed, part))
+                chain_inds[point] = prev_chain
+                continue
+        chains.append(([(point, prev, seed, part), ],
+                       None if prev is None else chain_inds[prev]))
+        chain_inds[point] = len(chains) - 1
+    return chains
+
+
+def job_prefix(seed, seeds_num):
+    return f"seed{seed+1}_" if seeds_num > 1 else ""
+
+
+def make_column_jobs(chains, job_kwargs, id_fmt, fn_suffix, inporbs,
+                     seed_prefix=True):
+    job_kwargs = job_kwargs.copy()
+    cas = job_kwargs.get("cas", False)
+    backup_path = job_kwargs["backup_path"]
+
+    jobs = list()
+    job_fns = list()
+    # Dependencies of every job input, used by mcgridrun to start a column
+    # as soon as its seed RasOrb was written by the equilibrium row.
+    job_deps = dict()
+    for points, parent in chains:
+        (c1, _), prev, seed, part = points[0]
+        coords1, coords2 = zip(*[point for point, *_ in points])
+        prefix = job_prefix(seed, len(inporbs)) if seed_prefix else ""
+        if part in ("left", "right"):
+            fn = f"{prefix}{part}_{fn_suffix}.in"
+        elif part in ("down", "up"):
+            fn = f"{prefix}{part}_{c1}_{fn_suffix}.in"
+        else:
+            fn = f"{prefix}{part}_{id_fmt.format(*points[0][0])}_{fn_suffix}.in"
+        if prev is None:
+            inporb = inporbs[seed]
+            job_kwargs["inporb"] = inporb
+            deps = {
+                "needs": [str(inporb), ] if inporb else [],
+                "after": [],
+            }
+        else:
+            # To set up the columns we use the RasOrbs from the row.
+            prev_rasorb = f"{backup_path}/{id_fmt.format(*prev)}.RasOrb"
+            job_kwargs["inporb"] = prev_rasorb if cas else None
+            deps = {
+                "needs": [prev_rasorb, ] if cas else [],
+                "after": [job_fns[parent], ] if cas else [],
+            }
+        ids = [id_fmt.format(c1, c2) for c1, c2 in zip(coords1, coords2)]
+        xyzs = [make_xyz(angle=c1, bond=c2)
+                for c1, c2 in zip(coords1, coords2)]
+        deps["ids"] = ids
+        job = TPL.render(**job_kwargs,
+                         ids=ids,
+                         xyzs=xyzs,
+        )
+        jobs.append(job)
+        job_fns.append(fn)
+        job_deps[fn] = deps
+
+    return jobs, job_fns, job_deps
+
+
+def make_point_jobs(tree, job_kwargs, id_fmt, fn_suffix, inporbs):
+    job_kwargs = job_kwargs.copy()
+    cas = job_kwargs.get("cas", False)
+    backup_path = job_kwargs["backup_path"]
+
+    jobs = list()
+    job_fns = list()
+    job_deps = dict()
+    point_fns = dict()
+    for (c1, c2), prev, seed, _ in tree:
+        ids, xyzs, _ = make_xyzs(id_fmt, [c1, ], [c2, ])
+        id_ = ids[0]
+        fn = f"point_{id_}_{fn_suffix}.in"
+        if prev is None:
+            inporb = inporbs[seed]
+            job_kwargs["inporb"] = inporb
+            deps = {
+                "needs": [str(inporb), ] if inporb else [],
+                "after": [],
+            }
+        else:
+            prev_id = id_fmt.format(*prev)
+            prev_rasorb = f"{backup_path}/{prev_id}.RasOrb"
+            job_kwargs["inporb"] = prev_rasorb if cas else None
+            deps = {
+                "needs": [prev_rasorb, ] if cas else [],
+                "after": [point_fns[prev], ] if cas else [],
+            }
+        deps["ids"] = ids
+        job = TPL.render(**job_kwargs,
+                         ids=ids,
+                         xyzs=xyzs,
+        )
+        jobs.append(job)
+        job_fns.append(fn)
+        job_deps[fn] = deps
+        point_fns[(c1, c2)] = fn
+    return jobs, job_fns, job_deps
+
+
+def retry_seeds(coord1_spec, coord2_spec, seeds, id_fmt):
+    """Alternative starting points for every grid point, in case its
+    RASSCF fails when started from its predecessor.
+
+    These are the neighbour in the same row and the diagonal neighbour,
+    both one step closer to the seed point, so they are computed
+    independently of the failed point and belong to the same region.
+
+    Returns a dict, mapping the ID of every point to the IDs of its
+    alternative starting points and the number of its seed."""
+    coords1, coords2, seed_inds, regions = seed_regions(coord1_spec,
+                                                        coord2_spec, seeds)
+    retry = dict()
+    for (i1, i2), seed in regions.items():
+        s1, s2 = seed_inds[seed]
+        step1 = int(np.sign(s1 - i1))
+        step2 = int(np.sign(s2 - i2))
+        # Along the row of the seed the row neighbour already is the
+        # predecessor.
+        if (step1 == 0) or (step2 == 0):
+            neighbours = list()
+        else:
+            neighbours = [(i1+step1, i2), (i1+step1, i2+step2)]
+        id_ = id_fmt.format(coords1[i1], coords2[i2])
+        retry[id_] = ([id_fmt.format(coords1[n1], coords2[n2])
+                       for n1, n2 in neighbours], seed)
+    return retry
+
+
+def add_retry_seeds(job_deps, retry, backup_path, inporbs):
+    """Add the RasOrbs of the alternative starting points from 'retry', see
+    retry_seeds, and the INPORB of the seed to the dependencies of every
+    job."""
+    for deps in job_deps.values():
+        deps["seeds"] = dict()
+        for id_ in deps["ids"]:
+            neighbours, seed = retry[id_]
+            deps["seeds"][id_] = [f"{backup_path}/{neighbour}.RasOrb"
+                                  for neighbour in neighbours] \
+                                 + [str(inporbs[seed]), ]
+
+
+def use_cache(cache, jobs, job_fns, job_deps, backup_path, out_path,
+              indices=None):
+    """Restore the points found in the ResultCache 'cache' to backup_path
+    and out_path and take them out of the jobs. 'indices' holds the active
+    space of every point, see cache.orbital_index.
+
+    A job is split at its cached points. The part after a cached point
+    starts from its RasOrb and doesn't wait for any other job. Jobs that
+    only hold cached points are dropped. Every other job waits for the
+    part that computes its seed, or not at all when its seed is cached."""
+    indices = dict() if indices is None else indices
+    os.makedirs(out_path, exist_ok=True)
+    new_jobs = list()
+    new_fns = list()
+    new_deps = dict()
+    # Part that computes every point that is not cached
+    part_fns = dict()
+    cached = set()
+    for job, fn in zip(jobs, job_fns):
+        header, blocks = split_input(job)
+        deps = job_deps[fn]
+        cas = "&rasscf" in job
+        parts = [(None, list()), ]
+        for id_, block in blocks:
+            key = point_key(block, indices.get(id_, ""))
+            if cache.restore(key, backup_path, id_, out_path):
+                cached.add(id_)
+                parts.append((backup_path / f"{id_}.RasOrb", list()))
+            else:
+                parts[-1][1].append((id_, block))
+        for i, (inporb, part) in enumerate(parts):
+            if not part:
+                continue
+            ids = [id_ for id_, _ in part]
+            if i == 0:
+                part_fn = fn
+                part_header = header
+                part_deps = dict(deps)
+            else:
+                part_fn = f"{Path(fn).stem}.{ids[0]}.in"
+                part_header = set_inporb(header, inporb) if cas else header
+                part_deps = {
+                    "needs": [str(inporb), ] if cas else [],
+                    "after": [],
+                }
+            part_deps["ids"] = ids
+            if "seeds" in deps:
+                part_deps["seeds"] = {id_: deps["seeds"][id_] for id_ in ids}
+            new_jobs.append(part_header
+                            + "".join([block for _, block in part]))
+            new_fns.append(part_fn)
+            new_deps[part_fn] = part_deps
+            part_fns.update({id_: part_fn for id_ in ids})
+    for deps in new_deps.values():
+        needs = deps.get("needs", list())
+        seed = seed_id(needs[0]) if needs else None
+        if seed in part_fns:
+            deps["after"] = [part_fns[seed], ]
+        elif seed in cached:
+            deps["after"] = list()
+        else:
+            deps["after"] = [parent for parent in deps["after"]
+                             if parent in new_deps]
+    print(f"Restored {len(cached)} points from the cache, {len(new_jobs)} "
+           "jobs are left.")
+    return new_jobs, new_fns, new_deps
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser()
+
+    parser.add_argument("--points", action="store_true",
+        help="Create one job per grid point instead of one job per "
+             "row/column, so mcgridrun can balance single points."
+    )
+
+    parser.add_argument("--topology", choices=list(TOPOLOGIES),
+        default="cross",
+        help="Order in which the orbitals are propagated through the grid. "
+             "'cross' propagates along the row of every seed and from there "
+             "along the columns. 'snake' and 'spiral' walk through the grid "
+             "point by point. 'mst' propagates along a minimum spanning tree "
+             "of the points, which is always used for irregular point sets, "
+             "given by 'points' or 'regions' in mcgrid.yaml."
+    )
+    parser.add_argument("--extend", action="store_true",
+        help="Only create inputs for the points in mcgrid.yaml that have no "
+             "RasOrb in backup_path yet, e.g. after enlarging or refining "
+             "the grid. Every new point starts from the closest existing "
+             "point, see --max-depth. Needs the 'cas' method."
+    )
+    parser.add_argument("--cache", default=None,
+        help="Folder of a result cache filled by 'mcgridrun --cache'. Points "
+             "found in it are copied to backup_path and ./out instead of "
+             "being computed again."
+    )
+    parser.add_argument("--max-depth", type=int, default=None,
+        help="Largest number of points propagated one after another from a "
+             "seed with the 'mst' topology."
+    )
+    parser.add_argument("--plan", action="store_true",
+        help="Only print the propagation plan: critical path, parallelism "
+             "and the speedup for different --cpus. No inputs are written."
+    )
+    parser.add_argument("--cpus", type=int, default=None,
+        help="Number of jobs at a time to include in the plan."
+    )
+
+    args = parser.parse_args(args)
+    if (args.max_depth is not None) and (args.max_depth < 1):
+        parser.error("--max-depth must be at least 1.")
+    return args
+
+
 def run():
+    args = parse_args(sys.argv[1:])
+
     print("Job configuration")
     pprint(CONF)
 
@@ -233,8 +851,9 @@ def run():
 
     backup_path = Path(CONF["backup_path"]).resolve()
     try:
-        os.mkdir(backup_path)
-        print(f"Created backup directory at '{backup_path}'")
+        if not args.plan:
+            os.mkdir(backup_path)
+            print(f"Created backup directory at '{backup_path}'")
     except FileExistsError:
         print("Skipping creation of backup directory, as it already exists.")
     job_kwargs = {
@@ -249,11 +868,18 @@ def run():
     for method in methods:
         job_kwargs[method] = True
 
+    # Every seed point comes with its own INPORB. Without 'seeds' the
+    # INPORB is propagated from coord_eq.
+    if CONF["seeds"]:
+        seeds = [seed["coord"] for seed in CONF["seeds"]]
+        inporbs = [seed["inporb"] for seed in CONF["seeds"]]
+    else:
+        seeds = [CONF["coord_eq"], ]
+        inporbs = [CONF["inporb"], ]
     if "cas" not in methods:
-        inporb = None
+        inporbs = [None for _ in inporbs]
     else:
-        inporb = Path(CONF["inporb"]).resolve()
-    job_kwargs["inporb"] = inporb
+        inporbs = [Path(inporb).resolve() for inporb in inporbs]
 
     method_str = "_".join(methods)
     # print("Using methods:")
@@ -269,51 +895,109 @@ def run():
 
     id_fmt = CONF["id_fmt"]
 
-    coord1_spec = CONF["coord1"]
-    coord2_spec = CONF["coord2"]
-    c_eq = CONF["coord_eq"]
-    coords = setup_2d_scan(coord1_spec, coord2_spec, c_eq)
-
-    left_right = [list(it.product(c1, c2)) for c1, c2 in coords[:2]]
-    left_right_ids = [id_fmt.format(*cs)
-                      for cs in it.chain(left_right[0][::-1], left_right[1])]
-
-    # Generate the RasOrbs that will be used as input for the up
-    # and down columns.
-    rasorb_fns = lambda ids: [f"{job_kwargs['backup_path']}/{id_}.RasOrb"
-                              for id_ in ids]
-    eq_rasorbs = rasorb_fns(left_right_ids)
-
-    # Expand the up and down coords into two parts of one row
-    jobs = list()
-    job_fns = list()
-    for coords_name, (coords1, coords2) in zip(("left", "right"), coords[:2]):
-        # ids, zmats, _ = make_zmats(zmat_tpl, id_fmt, coords1, coords2)
-        ids, xyzs, _ = make_xyzs(id_fmt, coords1, coords2)
-        job = TPL.render(**job_kwargs,
-                         ids=ids,
-                         # zmats=zmats,
-                         xyzs=xyzs,
-        )
-        jobs.append(job)
-        fn = f"{coords_name}_{method}_{job_kwargs['basis']}.in"
-        job_fns.append(fn)
-
-    # Expand up down into their respective columns
-    for coords_name, (coords1, coords2) in zip(("down", "up"), coords[2:]):
-        for col, inporb in zip(coords1, eq_rasorbs):
-            # ids, zmats, _ = make_zmats(zmat_tpl, id_fmt, [col, ], coords2)
-            ids, xyzs, _ = make_xyzs(id_fmt, [col, ], coords2)
-            # To set up the columns we use the RasOrbs from the equilibrium row.
-            job_kwargs["inporb"] = inporb
-            job = TPL.render(**job_kwargs,
-                             ids=ids,
-                             # zmats=zmats,
-                             xyzs=xyzs,
+    coord1_spec = CONF.get("coord1")
+    coord2_spec = CONF.get("coord2")
+    fn_suffix = f"{method}_{job_kwargs['basis']}"
+
+    def make_jobs(tree):
+        if args.points:
+            return make_point_jobs(tree, job_kwargs, id_fmt, fn_suffix,
+                                   inporbs)
+        chains = tree_chains(tree)
+        return make_column_jobs(chains, job_kwargs, id_fmt, fn_suffix,
+                                inporbs, seed_prefix=not args.extend)
+
+    # Irregular point sets can only be propagated along a spanning tree.
+    irregular = bool(CONF["points"] or CONF["regions"])
+    if irregular:
+        grid_points = points_from_config(CONF["points"], CONF["regions"],
+                                         id_fmt)
+    elif args.extend:
+        coords1, _ = coords_from_spec(*coord1_spec)
+        coords2, _ = coords_from_spec(*coord2_spec)
+        grid_points = [(float(c1), float(c2))
+                       for c1, c2 in it.product(coords1, coords2)]
+    if args.extend:
+        if "cas" not in methods:
+            sys.exit("Extending a grid needs the 'cas' method, as computed "
+                     "points are recognized by their RasOrb.")
+        existing = existing_points(backup_path)
+        if not existing:
+            sys.exit(f"Found no RasOrbs to extend in '{backup_path}'.")
+        args.topology = "mst"
+        tree, full_tree = extension_tree(grid_points, existing, id_fmt,
+                                         args.max_depth)
+        # Every new point next to the existing points starts from the RasOrb
+        # of one of them.
+        inporbs = [backup_path / f"{id_fmt.format(*point)}.RasOrb"
+                   for point in existing]
+        print(f"Found {len(existing)} computed points in '{backup_path}'. "
+              f"{len(tree)} points are new.")
+        if not tree:
+            print("Nothing to do.")
+            return
+    elif irregular:
+        args.topology = "mst"
+        tree = mst_tree(grid_points, seeds, id_fmt, args.max_depth)
+    else:
+        tree = topology_tree(coord1_spec, coord2_spec, seeds, args.topology,
+                             id_fmt, args.max_depth)
+    print(f"There are a total of {len(tree)} points in the grid, "
+          f"propagated from {len(inporbs)} seed point(s).")
+    if args.points:
+        print("Setting up one job per grid point.")
+    jobs, job_fns, job_deps = make_jobs(tree)
+
+    if args.plan:
+        if irregular or args.extend:
+            coords1 = np.unique([c1 for (c1, _), *_ in tree])
+            coords2 = np.unique([c2 for (_, c2), *_ in tree])
+        else:
+            coords1, _ = coords_from_spec(*coord1_spec)
+            coords2, _ = coords_from_spec(*coord2_spec)
+        print(f"Propagation plan for the '{args.topology}' topology")
+        plan.report(job_fns, job_deps, tree, coords1, coords2, args.cpus)
+        print()
+        if irregular or args.extend:
+            return
+        cpus = args.cpus if args.cpus else 1
+        print(f"Comparison of all topologies, makespan with {cpus} jobs "
+               "at a time:")
+        print(f"{'topology':>10} {'critical path':>14} {'max parallel':>13} "
+              f"{'makespan':>9}")
+        for topology in TOPOLOGIES:
+            _, topo_fns, topo_deps = make_jobs(
+                topology_tree(coord1_spec, coord2_spec, seeds, topology,
+                              id_fmt, args.max_depth)
+            )
+            critical, max_parallel, makespan = plan.plan_summary(
+                topo_fns, topo_deps, cpus
             )
-            jobs.append(job)
-            fn = f"{coords_name}_{col}_{method}_{job_kwargs['basis']}.in"
-            job_fns.append(fn)
+            print(f"{topology:>10} {critical:>14.0f} {max_parallel:>13d} "
+                  f"{makespan:>9.0f}")
+        return
+
+    if "cas" in methods:
+        if args.extend:
+            # Existing points are alternatives for all new points.
+            retry = tree_retry_seeds(full_tree, id_fmt, same_region=False)
+        elif args.topology == "mst":
+            retry = tree_retry_seeds(tree, id_fmt)
+        else:
+            retry = retry_seeds(coord1_spec, coord2_spec, seeds, id_fmt)
+        add_retry_seeds(job_deps, retry, backup_path, inporbs)
+
+    if args.cache:
+        # The active space of every point is the one of the INPORB of its
+        # region.
+        region_indices = [orbital_index(inporb) if inporb else ""
+                          for inporb in inporbs]
+        indices = {id_fmt.format(*point): region_indices[seed]
+                   for point, _, seed, _ in tree}
+        cache = ResultCache(args.cache)
+        jobs, job_fns, job_deps = use_cache(cache, jobs, job_fns, job_deps,
+                                            backup_path, Path("out"), indices)
+        cache.close()
 
     for job, fn in zip(jobs, job_fns):
         with open(fn, "w") as handle:
@@ -325,6 +1009,11 @@ def run():
         handle.write("\n".join(job_fns))
     print(f"Wrote list of all job inputs to '{job_inputs_fn}'")
 
+    job_deps_fn = "job_deps.yaml"
+    with open(job_deps_fn, "w") as handle:
+        yaml.dump(job_deps, handle)
+    print(f"Wrote job dependencies to '{job_deps_fn}'")
+
 
 if __name__ == "__main__":
     run()
@@ -3,6 +3,7 @@
 import argparse
 import itertools as it
 import logging
+import os
 from pathlib import Path
 from pprint import pprint
 import re
@@ -12,9 +13,11 @@ import h5py
 import numpy as np
 
 from mcgridprep.config import config as CONF
+from mcgridprep.cost import id_coords
 from mcgridprep.helpers import ind_for_spec, id_for_fn, coords_from_spec, \
                                get_all_ids
 import mcgridprep.helpers as helpers
+from mcgridprep.ledger import Ledger, LEDGER_FN, SKIPPED
 
 
 def parse_args(args):
@@ -22,6 +25,10 @@ def parse_args(args):
 
     parser.add_argument("--backup", default="./backup")
     parser.add_argument("--out", default="./out")
+    parser.add_argument("--ledger", default=LEDGER_FN,
+        help="Ledger of mcgridrun. Points it skipped because of the energy "
+             "cutoff are set to NaN in the grids."
+    )
 
     return parser.parse_args(args)
 
@@ -37,6 +44,14 @@ def get_ind_funcs():
     return coord1_ind, coord2_ind
 
 
+def on_grid(c1, c2):
+    """Check if a point lies on the grid of coord1 and coord2, e.g. not on
+    a coarser or larger grid that was extended with 'mcgridprep --extend'."""
+    coords1, _ = coords_from_spec(*CONF["coord1"])
+    coords2, _ = coords_from_spec(*CONF["coord2"])
+    return np.isclose(coords1, c1).any() and np.isclose(coords2, c2).any()
+
+
 def parse_loprop(text):
     pol_re = "Molecular Polarizability\s*" \
              "Tensor\s*" \
@@ -57,11 +72,24 @@ def parse_caspt2(text, skip=None):
 def parse_logs(fns, grid_dims):
     num2, num1 = grid_dims
 
-    calc_texts = list()
+    # Points of resumed jobs can appear in several logs, so only the most
+    # recent calculation of every point is kept.
+    fns = sorted(fns, key=os.path.getmtime)
+    calc_texts = dict()
     for fn in fns:
         with open(fn) as handle:
             text = handle.read()
-        calc_texts.extend(text.split("Start Module: gateway")[1:])
+        for calc_text in text.split("Start Module: gateway")[1:]:
+            # Intermediate steps inserted by mcgridrun are not part of the
+            # grid and have no ID.
+            if not helpers.ids_from_log(calc_text):
+                continue
+            calc_texts[tuple(helpers.id_from_log(calc_text))] = calc_text
+    off_grid = [id_ for id_ in calc_texts if not on_grid(*id_)]
+    if off_grid:
+        print(f"Ignoring {len(off_grid)} calculations off the grid.")
+    calc_texts = [text for id_, text in calc_texts.items()
+                  if id_ not in off_grid]
 
     logs_expected = num1*num2
     logs_present = len(calc_texts)
@@ -100,7 +128,20 @@ def parse_logs(fns, grid_dims):
         print(f"Wrote CASPT2 energies to '{pt2_grid_fn}'")
 
 
-def energies_from_h5s(h5_fns, grid_dims, grid_fn, h5_key="SFS_ENERGIES"):
+def skipped_points(ledger_fn):
+    """IDs of the points mcgridrun skipped because of the energy cutoff."""
+    if not os.path.exists(ledger_fn):
+        return list()
+    ledger = Ledger(ledger_fn)
+    ids = ledger.ids_in_state(SKIPPED)
+    ledger.close()
+    return [id_coords(id_) for id_ in ids]
+
+
+def energies_from_h5s(h5_fns, grid_dims, grid_fn, h5_key="SFS_ENERGIES",
+                      skipped=()):
+    # Points of a grid that was extended may lie off the current grid.
+    h5_fns = [fn for fn in h5_fns if on_grid(*id_for_fn(fn.name))]
     if len(h5_fns) == 0:
         return
     ids = [id_for_fn(fn.name) for fn in h5_fns]
@@ -119,6 +160,8 @@ def energies_from_h5s(h5_fns, grid_dims, grid_fn, h5_key="SFS_ENERGIES"):
         c2_ind = coord2_ind(c2)
         f = h5py.File(h5_fn)
         grid[c2_ind,c1_ind] = f[h5_key][:]
+    for c1, c2 in skipped:
+        grid[coord2_ind(c2), coord1_ind(c1)] = np.nan
 
     np.save(grid_fn, grid)
     print(f"Wrote '{grid_fn}'")
@@ -154,9 +197,17 @@ def run():
     pt2_rassi_h5s = list(backup_path.glob("*.rassi_pt2.h5"))
     print(f"Found {len(pt2_rassi_h5s)} caspt2/rassi HDF5 files.")
 
-    energies_from_h5s(cas_h5s, grid_dims, "rasscf_grid.npy", h5_key="ROOT_ENERGIES")
-    energies_from_h5s(cas_rassi_h5s, grid_dims, "rasscf_grid.npy")
-    energies_from_h5s(pt2_rassi_h5s, grid_dims, "caspt2_grid.npy")
+    skipped = skipped_points(args.ledger)
+    if skipped:
+        print(f"{len(skipped)} points were skipped because of the energy "
+               "cutoff. They are NaN in the grids.")
+
+    energies_from_h5s(cas_h5s, grid_dims, "rasscf_grid.npy",
+                      h5_key="ROOT_ENERGIES", skipped=skipped)
+    energies_from_h5s(cas_rassi_h5s, grid_dims, "rasscf_grid.npy",
+                      skipped=skipped)
+    energies_from_h5s(pt2_rassi_h5s, grid_dims, "caspt2_grid.npy",
+                      skipped=skipped)
 
 
 if __name__ == "__main__":
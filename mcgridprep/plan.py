@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+
+import numpy as np
+
+from mcgridprep.cost import CostModel, schedule_jobs
+from mcgridprep.run import job_priorities
+
+
+def propagation_map(tree, coords1, coords2):
+    """Draw the propagation tree on the grid. An arrow shows the direction
+    in which the orbitals are propagated to a point, 'o' marks points that
+    start from an INPORB and '+' points that start from a point that is not
+    a direct neighbour. The largest value of coord2 is at the top."""
+    inds1 = {c1: i1 for i1, c1 in enumerate(coords1)}
+    inds2 = {c2: i2 for i2, c2 in enumerate(coords2)}
+    arrows = {(1, 0): ">", (-1, 0): "<", (0, 1): "^", (0, -1): "v"}
+    rows = [[" " for _ in coords1] for _ in coords2]
+    for (c1, c2), prev, *_ in tree:
+        i1, i2 = inds1[c1], inds2[c2]
+        if prev is None:
+            char = "o"
+        else:
+            step = (i1 - inds1[prev[0]], i2 - inds2[prev[1]])
+            char = arrows.get(step, "+")
+        rows[i2][i1] = char
+    lines = [f"{c2:>8.3f} | " + " ".join(row)
+             for c2, row in zip(coords2[::-1], rows[::-1])]
+    return "\n".join(lines)
+
+
+def parallelism_profile(starts, ends, makespan, bins=20):
+    """Highest number of jobs running at the same time in 'bins' equal
+    intervals of the makespan."""
+    edges = np.linspace(0, makespan, min(bins, max(int(makespan), 1)) + 1)
+    profile = list()
+    for lower, upper in zip(edges[:-1], edges[1:]):
+        # The number of running jobs only changes when a job starts.
+        times = [lower, ] + [start for start in starts.values()
+                             if lower < start < upper]
+        profile.append((lower, upper, max(
+            [sum([(starts[job] <= time < ends[job]) for job in starts])
+             for time in times]
+        )))
+    return profile
+
+
+def speedup_curve(job_inputs, job_deps, points, max_cpus, cpus=None):
+    """Predicted makespan for several numbers of jobs at a time, using the
+    ordering of mcgridrun on a new grid. Every point costs one unit."""
+    model = CostModel()
+    priority = job_priorities(job_inputs, job_deps)
+    cpus_list = [2**i for i in range(int(np.log2(max_cpus)) + 1)] \
+                + [max_cpus, ]
+    if cpus:
+        cpus_list.append(cpus)
+    curve = list()
+    for cpus_ in sorted(set(cpus_list)):
+        _, ends = schedule_jobs(job_inputs, job_deps, points, model, cpus_,
+                                priority)
+        curve.append((cpus_, max(ends.values())))
+    return curve
+
+
+def plan(job_inputs, job_deps):
+    """Schedule the jobs with unlimited cores and one unit per point.
+
+    Returns the start and end times of all jobs, the points of every job
+    and the length of the critical path in points."""
+    points = {job_input: job_deps[job_input]["ids"]
+              for job_input in job_inputs}
+    starts, ends = schedule_jobs(job_inputs, job_deps, points, CostModel(),
+                                 len(job_inputs),
+                                 job_priorities(job_inputs, job_deps))
+    return starts, ends, points, max(ends.values(), default=0.)
+
+
+def plan_summary(job_inputs, job_deps, cpus):
+    """Critical path, maximum parallelism and makespan with 'cpus' jobs at
+    a time, in points."""
+    starts, ends, points, critical = plan(job_inputs, job_deps)
+    profile = parallelism_profile(starts, ends, critical)
+    max_parallel = max([running for *_, running in profile])
+    _, ends = schedule_jobs(job_inputs, job_deps, points, CostModel(), cpus,
+                            job_priorities(job_inputs, job_deps))
+    return critical, max_parallel, max(ends.values())
+
+
+def report(job_inputs, job_deps, tree, coords1, coords2, cpus=None,
+           tolerance=0.1):
+    """Print the propagation plan of a grid."""
+    starts, ends, points, critical = plan(job_inputs, job_deps)
+    total = sum([len(ids) for ids in points.values()])
+    print(f"{total} points in {len(job_inputs)} jobs")
+    print(propagation_map(tree, coords1, coords2))
+    print()
+    print(f"Critical path: {critical:.0f} points. No number of cores can "
+          f"finish the grid in less than {critical:.0f} consecutive points.")
+
+    profile = parallelism_profile(starts, ends, critical)
+    max_parallel = max([running for *_, running in profile])
+    print(f"Maximum useful parallelism: {max_parallel} jobs at a time")
+    print("Parallelism over time, with unlimited cores (in points):")
+    for lower, upper, running in profile:
+        print(f"{lower:>6.1f} - {upper:>6.1f} {running:>4d} {'#'*running}")
+    print()
+
+    curve = speedup_curve(job_inputs, job_deps, points, max_parallel, cpus)
+    serial = total
+    print("Speedup with the ordering of mcgridrun:")
+    print(f"{'cpus':>6} {'makespan':>9} {'speedup':>8} {'efficiency':>11}")
+    for cpus_, makespan in curve:
+        speedup = serial / makespan
+        print(f"{cpus_:>6d} {makespan:>9.0f} {speedup:>8.2f} "
+              f"{speedup/cpus_:>10.0%}")
+    ideal = min([cpus_ for cpus_, makespan in curve
+                 if makespan <= (1 + tolerance) * critical])
+    print(f"With --cpus {ideal} the makespan is within {tolerance:.0%} of "
+           "the critical path. More cores are mostly idle.")
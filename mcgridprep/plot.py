@@ -81,12 +81,13 @@ def plot_grid(C1, C2, energies, title="", level_num=35):
         fig, ax = plt.subplots()
         fig.suptitle(f"{title}, State {state}")
         state_ens = energies[:,:,state]
-        state_ens -= state_ens.min()
-        state_ens = np.nan_to_num(state_ens)
-        min_ind = np.unravel_index(state_ens.argmin(), state_ens.shape)
+        # Points skipped by the energy cutoff are NaN and are left blank.
+        state_ens -= np.nanmin(state_ens)
+        min_ind = np.unravel_index(np.nanargmin(state_ens), state_ens.shape)
         x_min = C1[min_ind]
         y_min = C2[min_ind]
-        conf = ax.contourf(C1, C2, state_ens, levels=levels)
+        conf = ax.contourf(C1, C2, np.ma.masked_invalid(state_ens),
+                           levels=levels)
         x_lims = ax.get_xlim()
         y_lims = ax.get_ylim()
         # ax.contour(C1, C2, state_ens, levels=levels, colors="w", linewidths=1)
@@ -1,60 +1,2009 @@
 #!/usr/bin/env python3
 
 import argparse
+import asyncio
 from functools import partial
-import multiprocessing
 import os
 from pathlib import Path
 from pprint import pprint
 import re
 import shutil
-import subprocess
+import signal
 import sys
 import tempfile
 import time
 
+import numpy as np
+import yaml
+
+from mcgridprep.admission import Admission, parse_mem
+from mcgridprep.batch import BACKENDS, run_args_from
+from mcgridprep.cache import ResultCache, orbital_index, point_key
+from mcgridprep.cost import CostModel, id_coords, predict_makespan, seed_id
+from mcgridprep.ledger import Ledger, LEDGER_FN, PENDING, DONE, FAILED, \
+                            TIMEOUT, SKIPPED, RC_OK
+from mcgridprep.workqueue import WorkQueue, QUEUE_DIR, worker_name
+
+
+ID_RE = "\*# (\S+) #\*"
+RC_RE = "/rc=_(\w+)_"
+# Energy of a point, that is checked against the cutoff. The first
+# matching expression is used.
+ENERGY_RES = (
+    "::\s+RASSCF root number\s+1 Total energy:\s+([\d\-\.]+)",
+    "Total SCF energy\s+([\d\-\.]+)",
+)
+AU2EV = 27.2114
+WAVE_SEEDS = ("nearest", "energy")
+ITER_RE = "Convergence after\s+(\d+)\s+iterations"
+CI_HEAD_RE = "printout of CI-coefficients larger than\s+\S+\s+for root\s+1\s"
+CONF_RE = "^\s+\d+\s+([2ud0][2ud0 ]*?)\s+-?\d+\.\d+\s+(\d+\.\d+)\s*$"
+FLOAT_RE = "-?\d+\.\d*"
+
 
 def parse_args(args):
     parser = argparse.ArgumentParser()
 
     parser.add_argument("job_inputs")
     parser.add_argument("--cpus", type=int, default=1)
+    parser.add_argument("--deps", default=None,
+        help="YAML file with the dependencies of every job input. Defaults to "
+             "'job_deps.yaml' next to job_inputs, if present."
+    )
+    parser.add_argument("--poll", type=float, default=5.,
+        help="Interval in seconds to check for finished jobs and seed files."
+    )
+    parser.add_argument("--ledger", default=None,
+        help="SQLite database recording the state of every point. Defaults "
+            f"to '{LEDGER_FN}' next to job_inputs."
+    )
+    parser.add_argument("--resume", action="store_true",
+        help="Skip points that already finished successfully according to "
+             "the ledger and restart every job after its last good point."
+    )
+    parser.add_argument("--scale-cores", choices=("omp", "mpi"), default=None,
+        help="Set the number of OpenMP threads (OMP_NUM_THREADS) or MPI "
+             "processes (MOLCAS_NPROCS) of every job, so the --cpus cores "
+             "are shared between the remaining jobs at the end of a grid. "
+             "By default these variables are taken from the environment."
+    )
+    parser.add_argument("--scratch", action="append", default=None,
+        help="Directory the jobs are run in, e.g. a node-local disk or "
+             "tmpfs. Can be given multiple times; the first one with "
+             "enough free space is used. Defaults to $TMPDIR. The input and "
+             "the output are linked or renamed instead of copied when they "
+             "are on the same filesystem as ./out. The RasOrb, HDF5 and "
+             "other files are always copied to backup_path by the '>> copy' "
+             "lines of the input."
+    )
+    parser.add_argument("--min-free", type=float, default=1.,
+        help="Free space in GB a scratch directory needs to be used."
+    )
+    parser.add_argument("--stream-out", action="store_true",
+        help="Let pymolcas write its output directly to ./out instead of "
+             "copying it there after the job finished. Only the output is "
+             "affected, the files of the '>> copy' lines are still copied "
+             "by pymolcas."
+    )
+    parser.add_argument("--retries", type=int, default=0,
+        help="Number of alternative starting orbitals (row neighbour, "
+             "diagonal neighbour, INPORB) tried for a failed point, before "
+             "the rest of its job is continued anyway."
+    )
+    parser.add_argument("--jump", type=float, default=None,
+        help="When the energy changes by more than this many eV between two "
+             "points of a job, the second point is rerun from orbitals that "
+             "were propagated over --steps intermediate geometries."
+    )
+    parser.add_argument("--max-iter", type=int, default=None,
+        help="Like --jump, but for points whose RASSCF needed more than this "
+             "many iterations."
+    )
+    parser.add_argument("--steps", type=int, default=2,
+        help="Number of intermediate geometries for --jump and --max-iter. "
+             "They only propagate the orbitals and are not part of the grid."
+    )
+    parser.add_argument("--timeout", type=float, default=None,
+        help="Wall time in minutes after which a job is killed."
+    )
+    parser.add_argument("--stall", type=float, default=None,
+        help="Kill a job when its output did not grow for this many minutes, "
+             "e.g. because of a hung MPI process."
+    )
+    parser.add_argument("--point-factor", type=float, default=None,
+        help="Kill a job when its current point takes longer than this "
+             "multiple of the median point runtime in the ledger, e.g. "
+             "when RASSCF oscillates without converging."
+    )
+    parser.add_argument("--cutoff", type=float, default=None,
+        help="Energy in eV above the lowest energy of the grid so far. When "
+             "a point exceeds it, the rest of its chain is cancelled and "
+             "marked as skipped, as the region is not of interest."
+    )
+    parser.add_argument("--rise", type=float, default=None,
+        help="Cancel the rest of a chain, when the energy along the chain "
+             "kept rising by more than this many eV."
+    )
+    parser.add_argument("--max-load", type=float, default=None,
+        help="Only start a job when the load average of the machine plus "
+             "the cores of the job stays below this value, e.g. on a shared "
+             "workstation."
+    )
+    parser.add_argument("--job-mem", default=None,
+        help="Memory a job needs in MB (or with a unit, e.g. '8Gb'). A job is "
+             "only started when this much memory is available. Defaults to "
+             "MOLCAS_MEM from the environment."
+    )
+    parser.add_argument("--mem-budget", default=None,
+        help="Memory in MB (or with a unit, e.g. '64Gb') for all jobs "
+             "together. Every job gets its share as MOLCAS_MEM. Memory freed "
+             "by finished jobs goes to the jobs started later, so the last "
+             "long columns of a grid get more memory."
+    )
+    parser.add_argument("--timings", action="append", default=None,
+        help="Ledger of an earlier run, e.g. of the same grid with a smaller "
+             "basis, to learn the runtime of every point from. Can be given "
+             "multiple times. Timings from the current ledger are always "
+             "used."
+    )
+
+    parser.add_argument("--cache", default=None,
+        help="Folder of a result cache shared between projects. All points "
+             "that finished successfully are stored in it, so 'mcgridprep "
+             "--cache' can skip them in other projects."
+    )
+    parser.add_argument("--speculate", action="store_true",
+        help="Use cores that would idle to run jobs before their parents "
+             "finished, from the best orbitals available. Once the point a "
+             "job should have been started from is done, the first point of "
+             "the job is run again from its orbitals. The results are kept "
+             "when both runs of this point agree, see --spec-de and "
+             "--spec-dci, and the rest of the job is computed again "
+             "otherwise."
+    )
+    parser.add_argument("--spec-de", type=float, default=0.01,
+        help="Largest energy difference in eV between the speculative and "
+             "the checked run of the first point of a job."
+    )
+    parser.add_argument("--spec-dci", type=float, default=0.1,
+        help="Largest difference of the weight of any CI configuration "
+             "between the speculative and the checked run of the first point "
+             "of a job."
+    )
+    parser.add_argument("--wavefront", action="store_true",
+        help="Ignore the fixed propagation order and start every point as "
+             "soon as any of its neighbours converged, from the orbitals of "
+             "the best converged neighbour. Needs one job per point, see "
+             "'mcgridprep --points'."
+    )
+    parser.add_argument("--wave-seed", choices=WAVE_SEEDS, default="nearest",
+        help="Neighbour a point takes its orbitals from in --wavefront mode. "
+             "'nearest' is the closest neighbour in coordinates, 'energy' the "
+             "neighbour whose energy is closest to the median energy of all "
+             "converged neighbours, which avoids a neighbour that ended up on "
+             "another root."
+    )
+    parser.add_argument("--worker", action="store_true",
+        help="Run as one of several workers, possibly on different machines, "
+             "that drain a queue directory on a shared filesystem. The first "
+             "worker creates the queue. Workers can join or leave at any "
+             "time. Can't be combined with --resume, as the queue already "
+             "knows which jobs finished."
+    )
+    parser.add_argument("--queue", default=None,
+        help=f"Queue directory of --worker. Defaults to '{QUEUE_DIR}' next "
+              "to job_inputs."
+    )
+    parser.add_argument("--lease", type=float, default=300.,
+        help="Seconds after which the jobs of a worker that stopped renewing "
+             "its claims, e.g. because it died, are returned to the queue."
+    )
+
+    parser.add_argument("--backend", choices=["local", ] + list(BACKENDS),
+        default="local",
+        help="Run the jobs on this machine or submit them as job arrays "
+             "to a batch system. Every array task keeps its own ledger next "
+             "to its job list in the batch folder, so --resume only skips "
+             "the points of the task itself and the --cutoff minimum is the "
+             "lowest energy the task has seen."
+    )
+    parser.add_argument("--pack", type=int, default=1,
+        help="Number of job inputs run by one array task of a batch system."
+    )
+    parser.add_argument("--batch-opt", action="append", default=None,
+        help="Additional option for the batch script, e.g. "
+             "'--partition=long'. Can be given multiple times."
+    )
+    parser.add_argument("--env-script", default=None,
+        help="Script that is sourced in the batch script to set up "
+             "OpenMolcas, e.g. setmolcas.sh."
+    )
+    parser.add_argument("--wait", action="store_true",
+        help="Wait until all submitted job arrays left the queue."
+    )
 
     return parser.parse_args(args)
 
 
+def split_input(text):
+    """Split a Molcas input into the header and the blocks of all points.
+
+    Blocks without an ID, e.g. intermediate steps inserted by refine_job,
+    are kept together with the point they lead to.
+
+    Returns the header and a list of (id, block) tuples."""
+    header, *blocks = re.split("^(?=&gateway)", text, flags=re.MULTILINE)
+    id_blocks = list()
+    steps = ""
+    for block in blocks:
+        mobj = re.search(ID_RE, block)
+        if mobj is None:
+            steps += block
+            continue
+        id_blocks.append((mobj[1], steps + block))
+        steps = ""
+    if steps and id_blocks:
+        id_, block = id_blocks[-1]
+        id_blocks[-1] = (id_, block + steps)
+    return header, id_blocks
+
+
+def set_inporb(header, inporb):
+    """Use inporb as starting orbitals in the header of a Molcas input."""
+    copy_line = f">> copy {inporb} $Project.RasOrb"
+    copy_re = "^>> copy \S+ \$Project\.RasOrb$"
+    if re.search(copy_re, header, flags=re.MULTILINE):
+        return re.sub(copy_re, copy_line, header, flags=re.MULTILINE)
+    return header.rstrip() + f"\n{copy_line}\n\n"
+
+
+def backup_path_from_input(text):
+    mobj = re.search("^>> export backup_path=(\S+)", text, flags=re.MULTILINE)
+    return Path(mobj[1]) if mobj else None
+
+
+def point_return_codes(text):
+    """Return codes of all modules, grouped by the ID of the point."""
+    point_rcs = dict()
+    for section in text.split("Start Module: gateway")[1:]:
+        mobj = re.search(ID_RE, section)
+        if mobj is None:
+            continue
+        point_rcs[mobj[1]] = re.findall(RC_RE, section)
+    return point_rcs
+
+
+def point_energies(text):
+    """Energy in Hartree of every point in a log, from the first root of
+    &rasscf or otherwise from &scf."""
+    energies = dict()
+    for section in text.split("Start Module: gateway")[1:]:
+        mobj = re.search(ID_RE, section)
+        if mobj is None:
+            continue
+        for energy_re in ENERGY_RES:
+            energy = re.search(energy_re, section)
+            if energy:
+                energies[mobj[1]] = float(energy[1])
+                break
+    return energies
+
+
+def point_log(text, id_):
+    """Section of a log with all modules of the point 'id_'."""
+    for section in text.split("Start Module: gateway")[1:]:
+        mobj = re.search(ID_RE, section)
+        if (mobj is not None) and (mobj[1] == id_):
+            return "--- Start Module: gateway" + section
+    return None
+
+
+def point_iterations(text):
+    """Number of RASSCF iterations of every point in a log."""
+    iterations = dict()
+    for section in text.split("Start Module: gateway")[1:]:
+        mobj = re.search(ID_RE, section)
+        iters = re.search(ITER_RE, section)
+        if (mobj is not None) and (iters is not None):
+            iterations[mobj[1]] = int(iters[1])
+    return iterations
+
+
+def point_compositions(text):
+    """Weights of the configurations in the first CI root of every point
+    in a log, as printed by &rasscf."""
+    compositions = dict()
+    for section in text.split("Start Module: gateway")[1:]:
+        mobj = re.search(ID_RE, section)
+        head = re.search(CI_HEAD_RE, section)
+        if (mobj is None) or (head is None):
+            continue
+        weights = dict()
+        for line in section[head.end():].split("\n"):
+            conf = re.match(CONF_RE, line)
+            if conf:
+                weights[conf[1]] = float(conf[2])
+            elif weights:
+                break
+        compositions[mobj[1]] = weights
+    return compositions
+
+
+def ci_change(weights_a, weights_b):
+    """Largest change in the weight of any configuration. Configurations
+    missing in one of the printouts have a negligible weight there."""
+    confs = set(weights_a) | set(weights_b)
+    return max([abs(weights_a.get(conf, 0.) - weights_b.get(conf, 0.))
+                for conf in confs], default=0.)
+
+
 def check_return_codes(fn):
     with open(fn) as handle:
         text = handle.read()
 
-    rc_re = "/rc=_(\w+)_"
-    return_codes = re.findall(rc_re, text)
+    return_codes = re.findall(RC_RE, text)
     fails = [i for i, rc in enumerate(return_codes)
              if rc != "RC_ALL_IS_WELL"
     ]
     if len(return_codes) == 0 or fails:
         print(f"FAIL {fn} ({[return_codes[i] for i in fails]})")
+    return point_return_codes(text)
+
+
+def point_states(text, returncode=None):
+    """State and first failed return code of every point in a log.
+
+    While pymolcas is running (returncode is None) the last point in the
+    log is still in progress and is left out. When pymolcas did not exit
+    normally the last point is incomplete and counts as failed, even if all
+    modules that ran so far were successful."""
+    point_rcs = point_return_codes(text)
+    ids = list(point_rcs.keys())
+    if not ids:
+        return dict()
+    last_id = ids[-1]
+    if returncode is None:
+        ids = ids[:-1]
+    states = dict()
+    for id_ in ids:
+        rcs = point_rcs[id_]
+        fails = [rc for rc in rcs if rc != RC_OK]
+        complete = (id_ != last_id) or (returncode == 0)
+        if rcs and not fails and complete:
+            states[id_] = (DONE, RC_OK)
+        else:
+            states[id_] = (FAILED, fails[0] if fails else None)
+    return states
+
+
+def point_artifacts(backup_path, id_):
+    if backup_path is None:
+        return list()
+    return sorted(backup_path.glob(f"{id_}.*"))
+
+
+def record_points(ledger, states, backup_path, recorded, energies=None):
+    """Record points from 'states' in the ledger that were not recorded
+    before and add them to the set 'recorded'."""
+    energies = dict() if energies is None else energies
+    for id_, (state, rc) in states.items():
+        if id_ in recorded:
+            continue
+        ledger.set_finished(id_, state, rc, point_artifacts(backup_path, id_),
+                            energies.get(id_))
+        recorded.add(id_)
+
+
+def check_cutoff(cutoff, states, energies, checked):
+    """Check the points that finished successfully since the last call
+    against the energy cutoff. Returns the first point that exceeds it and
+    the reason, or None."""
+    for id_, (state, _) in states.items():
+        if (id_ in checked) or (state != DONE) or (id_ not in energies):
+            continue
+        checked.add(id_)
+        cutoff.add({id_: energies[id_]})
+        reason = cutoff.check(id_)
+        if reason is not None:
+            return id_, reason
+    return None
+
+
+def rough_step(ids, states, energies, iterations, checked, jump=None,
+               max_iter=None, refined=()):
+    """Check the points that finished successfully since the last call for
+    a too large step from the point before them in the job: an energy
+    change of more than 'jump' eV or more than 'max_iter' RASSCF
+    iterations. Points in 'refined' were already rerun with intermediate
+    steps. Returns the first such point and the reason, or None."""
+    for prev_id, id_ in zip(ids[:-1], ids[1:]):
+        if (id_ in checked) or (states.get(id_, (None, ))[0] != DONE):
+            continue
+        checked.add(id_)
+        if id_ in refined:
+            continue
+        if jump and (prev_id in energies) and (id_ in energies):
+            change = abs(energies[id_] - energies[prev_id]) * AU2EV
+            if change > jump:
+                return id_, f"energy changed by {change:.2f} eV"
+        if max_iter and (iterations.get(id_, 0) > max_iter):
+            return id_, f"RASSCF needed {iterations[id_]} iterations"
+    return None
+
+
+def step_blocks(block_a, block_b, steps):
+    """Blocks at 'steps' geometries between the points of block_a and
+    block_b, that only propagate the orbitals with &rasscf. They have no
+    ID and copy nothing to the backup path, so they are not part of the
+    grid.
+
+    All numbers in the geometries are interpolated linearly, which works
+    for xyz coordinates and Z-matrices alike. Returns None when the
+    geometries can't be interpolated or there is no &rasscf."""
+    # Earlier intermediate steps in front of a point are not needed.
+    block_a = re.split("^(?=&gateway)", block_a, flags=re.MULTILINE)[-1]
+    block_b = re.split("^(?=&gateway)", block_b, flags=re.MULTILINE)[-1]
+    geom_re = "^&gateway.*?(?=^>> echo)"
+    geom_a = re.search(geom_re, block_a, flags=re.MULTILINE | re.DOTALL)
+    geom_b = re.search(geom_re, block_b, flags=re.MULTILINE | re.DOTALL)
+    rasscf = re.search("^&rasscf\n(?:(?!&|>>).*\n)*", block_b,
+                       flags=re.MULTILINE)
+    if (geom_a is None) or (geom_b is None) or (rasscf is None):
+        return None
+    nums_a = [float(num) for num in re.findall(FLOAT_RE, geom_a[0])]
+    nums_b = [float(num) for num in re.findall(FLOAT_RE, geom_b[0])]
+    if (len(nums_a) != len(nums_b)) or (nums_a == nums_b):
+        return None
+
+    blocks = list()
+    for step in range(1, steps+1):
+        frac = step / (steps + 1)
+        nums = iter([(1-frac)*num_a + frac*num_b
+                     for num_a, num_b in zip(nums_a, nums_b)])
+        geom = re.sub(FLOAT_RE, lambda _: f"{next(nums):.8f}", geom_b[0])
+        blocks.append(f"{geom}>> echo \"step {step}/{steps}\"\n\n&seward\n\n"
+                      f"{rasscf[0]}\n")
+    return blocks
+
+
+def first_failed(states):
+    failed = [id_ for id_, (state, _) in states.items() if state == FAILED]
+    return failed[0] if failed else None
+
+
+async def kill_job(proc, grace=10.):
+    """Terminate pymolcas and all programs it started. Programs that are
+    still running after 'grace' seconds, e.g. hung MPI processes, are
+    killed."""
+    try:
+        os.killpg(proc.pid, signal.SIGTERM)
+    except ProcessLookupError:
+        pass
+    try:
+        await asyncio.wait_for(proc.wait(), timeout=grace)
+    except asyncio.TimeoutError:
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+        await proc.wait()
+
+
+class Watchdog:
+    """Flags a job that ran longer than 'timeout' seconds, whose output
+    did not grow for 'stall' seconds or whose current point runs longer
+    than 'point_timeout' seconds."""
+
+    def __init__(self, timeout=None, stall=None, point_timeout=None):
+        now = time.time()
+        self.timeout = timeout
+        self.stall = stall
+        self.point_timeout = point_timeout
+        self.start = now
+        self.grown = now
+        self.size = 0
+        self.point_start = now
+        self.points = 0
+
+    def check(self, out_fn, finished_points):
+        """Returns the reason, when the job has to be killed."""
+        now = time.time()
+        try:
+            size = os.stat(out_fn).st_size
+        except FileNotFoundError:
+            size = 0
+        if size != self.size:
+            self.size = size
+            self.grown = now
+        if finished_points != self.points:
+            self.points = finished_points
+            self.point_start = now
+
+        if self.timeout and (now - self.start > self.timeout):
+            return "wall time exceeded"
+        if self.stall and (now - self.grown > self.stall):
+            return "output stalled"
+        if self.point_timeout and (now - self.point_start > self.point_timeout):
+            return "point time exceeded"
+        return None
+
+
+def point_timeout(ledger, point_factor, min_points=3):
+    """'point_factor' times the median point runtime in the ledger, when
+    enough points were timed."""
+    if (ledger is None) or not point_factor:
+        return None
+    durations = list(ledger.durations().values())
+    if len(durations) < min_points:
+        return None
+    return point_factor * float(np.median(durations))
+
 
+def chain_prevs(job_inputs, job_deps, points):
+    """Point every point was started from, following the jobs and the seed
+    RasOrbs they need."""
+    prevs = dict()
+    for job_input in job_inputs:
+        ids = points[job_input]
+        needs = [seed_id(fn) for fn in
+                 job_deps.get(job_input, dict()).get("needs", list())]
+        needs = [id_ for id_ in needs if id_ is not None]
+        if ids and needs:
+            prevs[ids[0]] = needs[0]
+        prevs.update(zip(ids[1:], ids[:-1]))
+    return prevs
 
-def run_job(job_input, save_path):
+
+class EnergyCutoff:
+    """Decides if the rest of a chain is worth computing, from the energies
+    of the points that finished so far.
+
+    A point exceeds the cutoff when its energy lies more than 'cutoff' eV
+    above the lowest energy seen on the grid, or when the energy rose by
+    more than 'rise' eV over the consecutive points leading to it. 'prevs'
+    maps every point to the point it was started from."""
+
+    def __init__(self, cutoff=None, rise=None, prevs=None, energies=None):
+        self.cutoff = cutoff
+        self.rise = rise
+        self.prevs = dict() if prevs is None else prevs
+        self.energies = dict() if energies is None else dict(energies)
+
+    def add(self, energies):
+        self.energies.update(energies)
+
+    @property
+    def minimum(self):
+        return min(self.energies.values(), default=None)
+
+    def rising(self, id_):
+        """Energy in Hartree the chain rose by until reaching 'id_'."""
+        lowest = energy = self.energies[id_]
+        prev = self.prevs.get(id_)
+        while (prev in self.energies) and (self.energies[prev] < lowest):
+            lowest = self.energies[prev]
+            prev = self.prevs.get(prev)
+        return energy - lowest
+
+    def check(self, id_):
+        """Returns the reason, when the chain has to be cancelled after
+        'id_'."""
+        if id_ not in self.energies:
+            return None
+        above = (self.energies[id_] - self.minimum) * AU2EV
+        if (self.cutoff is not None) and (above > self.cutoff):
+            return f"{above:.2f} eV above the grid minimum"
+        rise = self.rising(id_) * AU2EV
+        if (self.rise is not None) and (rise > self.rise):
+            return f"energy rose by {rise:.2f} eV"
+        return None
+
+
+def read_text(fn):
+    try:
+        with open(fn) as handle:
+            return handle.read()
+    except FileNotFoundError:
+        return ""
+
+
+def scratch_root(scratch, min_free=0.):
+    """Select the directory the temporary job directory is created in.
+
+    The first directory in 'scratch' with at least 'min_free' GB of free
+    space is used. When no directory has enough space left, the one with the
+    most free space is used. Without 'scratch' the default temporary
+    directory ($TMPDIR) is used."""
+    if not scratch:
+        return None
+    free = [shutil.disk_usage(dir_).free / 1024**3 for dir_ in scratch]
+    for dir_, gb in zip(scratch, free):
+        if gb >= min_free:
+            return dir_
+    dir_, gb = max(zip(scratch, free), key=lambda dir_gb: dir_gb[1])
+    print(f"No scratch directory has {min_free:.1f} GB of free space left. "
+          f"Using '{dir_}' with {gb:.1f} GB.")
+    return dir_
+
+
+def same_filesystem(src, dst_dir):
+    return os.stat(src).st_dev == os.stat(dst_dir).st_dev
+
+
+def place_file(src, dst, move=False):
+    """Copy src to dst, but avoid the copy when both are on the same
+    filesystem. Then src is renamed, when it is moved, or hardlinked.
+    When that fails anyway, e.g. across bind mounts, src is copied."""
+    src, dst = Path(src), Path(dst)
+    if same_filesystem(src, dst.parent):
+        try:
+            if move:
+                os.replace(src, dst)
+                return
+            if dst.exists():
+                dst.unlink()
+            os.link(src, dst)
+            return
+        except OSError:
+            pass
+    shutil.copy(src, dst)
+    if move:
+        src.unlink()
+
+
+async def run_job(job_input, save_path, ledger=None, poll=5., seeds=None,
+                  retries=0, tried=None, env=None, scratch=None, min_free=0.,
+                  stream_out=False, timeout=None, stall=None,
+                  point_factor=None, cutoff=None, mem=None, jump=None,
+                  max_iter=None, steps=2, refined=None):
+    """Run pymolcas on job_input.
+
+    When retries > 0 and a point fails, the job is stopped right away, as
+    all following points would start from the orbitals of the failed point.
+    The failed point is then rerun with alternative starting orbitals from
+    'seeds' and the rest of the job continues from there. At most
+    'retries' seeds are tried for every point.
+
+    Variables in 'env' are set in the environment of pymolcas. The job is
+    run in a temporary directory below one of the 'scratch' directories,
+    see 'scratch_root'. With 'stream_out' pymolcas writes its output
+    directly to 'save_path' instead of the temporary directory. Everything
+    pymolcas prints itself is captured in a '.stdout' file in 'save_path'.
+    With 'mem' MOLCAS_MEM is set to this many MB.
+
+    pymolcas is killed when the job runs longer than 'timeout' seconds,
+    when its output does not grow for 'stall' seconds or when a point
+    takes longer than 'point_factor' times the median point runtime. The
+    point in progress is then recorded as timed out and the rest of the
+    job is continued like after a failed point.
+
+    When the energy changes by more than 'jump' eV between two points or a
+    point needs more than 'max_iter' RASSCF iterations, the step between
+    the points was probably too large. The job is stopped and the point is
+    rerun with 'steps' intermediate steps, see refine_job. Points in
+    'refined' already were.
+
+    With an EnergyCutoff 'cutoff' the job is stopped after the first point
+    that exceeds it. The points after it that did not run yet are recorded
+    as skipped. This point and all points after it are returned as
+    'stopped', so the runner can skip the jobs started from them.
+
+    When the job is cancelled, pymolcas is killed."""
     start = time.time()
-    with tempfile.TemporaryDirectory() as tmp_dir:
+    seeds = dict() if seeds is None else seeds
+    tried = dict() if tried is None else tried
+    refined = set() if refined is None else refined
+    with open(job_input) as handle:
+        inp_text = handle.read()
+    _, blocks = split_input(inp_text)
+    ids = [id_ for id_, _ in blocks]
+    backup_path = backup_path_from_input(inp_text)
+    if ledger:
+        ledger.set_running(job_input, ids)
+    recorded = set()
+    failed_id = None
+    timed_out = None
+    cut = None
+    checked = set()
+    rough = None
+    smooth = set()
+    watchdog = Watchdog(timeout, stall, point_timeout(ledger, point_factor))
+
+    work_root = scratch_root(scratch, min_free)
+    with tempfile.TemporaryDirectory(dir=work_root) as tmp_dir, \
+         open(save_path / Path(job_input).with_suffix(".stdout").name,
+              "w") as stdout:
         print(f"Running {job_input} in {tmp_dir}")
-        out_path = Path(job_input).with_suffix(".out")
-        shutil.copy(job_input, tmp_dir)
-        args = f"pymolcas -b0 {job_input} -oe {out_path}".split()
+        # Only the name of job_input is used in the job directory, so jobs
+        # of other projects can be given with their full path.
+        out_path = Path(Path(job_input).name).with_suffix(".out")
+        out_saved = save_path / out_path
+        place_file(job_input, Path(tmp_dir) / Path(job_input).name)
+        tmp_out = Path(tmp_dir) / out_path
+        if stream_out:
+            tmp_out = out_saved
+        args = f"pymolcas -b0 {Path(job_input).name} -oe {tmp_out}".split()
 
-        proc = subprocess.Popen(args, cwd=tmp_dir)
-        proc.wait()
-        out_saved = save_path / Path(out_path).name
-        shutil.copy(tmp_dir / out_path, out_saved)
+        # Start pymolcas in a new session, so it can be killed together
+        # with all programs it starts.
+        proc_env = os.environ.copy()
+        if env:
+            proc_env.update(env)
+        if mem:
+            proc_env["MOLCAS_MEM"] = str(int(mem))
+        proc = await asyncio.create_subprocess_exec(
+            *args, cwd=tmp_dir, env=proc_env, stdout=stdout,
+            stderr=asyncio.subprocess.STDOUT, start_new_session=True
+        )
+        try:
+            while True:
+                try:
+                    await asyncio.wait_for(proc.wait(), timeout=poll)
+                    break
+                except asyncio.TimeoutError:
+                    pass
+                text = read_text(tmp_out)
+                states = point_states(text)
+                energies = point_energies(text)
+                # Record finished points while the job is still running, so
+                # they are not lost when the machine goes down.
+                if ledger:
+                    record_points(ledger, states, backup_path, recorded,
+                                  energies)
+                if jump or max_iter:
+                    rough = rough_step(ids, states, energies,
+                                       point_iterations(text), smooth, jump,
+                                       max_iter, refined)
+                if rough is not None:
+                    print(f"Point {rough[0]} in {job_input}: {rough[1]}. "
+                           "Stopping job.")
+                    await kill_job(proc)
+                    break
+                if cutoff is not None:
+                    cut = check_cutoff(cutoff, states, energies, checked)
+                if cut is not None:
+                    print(f"Point {cut[0]} in {job_input}: {cut[1]}. "
+                           "Cancelling the rest of the chain.")
+                    await kill_job(proc)
+                    break
+                if retries > 0:
+                    failed_id = first_failed(states)
+                if failed_id is not None:
+                    print(f"Point {failed_id} in {job_input} failed. "
+                           "Stopping job.")
+                    await kill_job(proc)
+                    break
+                reason = watchdog.check(tmp_out, len(states))
+                if reason is not None:
+                    timed_out = (ids[len(states)] if len(states) < len(ids)
+                                 else ids[-1], reason)
+                    print(f"Point {timed_out[0]} in {job_input}: {reason}. "
+                           "Killing job.")
+                    await kill_job(proc)
+                    break
+        except asyncio.CancelledError:
+            print(f"Cancelled {job_input}.")
+            await kill_job(proc)
+            raise
+        if not stream_out:
+            await asyncio.to_thread(place_file, tmp_out, out_saved, move=True)
 
     end = time.time()
     duration = end - start
     mins = duration / 60
     print(f"... calculations in {job_input} took {mins:.1f} min")
     check_return_codes(out_saved)
+    # A killed job is treated like a running job, so the point that was
+    # in progress is not marked as failed.
+    returncode = None if (failed_id or timed_out or cut or rough) \
+                 else proc.returncode
+    text = read_text(out_saved)
+    states = point_states(text, returncode)
+    energies = point_energies(text)
+    if timed_out:
+        states.pop(timed_out[0], None)
+    # Points that finished since the last check may have been reached with
+    # a too large step, too.
+    if (jump or max_iter) and (rough is None) and (cut is None):
+        rough = rough_step(ids, states, energies, point_iterations(text),
+                           smooth, jump, max_iter, refined)
+        if rough is not None:
+            print(f"Point {rough[0]} in {job_input}: {rough[1]}.")
+    # The job may have finished points beyond the cutoff since the last
+    # check. Then only the jobs started from them are skipped.
+    if (cutoff is not None) and (cut is None) and (rough is None):
+        cut = check_cutoff(cutoff, states, energies, checked)
+        if cut is not None:
+            print(f"Point {cut[0]} in {job_input}: {cut[1]}.")
+    stopped = list()
+    if cut is not None:
+        stopped = ids[ids.index(cut[0]):]
+    skipped = [id_ for id_ in stopped[1:] if id_ not in states]
+    if ledger:
+        record_points(ledger, states, backup_path, recorded, energies)
+        if timed_out:
+            ledger.set_finished(timed_out[0], TIMEOUT, timed_out[1])
+            recorded.add(timed_out[0])
+        for id_ in skipped:
+            ledger.set_finished(id_, SKIPPED, f"after {cut[0]}: {cut[1]}")
+            recorded.add(id_)
+        # Points that were never reached can be run again.
+        ledger.set_pending([id_ for id_ in ids if id_ not in recorded])
     sys.stdout.flush()
+    result = {
+        "job_input": job_input,
+        "out": out_saved,
+        "returncode": proc.returncode,
+        "duration": duration,
+        "timed_out": timed_out,
+        "stopped": stopped,
+        "skipped": skipped,
+    }
+    # Points after the cutoff are not worth retrying.
+    if cut is not None:
+        return result
+    run_kwargs = dict(
+        save_path=save_path, ledger=ledger, poll=poll, env=env,
+        scratch=scratch, min_free=min_free, stream_out=stream_out,
+        timeout=timeout, stall=stall, point_factor=point_factor,
+        cutoff=cutoff, mem=mem, jump=jump, max_iter=max_iter, steps=steps
+    )
+    if rough is not None:
+        refine_result = await refine_job(
+            job_input, rough[0], refined, seeds=seeds, retries=retries,
+            tried=tried, **run_kwargs
+        )
+        if refine_result is not None:
+            return refine_result
+    if retries > 0:
+        failed_id = first_failed(states)
+    # The points after a timed out point were never run, so they are
+    # continued, even without retries.
+    if timed_out:
+        failed_id = timed_out[0]
+    if failed_id is not None:
+        retry_result = await retry_job(
+            job_input, failed_id, seeds, retries, tried, refined=refined,
+            **run_kwargs
+        )
+        if retry_result is not None:
+            result = retry_result
+    return result
+
+
+async def retry_job(job_input, failed_id, seeds, retries, tried,
+                    **run_kwargs):
+    """Rerun the failed point and all points after it, starting from
+    the next available alternative seed.
+
+    When no seeds are left, only the points after the failed point are
+    run, starting from the orbitals of the failed point, as they would
+    have been without retries. 'run_kwargs' are passed on to run_job."""
+    with open(job_input) as handle:
+        text = handle.read()
+    header, blocks = split_input(text)
+    ids = [id_ for id_, _ in blocks]
+    failed_ind = ids.index(failed_id)
+    backup_path = backup_path_from_input(text)
+
+    tried_seeds = tried.get(failed_id, list())
+    candidates = [seed for seed in seeds.get(failed_id, list())
+                  if (seed not in tried_seeds) and Path(seed).exists()]
+    stem = Path(job_input).with_suffix("")
+    if candidates and (len(tried_seeds) < retries):
+        seed = candidates[0]
+        tried = tried.copy()
+        tried[failed_id] = tried_seeds + [seed, ]
+        attempt = len(tried[failed_id])
+        todo = blocks[failed_ind:]
+        retry_input = f"{stem}.retry{attempt}.in"
+        print(f"Retrying point {failed_id} from '{seed}' in '{retry_input}'.")
+    else:
+        todo = blocks[failed_ind+1:]
+        if not todo:
+            return None
+        seed = backup_path / f"{failed_id}.RasOrb"
+        retry_input = f"{stem}.cont.in"
+        print(f"No seeds left for point {failed_id}. Continuing with the "
+              f"remaining points in '{retry_input}'.")
+    # Without a RasOrb of the failed point the original INPORB is kept.
+    if Path(seed).exists():
+        header = set_inporb(header, seed)
+    with open(retry_input, "w") as handle:
+        handle.write(header + "".join([block for _, block in todo]))
+    return await run_job(retry_input, seeds=seeds, retries=retries,
+                         tried=tried, **run_kwargs)
+
+
+async def refine_job(job_input, rough_id, refined, **run_kwargs):
+    """Rerun the point 'rough_id' and all points after it, starting from
+    the RasOrb of the point before it. The orbitals are first propagated
+    over intermediate geometries between both points, see step_blocks.
+
+    When the intermediate steps fail, the points are rerun without them.
+    When no steps can be inserted, the points after 'rough_id' are
+    continued from its orbitals. 'run_kwargs' are passed on to run_job."""
+    with open(job_input) as handle:
+        text = handle.read()
+    header, blocks = split_input(text)
+    ids = [id_ for id_, _ in blocks]
+    rough_ind = ids.index(rough_id)
+    prev_id = ids[rough_ind-1]
+    backup_path = backup_path_from_input(text)
+    stem = Path(job_input).with_suffix("")
+    refined = refined | {rough_id, }
+    seed = backup_path / f"{prev_id}.RasOrb"
+    steps = step_blocks(blocks[rough_ind-1][1], blocks[rough_ind][1],
+                        run_kwargs["steps"])
+
+    if (steps is None) or not seed.exists():
+        todo = blocks[rough_ind+1:]
+        if not todo:
+            return None
+        cont_input = f"{stem}.cont.in"
+        rasorb = backup_path / f"{rough_id}.RasOrb"
+        if rasorb.exists():
+            header = set_inporb(header, rasorb)
+        with open(cont_input, "w") as handle:
+            handle.write(header + "".join([block for _, block in todo]))
+        print(f"Can't insert steps between {prev_id} and {rough_id}. "
+              f"Continuing with the remaining points in '{cont_input}'.")
+        return await run_job(cont_input, refined=refined, **run_kwargs)
+
+    header = set_inporb(header, seed)
+    todo = "".join([block for _, block in blocks[rough_ind:]])
+    refine_input = f"{stem}.steps.in"
+    with open(refine_input, "w") as handle:
+        handle.write(header + "".join(steps) + todo)
+    print(f"Inserting {len(steps)} steps between {prev_id} and {rough_id} "
+          f"in '{refine_input}'.")
+    start = time.time()
+    result = await run_job(refine_input, refined=refined, **run_kwargs)
+    # The point converged again when it was recorded as done or, without a
+    # ledger, when its RasOrb was written by this run.
+    ledger = run_kwargs.get("ledger")
+    rough_rasorb = backup_path / f"{rough_id}.RasOrb"
+    if ledger:
+        converged = ledger.is_done(rough_id)
+    else:
+        converged = rough_rasorb.exists() \
+                    and (rough_rasorb.stat().st_mtime >= start)
+    if converged:
+        return result
+    nosteps_input = f"{stem}.nosteps.in"
+    with open(nosteps_input, "w") as handle:
+        handle.write(header + todo)
+    print(f"The steps in '{refine_input}' failed. Rerunning {rough_id} "
+          f"without them in '{nosteps_input}'.")
+    return await run_job(nosteps_input, refined=refined, **run_kwargs)
+
+
+def load_job_deps(job_inputs_fn, deps_fn=None):
+    if deps_fn is None:
+        deps_fn = Path(job_inputs_fn).parent / "job_deps.yaml"
+        if not deps_fn.is_file():
+            return None
+    with open(deps_fn) as handle:
+        job_deps = yaml.safe_load(handle)
+    print(f"Loaded job dependencies from '{deps_fn}'")
+    return job_deps
+
+
+def barrier_deps(job_inputs):
+    """Dependencies for job inputs without a 'job_deps.yaml'. The columns
+    are only started after both parts of the equilibrium row finished."""
+    rows, cols = job_inputs[:2], job_inputs[2:]
+    job_deps = {job_input: {"after": list()} for job_input in rows}
+    job_deps.update({job_input: {"after": rows} for job_input in cols})
+    return job_deps
+
+
+def file_landed(fn, not_before, sizes):
+    """Check if fn was written after not_before and its size is stable.
+
+    The size of the file is compared to the size recorded in 'sizes'
+    during the previous call, so a file that is still being copied
+    is not used yet."""
+    try:
+        stat = os.stat(fn)
+    except FileNotFoundError:
+        return False
+    prev_size = sizes.get(fn)
+    sizes[fn] = stat.st_size
+    return (stat.st_mtime >= not_before) and (stat.st_size == prev_size)
+
+
+def seed_is_good(fn, ledger):
+    """Check that the ledger does not know about a problem with the point
+    the RasOrb fn belongs to, e.g. when it failed and is retried."""
+    if (ledger is None) or not fn.endswith(".RasOrb"):
+        return True
+    point = ledger.get(Path(fn).name[:-len(".RasOrb")])
+    return (point is None) or ledger.is_done(point["id"])
+
+
+def job_is_ready(deps, finished, not_before, sizes, ready_files=(),
+                 ledger=None):
+    """A job is ready when all jobs it depends on finished, or when all
+    files it needs already landed, e.g. the seed RasOrb of a column that
+    is written while the equilibrium row is still running. Files in
+    ready_files, e.g. from points done in a previous run, count as landed."""
+    # Jobs without parents, that start from the INPORB of the
+    # configuration, are always ready.
+    after = deps.get("after", list())
+    if all([job in finished for job in after]):
+        return True
+    needs = deps.get("needs", list())
+    # Evaluate all files, so the recorded sizes stay up to date.
+    landed = [(fn in ready_files)
+              or (file_landed(fn, not_before, sizes) and seed_is_good(fn, ledger))
+              for fn in needs]
+    return bool(needs) and all(landed)
+
+
+def chain_lengths(job_inputs, job_deps, costs=None):
+    """Cost of the longest chain of jobs starting at every job, the job
+    itself included. Without 'costs' every point costs one unit."""
+    children = {job_input: list() for job_input in job_inputs}
+    for job_input in job_inputs:
+        for parent in job_deps.get(job_input, dict()).get("after", list()):
+            if parent in children:
+                children[parent].append(job_input)
+
+    lengths = dict()
+    # Job inputs are written in propagation order, so all children of a
+    # job are already handled when going through the jobs in reverse.
+    for job_input in job_inputs[::-1]:
+        if costs is None:
+            cost = len(job_deps.get(job_input, dict()).get("ids", [None, ]))
+        else:
+            cost = costs[job_input]
+        lengths[job_input] = cost + max(
+            [lengths[child] for child in children[job_input]], default=0
+        )
+    return lengths
+
+
+def job_ids(job_input, job_deps):
+    try:
+        return job_deps[job_input]["ids"]
+    except KeyError:
+        with open(job_input) as handle:
+            _, blocks = split_input(handle.read())
+        return [id_ for id_, _ in blocks]
+
+
+def point_is_done(ledger, backup_path, id_, cas=True):
+    if not ledger.is_done(id_):
+        return False
+    # Without &rasscf no HDF5 files are written, so the ledger has to do.
+    return (not cas) or (backup_path / f"{id_}.rasscf.h5").exists()
+
+
+def resume_job(job_input, ledger, keep_skipped=False):
+    """Determine what is left to do for a job from a previous run.
+
+    Returns None when all points finished successfully. Otherwise the
+    job input to run is returned, which is a new input, continuing from the
+    RasOrb of the last good point, when some points are already done. With
+    'keep_skipped' points skipped by the energy cutoff count as done."""
+    with open(job_input) as handle:
+        text = handle.read()
+    header, blocks = split_input(text)
+    backup_path = backup_path_from_input(text)
+    cas = "&rasscf" in text
+    skipped = set(ledger.ids_in_state(SKIPPED))
+    done = [point_is_done(ledger, backup_path, id_, cas)
+            or (keep_skipped and (id_ in skipped))
+            for id_, _ in blocks]
+    if all(done):
+        return None
+    first_todo = done.index(False)
+    if first_todo == 0:
+        return job_input
+
+    last_good = blocks[first_todo-1][0]
+    rasorb = backup_path / f"{last_good}.RasOrb"
+    if rasorb.exists():
+        header = set_inporb(header, rasorb)
+    todo = [block for (_, block), is_done in zip(blocks, done) if not is_done]
+    resume_input = str(Path(job_input).with_suffix(".resume.in"))
+    with open(resume_input, "w") as handle:
+        handle.write(header + "".join(todo))
+    print(f"Resuming {job_input} after point {last_good} in '{resume_input}'.")
+    return resume_input
+
+
+def resume_jobs(job_inputs, job_deps, ledger, keep_skipped=False):
+    """Resume all jobs from a previous run, see resume_job.
+
+    Returns the jobs that already finished, the inputs to run in place of
+    the other jobs and the seed files of points that are already done,
+    which can be used right away."""
+    ready_files = set()
+    for deps in job_deps.values():
+        ready_files |= set([fn for fn in deps.get("needs", list())
+                            if fn.endswith(".RasOrb")
+                            and ledger.is_done(Path(fn).name[:-7])])
+    finished = set()
+    run_inputs = dict()
+    for job_input in job_inputs:
+        to_run = resume_job(job_input, ledger, keep_skipped)
+        if to_run is None:
+            finished.add(job_input)
+        elif to_run != job_input:
+            run_inputs[job_input] = to_run
+    print(f"Skipping {len(finished)} jobs that already finished.")
+    return finished, run_inputs, ready_files
+
+
+def job_priorities(job_inputs, job_deps, cost_model=None, points=None):
+    if cost_model is None:
+        return chain_lengths(job_inputs, job_deps)
+    costs = {job_input: cost_model.job_cost(points[job_input])
+             for job_input in job_inputs}
+    return chain_lengths(job_inputs, job_deps, costs)
+
+
+def job_mem(admission, threads, scale_cores):
+    """Memory of a job in MB. With MPI every process has MOLCAS_MEM."""
+    if (admission is None) or (admission.job_mem is None):
+        return None
+    return admission.job_mem * (threads if scale_cores == "mpi" else 1)
+
+
+def mem_share(mem_budget, used, free_cores, waiting):
+    """Memory in MB for the next job from what is left of 'mem_budget', so
+    the rest is enough for the other jobs that can still be started."""
+    return (mem_budget - used) / max(1, min(free_cores, waiting))
+
+
+def part_kwargs(env, mem, threads, scale_cores):
+    """Keyword arguments of 'run_part' for a job with 'mem' MB. With MPI
+    the memory is split between the processes."""
+    kwargs = {"env": env}
+    if mem is not None:
+        kwargs["mem"] = mem / threads if scale_cores == "mpi" else mem
+    return kwargs
+
+
+def hold_back(admission, held, threads, scale_cores, mem=None):
+    """Reason to hold back the next job, when the machine is busy. A
+    message is printed whenever jobs are held back or started again after
+    'held'."""
+    if admission is None:
+        return None
+    if mem is None:
+        mem = job_mem(admission, threads, scale_cores)
+    reason = admission.check(threads, mem)
+    if (reason is not None) and (held is None):
+        print(f"Holding back new jobs: {reason}.")
+    elif (reason is None) and (held is not None):
+        print("Starting new jobs again.")
+    return reason
+
+
+def stopped_points(result):
+    """Points of a finished job no other point may be started from: the
+    point that exceeded the energy cutoff and all points after it."""
+    if not isinstance(result, dict):
+        return set()
+    return set(result.get("stopped", list()))
+
+
+def skip_orphans(jobs, job_deps, stopped, ledger=None, points=None,
+                 ledgers=None):
+    """Jobs among 'jobs' that would start from a point in 'stopped'.
+
+    Their points are added to 'stopped', so the jobs started from them
+    are skipped as well, and are marked as skipped in the ledger, or in
+    the ledger of the job in 'ledgers'."""
+    skipped = list()
+    while True:
+        orphans = [
+            job_input for job_input in jobs
+            if (job_input not in skipped)
+            and any([seed_id(fn) in stopped for fn in
+                     job_deps.get(job_input, dict()).get("needs", list())])
+        ]
+        if not orphans:
+            break
+        for job_input in orphans:
+            ids = points[job_input] if points else job_ids(job_input, job_deps)
+            stopped |= set(ids)
+            job_ledger = ledgers.get(job_input, ledger) if ledgers else ledger
+            if job_ledger:
+                for id_ in ids:
+                    job_ledger.set_finished(id_, SKIPPED, "seed skipped")
+            skipped.append(job_input)
+    return skipped
+
+
+def thread_env(threads, scale_cores):
+    """Environment variables to run a job on 'threads' cores, either
+    with OpenMP threads or with MPI processes."""
+    if scale_cores == "omp":
+        return {"OMP_NUM_THREADS": str(threads), }
+    elif scale_cores == "mpi":
+        return {"MOLCAS_NPROCS": str(threads), "OMP_NUM_THREADS": "1"}
+    return dict()
+
+
+class Speculation:
+    """Runs jobs ahead of their parents on cores that would idle otherwise.
+
+    A speculative job starts from the best orbitals that are available,
+    see 'seed', and writes its results to a 'spec' folder in the backup
+    path, without recording them in the ledger. Once the point the job
+    should have been started from is done, only the first point of the job
+    is run again from its orbitals, see 'write_check'. When the energies of
+    both runs of this point differ by at most 'max_de' eV and no
+    configuration weight in the CI differs by more than 'max_dci', the
+    speculative run followed the same state and the rest of its results
+    are accepted. Otherwise the rest of the job is run again from the
+    checked point. Results with too large steps ('jump', 'max_iter') or
+    beyond the EnergyCutoff 'cutoff' are run again, too, so run_job can
+    handle them."""
+
+    def __init__(self, job_inputs, job_deps, ledger, max_de=0.01,
+                 max_dci=0.1, cutoff=None, jump=None, max_iter=None):
+        self.job_deps = job_deps
+        self.ledger = ledger
+        self.max_de = max_de
+        self.max_dci = max_dci
+        self.cutoff = cutoff
+        self.jump = jump
+        self.max_iter = max_iter
+        self.point_jobs = {id_: job_input for job_input in job_inputs
+                           for id_ in job_ids(job_input, job_deps)}
+        self.tasks = dict()
+        self.checks = dict()
+        self.results = dict()
+        self.spec_points = set()
+
+    @staticmethod
+    def spec_path(backup_path):
+        return Path(backup_path) / "spec"
+
+    def rasorb_needs(self, job_input):
+        return [fn for fn in self.job_deps.get(job_input, dict())
+                                          .get("needs", list())
+                if fn.endswith(".RasOrb")]
+
+    def seed(self, job_input):
+        """RasOrb of the closest point up the chain of 'job_input' that is
+        done or was computed speculatively. At the head of the chain the
+        starting orbitals of the chain are used."""
+        needs = self.rasorb_needs(job_input)
+        if not needs:
+            return None
+        fn = needs[0]
+        id_ = seed_id(fn)
+        while id_ in self.point_jobs:
+            parent = self.point_jobs[id_]
+            ids = job_ids(parent, self.job_deps)
+            for prev in ids[:ids.index(id_)+1][::-1]:
+                rasorb = Path(fn).parent / f"{prev}.RasOrb"
+                if self.ledger.is_done(prev) and rasorb.exists():
+                    return str(rasorb)
+                if prev in self.spec_points:
+                    return str(self.spec_path(rasorb.parent) / rasorb.name)
+            needs = self.rasorb_needs(parent)
+            if not needs:
+                return None
+            fn = needs[0]
+            id_ = seed_id(fn)
+        return fn
+
+    def candidates(self, pending, ready):
+        """Pending jobs that can be run speculatively. A job of a single
+        point would be checked by running it again, so nothing is won."""
+        return [job_input for job_input in pending
+                if (job_input not in ready)
+                and (job_input not in self.tasks.values())
+                and (job_input not in self.results)
+                and (len(job_ids(job_input, self.job_deps)) > 1)
+                and (self.seed(job_input) is not None)]
+
+    def write_input(self, job_input, seed):
+        with open(job_input) as handle:
+            text = handle.read()
+        spec_path = self.spec_path(backup_path_from_input(text))
+        os.makedirs(spec_path, exist_ok=True)
+        header, blocks = split_input(text)
+        header = re.sub("^>> export backup_path=\S+",
+                        f">> export backup_path={spec_path}", header,
+                        flags=re.MULTILINE)
+        spec_input = str(Path(job_input).with_suffix("")) + ".spec.in"
+        with open(spec_input, "w") as handle:
+            handle.write(set_inporb(header, seed)
+                         + "".join([block for _, block in blocks]))
+        return spec_input
+
+    def write_check(self, job_input):
+        """Input of the first point of a job, started from the orbitals it
+        should be started from."""
+        with open(job_input) as handle:
+            header, blocks = split_input(handle.read())
+        check_input = str(Path(job_input).with_suffix("")) + ".check.in"
+        with open(check_input, "w") as handle:
+            handle.write(header + blocks[0][1])
+        return check_input
+
+    def write_rerun(self, job_input):
+        """Input of the points of a job after the first one, started from
+        the orbitals of the first point."""
+        with open(job_input) as handle:
+            text = handle.read()
+        header, blocks = split_input(text)
+        rasorb = backup_path_from_input(text) / f"{blocks[0][0]}.RasOrb"
+        rerun_input = str(Path(job_input).with_suffix("")) + ".rerun.in"
+        with open(rerun_input, "w") as handle:
+            handle.write(set_inporb(header, rasorb)
+                         + "".join([block for _, block in blocks[1:]]))
+        return rerun_input
+
+    def started(self, task, job_input):
+        self.tasks[task] = job_input
+
+    def checking(self, task, job_input):
+        self.checks[task] = job_input
+
+    def landed(self, task):
+        """Keep the results of a finished speculative job."""
+        job_input = self.tasks.pop(task)
+        result = task.result()
+        text = read_text(result["out"])
+        states = point_states(text, result["returncode"])
+        self.results[job_input] = (states, point_energies(text),
+                                   point_compositions(text),
+                                   point_iterations(text))
+        self.spec_points |= set([id_ for id_, (state, _) in states.items()
+                                 if state == DONE])
+        return job_input
+
+    def waits(self, job_input):
+        """A ready job waits while its speculative run is still going on."""
+        return job_input in self.tasks.values()
+
+    def verify(self, task):
+        """Accept or reject the speculative results of a job, once the
+        first point of the job was checked by 'task'.
+
+        Returns None when the job is done, otherwise the input to run in
+        place of the job."""
+        job_input = self.checks.pop(task)
+        result = task.result()
+        states, energies, compositions, iterations = \
+            self.results.pop(job_input)
+        ids = job_ids(job_input, self.job_deps)
+        first = ids[0]
+        with open(job_input) as handle:
+            backup_path = backup_path_from_input(handle.read())
+        # The first point is beyond the cutoff and run_job already skipped
+        # the jobs started from it. The rest of the job is skipped, too.
+        if stopped_points(result):
+            for id_ in ids[1:]:
+                self.ledger.set_finished(id_, SKIPPED,
+                                         f"after {first}: energy cutoff")
+            return None
+        if not self.ledger.is_done(first):
+            print(f"Checking {first} of {job_input} failed. Running the "
+                  "job again.")
+            return job_input
+
+        text = read_text(result["out"])
+        check_energy = point_energies(text).get(first)
+        check_ci = point_compositions(text).get(first)
+        reason = None
+        if not all([states.get(id_, (FAILED, ))[0] == DONE for id_ in ids]):
+            reason = "it failed"
+        elif (check_energy is None) or (check_ci is None) \
+                or (first not in energies) or (first not in compositions):
+            reason = f"{first} can't be compared"
+        else:
+            de = abs(energies[first] - check_energy) * AU2EV
+            dci = ci_change(compositions[first], check_ci)
+            if de > self.max_de:
+                reason = f"the energy of {first} changed by {de:.3f} eV"
+            elif dci > self.max_dci:
+                reason = f"a CI weight of {first} changed by {dci:.2f}"
+        rough = None
+        if (reason is None) and (self.jump or self.max_iter):
+            rough = rough_step(ids, states, energies, iterations, set(),
+                               self.jump, self.max_iter)
+        if rough is not None:
+            reason = f"{rough[1]} at {rough[0]}"
+        cut = None
+        if (reason is None) and (self.cutoff is not None):
+            cut = check_cutoff(self.cutoff, states, energies, set())
+        if cut is not None:
+            reason = f"{cut[0]} is beyond the energy cutoff"
+        if reason is not None:
+            print(f"Rejecting the speculative run of {job_input}, as "
+                  f"{reason}. Running the rest of the job from {first}.")
+            return self.write_rerun(job_input)
+
+        spec_path = self.spec_path(backup_path)
+        for id_ in ids[1:]:
+            for fn in point_artifacts(spec_path, id_):
+                place_file(fn, backup_path / fn.name, move=True)
+            self.ledger.set_finished(id_, DONE, RC_OK,
+                                     point_artifacts(backup_path, id_),
+                                     energies.get(id_))
+        print(f"Accepted the speculative run of {job_input}.")
+        return None
+
+
+async def run_dag(job_inputs, job_deps, cpus, run_part, poll=5.,
+                  finished=None, run_inputs=None, ready_files=(), ledger=None,
+                  scale_cores=None, on_done=None, cost_model=None,
+                  points=None, admission=None, mem_budget=None,
+                  job_order=None, speculation=None, ledgers=None):
+    """Run the job inputs, starting every job as soon as its dependencies
+    are met, so no barrier between the row and the columns is needed.
+
+    All jobs are supervised from one event loop. 'run_part' is a coroutine
+    function that is awaited with the job input and the keyword argument
+    'env'. As soon as a job finishes, 'on_done' is called with the job
+    input and its result and the next jobs are started. Files jobs wait
+    for are checked every 'poll' seconds.
+
+    Ready jobs heading the longest remaining chains are started first, so
+    with one job per point, idle processes pick up the points of long
+    columns instead of waiting for them at the end. With a 'cost_model' the
+    chains are weighted by the predicted runtime of the points in 'points'
+    instead of their number, so the most expensive columns are started
+    first. The model learns from the ledger whenever a job finished.
+
+    The runner owns a budget of 'cpus' cores. With 'scale_cores' set, free
+    cores are split between all unfinished jobs, so once fewer jobs than
+    cores are left, every job is started with several threads (OpenMP) or
+    processes (MPI). Jobs that are not ready yet get their share, too, as
+    their seeds may land any moment.
+
+    With an Admission 'admission' new jobs are held back as long as the
+    machine is under load or short of memory.
+
+    With a 'mem_budget' in MB the budget is split between the pending jobs
+    and every job gets its share as the keyword argument 'mem'
+    of 'run_part'.
+
+    'job_order' can replace the order in which pending jobs are started.
+    It is called with the pending jobs and the cores of the running jobs
+    before every start and returns the pending jobs in the new order.
+
+    With a Speculation 'speculation' cores that no ready job can use run
+    pending jobs ahead of their parents. 'run_part' is then also awaited
+    with the keyword arguments 'ledger', 'retries', 'cutoff', 'jump' and
+    'max_iter' of run_job, to turn them off for these runs. A job whose
+    speculative run is still going on when it becomes ready waits for it.
+    Once a job with speculative results is ready, only its first point is
+    run, to check them, see Speculation.verify.
+
+    Jobs in 'finished' are not run again and the inputs in 'run_inputs'
+    are run in place of the original job inputs.
+
+    'ledgers' holds the ledger of every job, when the jobs belong to
+    several projects. It takes the place of 'ledger' when checking seed
+    files and skipping jobs.
+
+    Jobs that would start from a point beyond the energy cutoff of
+    run_job are not run and their points are marked as skipped."""
+    start = time.time()
+    finished = set() if finished is None else set(finished)
+    run_inputs = dict() if run_inputs is None else dict(run_inputs)
+    lengths = job_priorities(job_inputs, job_deps, cost_model, points)
+    pending = sorted([job_input for job_input in job_inputs
+                      if job_input not in finished],
+                     key=lambda job_input: -lengths[job_input])
+    running = dict()
+    cores = dict()
+    sizes = dict()
+    mems = dict()
+    stopped = set()
+    held = None
+    try:
+        while pending or running:
+            # Readiness is checked once per round, as file_landed compares
+            # the sizes of the seed files with the previous check.
+            ready = set([job_input for job_input in pending
+                         if job_is_ready(job_deps.get(job_input, dict()),
+                                         finished, start, sizes, ready_files,
+                                         ledgers.get(job_input, ledger)
+                                         if ledgers else ledger)])
+            candidates = [job_input for job_input in pending
+                          if job_input in ready]
+            while candidates:
+                if job_order:
+                    candidates = job_order(candidates, cores)
+                job_input = candidates.pop(0)
+                free_cores = cpus - sum(cores.values())
+                if free_cores == 0:
+                    break
+                if speculation and speculation.waits(job_input):
+                    continue
+                threads = 1
+                if scale_cores:
+                    threads = max(1, free_cores
+                                     // max(1, len(pending) + len(running)))
+                mem = None
+                if mem_budget:
+                    mem = mem_share(mem_budget, sum(mems.values()),
+                                    free_cores, len(pending))
+                held = hold_back(admission, held, threads, scale_cores, mem)
+                if held is not None:
+                    break
+                to_run = run_inputs.get(job_input, job_input)
+                check = speculation and (job_input in speculation.results)
+                if check:
+                    to_run = speculation.write_check(job_input)
+                    print(f"Checking the speculative run of {job_input} "
+                          f"with '{to_run}'.")
+                env = thread_env(threads, scale_cores)
+                if threads > 1:
+                    print(f"Starting {to_run} on {threads} cores.")
+                if mem_budget:
+                    print(f"Starting {to_run} with {mem:.0f} MB.")
+                task = asyncio.create_task(run_part(
+                    to_run, **part_kwargs(env, mem, threads, scale_cores)
+                ))
+                if check:
+                    speculation.checking(task, job_input)
+                running[task] = job_input
+                cores[job_input] = threads
+                mems[job_input] = mem or 0.
+                if admission:
+                    admission.started(job_input, threads,
+                                      mem if mem_budget else
+                                      job_mem(admission, threads,
+                                              scale_cores))
+                pending.remove(job_input)
+            spec_inputs = list()
+            if speculation and (held is None):
+                spec_inputs = speculation.candidates(pending, ready)
+            for job_input in spec_inputs:
+                free_cores = cpus - sum(cores.values())
+                if free_cores == 0:
+                    break
+                mem = None
+                if mem_budget:
+                    mem = mem_share(mem_budget, sum(mems.values()),
+                                    free_cores, len(pending))
+                held = hold_back(admission, held, 1, scale_cores, mem)
+                if held is not None:
+                    break
+                seed = speculation.seed(job_input)
+                spec_input = speculation.write_input(job_input, seed)
+                print(f"Speculatively starting {job_input} from {seed} in "
+                      f"'{spec_input}'.")
+                env = thread_env(1, scale_cores)
+                task = asyncio.create_task(run_part(
+                    spec_input, ledger=None, retries=0, cutoff=None,
+                    jump=None, max_iter=None,
+                    **part_kwargs(env, mem, 1, scale_cores)
+                ))
+                speculation.started(task, job_input)
+                running[task] = job_input
+                cores[job_input] = 1
+                mems[job_input] = mem or 0.
+                if admission:
+                    admission.started(job_input, 1,
+                                      mem if mem_budget else
+                                      job_mem(admission, 1, scale_cores))
+            if not running:
+                await asyncio.sleep(poll)
+                continue
+
+            done, _ = await asyncio.wait(running, timeout=poll,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                job_input = running.pop(task)
+                del cores[job_input]
+                del mems[job_input]
+                if admission:
+                    admission.finished(job_input)
+                if speculation and (task in speculation.tasks):
+                    speculation.landed(task)
+                    continue
+                # Reraise exceptions from the jobs
+                result = task.result()
+                stopped |= stopped_points(result)
+                if speculation and (task in speculation.checks):
+                    rerun = speculation.verify(task)
+                    if rerun is not None:
+                        run_inputs[job_input] = rerun
+                        pending.append(job_input)
+                        continue
+                finished.add(job_input)
+                if on_done:
+                    on_done(job_input, result)
+            for job_input in skip_orphans(pending, job_deps, stopped, ledger,
+                                          points, ledgers):
+                print(f"Skipping {job_input}, as it starts beyond the "
+                       "energy cutoff.")
+                pending.remove(job_input)
+                finished.add(job_input)
+            if done and cost_model and ledger:
+                cost_model.update(ledger.durations())
+                lengths = job_priorities(job_inputs, job_deps, cost_model,
+                                         points)
+                pending.sort(key=lambda job_input: -lengths[job_input])
+    except asyncio.CancelledError:
+        for task in running:
+            task.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+        raise
+
+
+def grid_neighbours(ids):
+    """Direct neighbours of every point on the grid spanned by 'ids' and
+    their distances in coordinates, relative to the extent of the grid
+    along every coordinate."""
+    coords = {id_: id_coords(id_) for id_ in ids}
+    axes = [sorted(set([coord[i] for coord in coords.values()]))
+            for i in range(2)]
+    spans = [(axis[-1] - axis[0]) or 1. for axis in axes]
+    index = {(axes[0].index(c1), axes[1].index(c2)): id_
+             for id_, (c1, c2) in coords.items()}
+    neighbours = dict()
+    for (i, j), id_ in index.items():
+        neighbours[id_] = list()
+        for ni, nj in ((i-1, j), (i+1, j), (i, j-1), (i, j+1)):
+            if (ni, nj) not in index:
+                continue
+            neighbour = index[(ni, nj)]
+            dist = np.linalg.norm(
+                [(coords[neighbour][k] - coords[id_][k]) / spans[k]
+                 for k in range(2)]
+            )
+            neighbours[id_].append((neighbour, dist))
+    return neighbours
+
+
+def wave_depths(neighbours, starts):
+    """Number of grid steps from every point to the nearest start."""
+    depths = {id_: 0 for id_ in starts}
+    front = list(starts)
+    while front:
+        next_front = list()
+        for id_ in front:
+            for neighbour, _ in neighbours[id_]:
+                if neighbour not in depths:
+                    depths[neighbour] = depths[id_] + 1
+                    next_front.append(neighbour)
+        front = next_front
+    return depths
+
+
+def best_neighbour(candidates, energies, seed_by="nearest"):
+    """Select the neighbour to take the orbitals from among the converged
+    (neighbour, distance) tuples in 'candidates'."""
+    if (seed_by == "energy") and all([neighbour in energies
+                                      for neighbour, _ in candidates]):
+        median = np.median([energies[neighbour]
+                            for neighbour, _ in candidates])
+        return min(candidates,
+                   key=lambda cand: abs(energies[cand[0]] - median))[0]
+    return min(candidates, key=lambda cand: cand[1])[0]
+
+
+async def wavefront(job_inputs, job_deps, cpus, run_part, ledger, poll=5.,
+                    seed_by="nearest", retries=0, resume=False,
+                    scale_cores=None, admission=None, mem_budget=None,
+                    cutoff=None):
+    """Run a grid with one job per point as a wavefront.
+
+    The jobs without parents start from their INPORB. Every other point is
+    ready as soon as any of its neighbours converged and is started from
+    the RasOrb of the best converged neighbour, see best_neighbour, instead
+    of a fixed predecessor. So the number of points that can run at a time
+    grows with the perimeter of the converged region. Points closest to
+    the starts are run first, to keep the region compact. A failed point
+    is tried again from up to 'retries' other converged neighbours. With
+    'resume' points that are done according to the ledger are kept.
+
+    Points beyond the energy cutoff of run_job are not started from, so
+    points that can only be reached through them are marked as skipped.
+    When resuming, done points are checked against the EnergyCutoff
+    'cutoff'.
+    'scale_cores', 'admission' and 'mem_budget' work like in run_dag."""
+    point_jobs = dict()
+    for job_input in job_inputs:
+        ids = job_ids(job_input, job_deps)
+        if len(ids) != 1:
+            raise ValueError(f"'{job_input}' contains {len(ids)} points. The "
+                              "wavefront needs one job per point.")
+        point_jobs[ids[0]] = job_input
+    neighbours = grid_neighbours(list(point_jobs))
+    starts = [id_ for id_, job_input in point_jobs.items()
+              if not job_deps.get(job_input, dict()).get("after")]
+    depths = wave_depths(neighbours, starts)
+    done = set()
+    if resume:
+        done = set([id_ for id_ in point_jobs if ledger.is_done(id_)])
+    tried = {id_: list() for id_ in point_jobs}
+    stopped = set()
+    if cutoff is not None:
+        stopped = set([id_ for id_ in done if cutoff.check(id_)])
+        done -= stopped
+    running = dict()
+    cores = dict()
+    mems = dict()
+    held = None
+
+    def candidates(id_):
+        return [(neighbour, dist) for neighbour, dist in neighbours[id_]
+                if (neighbour in done) and (neighbour not in tried[id_])]
+
+    def is_ready(id_):
+        if (id_ in done) or (id_ in stopped) or (id_ in running.values()):
+            return False
+        if len(tried[id_]) > retries:
+            return False
+        if (id_ in starts) and not tried[id_]:
+            return True
+        return bool(candidates(id_))
+
+    try:
+        while True:
+            ready = sorted([id_ for id_ in point_jobs if is_ready(id_)],
+                           key=lambda id_: (depths.get(id_, 0),
+                                            -len(candidates(id_))))
+            if not ready and not running:
+                break
+            energies = ledger.energies()
+            for i, id_ in enumerate(ready):
+                free_cores = cpus - sum(cores.values())
+                if free_cores == 0:
+                    break
+                threads = 1
+                if scale_cores:
+                    # Like in run_dag, all points that are left get a share.
+                    left = len([id_ for id_ in point_jobs
+                                if (id_ not in done) and (id_ not in stopped)])
+                    threads = max(1, free_cores // max(1, left))
+                mem = None
+                if mem_budget:
+                    mem = mem_share(mem_budget, sum(mems.values()),
+                                    free_cores, len(ready) - i)
+                held = hold_back(admission, held, threads, scale_cores, mem)
+                if held is not None:
+                    break
+                job_input = point_jobs[id_]
+                if (id_ in starts) and not tried[id_]:
+                    seed = None
+                    to_run = job_input
+                else:
+                    seed = best_neighbour(candidates(id_), energies, seed_by)
+                    with open(job_input) as handle:
+                        header, blocks = split_input(handle.read())
+                    rasorb = ledger_rasorb(job_input, seed)
+                    to_run = str(Path(job_input).with_suffix("")) \
+                             + f".wave{len(tried[id_])}.in"
+                    with open(to_run, "w") as handle:
+                        handle.write(set_inporb(header, rasorb)
+                                     + "".join([block for _, block in blocks]))
+                    print(f"Starting {id_} from {seed}.")
+                tried[id_].append(seed)
+                env = thread_env(threads, scale_cores)
+                task = asyncio.create_task(run_part(
+                    to_run, retries=0,
+                    **part_kwargs(env, mem, threads, scale_cores)
+                ))
+                running[task] = id_
+                cores[id_] = threads
+                mems[id_] = mem or 0.
+                if admission:
+                    admission.started(id_, threads,
+                                      mem if mem_budget else
+                                      job_mem(admission, threads, scale_cores))
+            if not running:
+                await asyncio.sleep(poll)
+                continue
+
+            finished, _ = await asyncio.wait(
+                running, timeout=poll, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in finished:
+                id_ = running.pop(task)
+                del cores[id_]
+                del mems[id_]
+                if admission:
+                    admission.finished(id_)
+                # Reraise exceptions from the jobs
+                result = task.result()
+                if id_ in stopped_points(result):
+                    stopped.add(id_)
+                elif ledger.is_done(id_):
+                    done.add(id_)
+    except asyncio.CancelledError:
+        for task in running:
+            task.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+        raise
+    # Points that were never started have no converged neighbour, that is
+    # below the cutoff.
+    orphans = [id_ for id_ in point_jobs
+               if (id_ not in done) and (id_ not in stopped) and not tried[id_]]
+    for id_ in orphans:
+        ledger.set_finished(id_, SKIPPED, "seed skipped")
+    if orphans:
+        print(f"Skipped {len(orphans)} points, that could only be started "
+               "from points beyond the energy cutoff or from failed points.")
+    unreached = len(point_jobs) - len(done) - len(stopped) - len(orphans)
+    if unreached:
+        print(f"{unreached} points did not converge from any neighbour.")
+
+
+def ledger_rasorb(job_input, id_):
+    """RasOrb of the point 'id_' in the backup path of job_input."""
+    with open(job_input) as handle:
+        backup_path = backup_path_from_input(handle.read())
+    return backup_path / f"{id_}.RasOrb"
+
+
+def cache_points(cache, job_inputs, ledger, save_path):
+    """Store all points of the job inputs that finished successfully in the
+    ResultCache 'cache'. Returns the number of new entries. The active space
+    is taken from the RasOrb of every point."""
+    energies = ledger.energies()
+    stored = 0
+    for job_input in job_inputs:
+        with open(job_input) as handle:
+            text = handle.read()
+        _, blocks = split_input(text)
+        backup_path = backup_path_from_input(text)
+        for id_, block in blocks:
+            if not ledger.is_done(id_):
+                continue
+            # The point may have been computed by a resumed or retried input.
+            job = ledger.get(id_)["job"]
+            out = save_path / Path(job).with_suffix(".out").name
+            log = point_log(read_text(out), id_)
+            index = orbital_index(backup_path / f"{id_}.RasOrb")
+            stored += cache.store(point_key(block, index), id_,
+                                  point_artifacts(backup_path, id_),
+                                  energies.get(id_), log)
+    return stored
+
+
+def minutes(value):
+    return None if value is None else 60 * value
+
+
+def stopped_info(stopped):
+    """Line for the info of a done job in a WorkQueue, that tells the other
+    workers about points no job may start from."""
+    return f"stopped {' '.join(sorted(stopped))}\n" if stopped else ""
+
+
+def stopped_from_info(info):
+    stopped = set()
+    for line in info.split("\n"):
+        if line.startswith("stopped "):
+            stopped |= set(line.split()[1:])
+    return stopped
+
+
+async def work(queue, worker, job_inputs, job_deps, cpus, run_part, poll=5.,
+               lease=300., scale_cores=None, ledger=None, admission=None,
+               mem_budget=None):
+    """Run jobs from a WorkQueue, that other workers drain at the same time.
+
+    Up to 'cpus' jobs are claimed and run at a time. A job is only claimed
+    when its parents are done or when its seed RasOrbs were written,
+    possibly by another worker. The claims of the running jobs are renewed
+    every 'poll' seconds and claims of other workers that expired after
+    'lease' seconds are returned to the queue. The worker stops when all
+    jobs are done. When it is cancelled, its claims are returned to the
+    queue right away.
+
+    Points beyond the energy cutoff are announced in the info of the done
+    jobs, so every worker skips the jobs that would start from them. With
+    an Admission 'admission' no jobs are claimed while the machine is
+    under load or short of memory. Like in run_dag, 'mem_budget' is split
+    between the jobs of this worker."""
+    lengths = chain_lengths(job_inputs, job_deps)
+    not_before = queue.created
+    running = dict()
+    cores = dict()
+    sizes = dict()
+    stopped = set()
+    read = set()
+    mems = dict()
+    held = None
+    try:
+        while True:
+            for job_input, dead_worker in queue.release_expired(lease):
+                print(f"Claim of {dead_worker} on {job_input} expired. "
+                       "Returned it to the queue.")
+            done = queue.done()
+            for job_input in done - read:
+                stopped |= stopped_from_info(queue.info(job_input))
+            read = done
+            todo = sorted(queue.todo() & set(job_inputs),
+                          key=lambda job_input: -lengths[job_input])
+            for job_input in skip_orphans(todo, job_deps, stopped):
+                todo.remove(job_input)
+                if not queue.claim(job_input, worker):
+                    continue
+                print(f"Skipping {job_input}, as it starts beyond the "
+                       "energy cutoff.")
+                ids = job_ids(job_input, job_deps)
+                if ledger:
+                    for id_ in ids:
+                        ledger.set_finished(id_, SKIPPED, "seed skipped")
+                queue.finish(job_input, worker,
+                             f"{worker} skipped\n" + stopped_info(ids))
+                done.add(job_input)
+            if not running and (set(job_inputs) <= done):
+                break
+            ready = [job_input for job_input in todo
+                     if job_is_ready(job_deps.get(job_input, dict()), done,
+                                     not_before, sizes)]
+            # Claimed jobs move from todo to running, so this stays the
+            # number of unfinished jobs of this worker during the round.
+            left = len(todo) + len(running)
+            for job_input in ready:
+                free_cores = cpus - sum(cores.values())
+                if free_cores == 0:
+                    break
+                threads = 1
+                if scale_cores:
+                    threads = max(1, free_cores // max(1, left))
+                mem = None
+                if mem_budget:
+                    mem = mem_share(mem_budget, sum(mems.values()),
+                                    free_cores, len(todo))
+                # Leave the job to other workers, while this machine is busy.
+                held = hold_back(admission, held, threads, scale_cores, mem)
+                if held is not None:
+                    break
+                if queue.claim(job_input, worker):
+                    env = thread_env(threads, scale_cores)
+                    task = asyncio.create_task(run_part(
+                        job_input, **part_kwargs(env, mem, threads,
+                                                 scale_cores)
+                    ))
+                    running[task] = job_input
+                    cores[job_input] = threads
+                    mems[job_input] = mem or 0.
+                    if admission:
+                        admission.started(job_input, threads,
+                                          mem if mem_budget else
+                                          job_mem(admission, threads,
+                                                  scale_cores))
+            if not running:
+                await asyncio.sleep(poll)
+                continue
+
+            finished, _ = await asyncio.wait(
+                running, timeout=poll, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in finished:
+                job_input = running.pop(task)
+                del cores[job_input]
+                del mems[job_input]
+                if admission:
+                    admission.finished(job_input)
+                result = task.result()
+                info = f"{worker} {result['returncode']} " \
+                       f"{result['duration']:.1f}\n" \
+                       + stopped_info(stopped_points(result))
+                if not queue.finish(job_input, worker, info):
+                    print(f"The claim on {job_input} expired before it "
+                           "finished. Another worker may run it again.")
+            for job_input in running.values():
+                if not queue.renew(job_input, worker):
+                    print(f"Lost the claim on {job_input}.")
+    except asyncio.CancelledError:
+        for task in running:
+            task.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+        for job_input in running.values():
+            queue.release(job_input, worker)
+        raise
 
 
 def run():
@@ -75,24 +2024,202 @@ def run():
     except FileExistsError:
         print("./out already exists.")
 
-    run_part = partial(run_job, save_path=save_path)
+    job_deps = load_job_deps(args.job_inputs, args.deps)
+    if job_deps is None:
+        job_deps = barrier_deps(job_inputs)
+
+    if args.wavefront:
+        # The wavefront picks the seeds of all points at run time, so it
+        # can't be split between workers or array tasks, and it doesn't
+        # know the fixed seeds --jump, --max-iter and --speculate restart
+        # from.
+        unsupported = [opt for opt, given in (
+            ("--jump", args.jump is not None),
+            ("--max-iter", args.max_iter is not None),
+            ("--speculate", args.speculate),
+            ("--worker", args.worker),
+            ("--backend", args.backend != "local"),
+        ) if given]
+        if unsupported:
+            sys.exit(f"--wavefront can't be combined with "
+                     f"{', '.join(unsupported)}.")
+
+    # Every worker keeps a ledger of its own, that a restarted worker
+    # doesn't find again. The queue already knows the finished jobs and
+    # returns the jobs of a worker that died to 'todo', see --lease.
+    if args.worker and args.resume:
+        sys.exit("--worker can't be combined with --resume. Restart the "
+                 "workers without it, the queue keeps track of the finished "
+                 "jobs.")
+
+    if args.backend != "local":
+        backend = BACKENDS[args.backend](
+            cpus=cpus, pack=args.pack, batch_opts=args.batch_opt,
+            env_script=args.env_script, run_args=run_args_from(args),
+        )
+        array_ids = backend.run(job_inputs, job_deps, args.deps)
+        if args.wait:
+            backend.wait(array_ids)
+        return
+
+    if args.worker:
+        queue_dir = args.queue
+        if queue_dir is None:
+            queue_dir = Path(args.job_inputs).parent / QUEUE_DIR
+        queue = WorkQueue(queue_dir)
+        if queue.create(job_inputs):
+            print(f"Created queue in '{queue_dir}'")
+        worker = worker_name()
+        print(f"Running as worker '{worker}' on queue '{queue_dir}'")
+
+    ledger_fn = args.ledger
+    if (ledger_fn is None) and args.worker:
+        # SQLite locking is unreliable on shared filesystems, so every
+        # worker keeps its own ledger.
+        ledger_fn = queue.queue_dir / f"{worker}.sqlite"
+    elif ledger_fn is None:
+        ledger_fn = Path(args.job_inputs).parent / LEDGER_FN
+    ledger = Ledger(ledger_fn)
+    print(f"Recording the state of all points in '{ledger_fn}'")
+    seeds = dict()
+    for deps in job_deps.values():
+        seeds.update(deps.get("seeds", dict()))
+    cutoff = None
+    if (args.cutoff is not None) or (args.rise is not None):
+        all_points = {job_input: job_ids(job_input, job_deps)
+                      for job_input in job_inputs}
+        # Energies of a previous run count towards the grid minimum.
+        cutoff = EnergyCutoff(args.cutoff, args.rise,
+                              chain_prevs(job_inputs, job_deps, all_points),
+                              ledger.energies())
+    run_part = partial(run_job, save_path=save_path, ledger=ledger,
+                       poll=args.poll, seeds=seeds, retries=args.retries,
+                       scratch=args.scratch, min_free=args.min_free,
+                       stream_out=args.stream_out,
+                       timeout=minutes(args.timeout),
+                       stall=minutes(args.stall),
+                       point_factor=args.point_factor, cutoff=cutoff,
+                       jump=args.jump, max_iter=args.max_iter,
+                       steps=args.steps)
+    for job_input in job_inputs:
+        ledger.register(job_input, job_ids(job_input, job_deps))
+
+    # Jobs that are depended on but not part of job_inputs, e.g. when
+    # running one task of a job array, were already run before.
+    finished = set([parent for deps in job_deps.values()
+                    for parent in deps.get("after", list())
+                    if parent not in job_inputs])
+    run_inputs = dict()
+    ready_files = set()
+    # The wavefront has one point per job and resumes on its own.
+    if args.resume and not args.wavefront:
+        done, run_inputs, ready_files = resume_jobs(
+            job_inputs, job_deps, ledger, keep_skipped=cutoff is not None
+        )
+        finished |= done
+
+    # The points every job computes, after resuming
+    points = {job_input: job_ids(run_inputs.get(job_input, job_input),
+                                 job_deps)
+              for job_input in job_inputs}
+    timing_ledgers = [Ledger(fn) for fn in (args.timings or list())]
+    cost_model = CostModel.from_ledgers(timing_ledgers + [ledger, ])
+    for timing_ledger in timing_ledgers:
+        timing_ledger.close()
+    makespan = predict_makespan(
+        job_inputs, job_deps, points, cost_model, cpus,
+        job_priorities(job_inputs, job_deps, cost_model, points), finished
+    )
+    if cost_model.timed:
+        print(f"Predicted makespan with {cpus} jobs at a time: "
+              f"{makespan/60:.1f} min, from the timings of "
+              f"{len(cost_model.durations)} points.")
+    else:
+        print(f"Predicted makespan with {cpus} jobs at a time: "
+              f"{makespan:.0f} point runtimes. No timings of earlier runs "
+               "are known yet.")
+
     if cpus == 1:
         print("Running in serial mode.")
-        [run_part(inp) for inp in job_inputs]
     else:
-        left_inp, right_inp, *col_inps = job_inputs
-        print("Running in parallel mode.")
-
-        print("Running equilibrium row with 2 processes.")
-        with multiprocessing.Pool(2) as pool:
-            pool.map(run_part, (left_inp, right_inp))
-        print()
-
-        print(f"Running columns with {cpus} processes.")
-        print(f"I found a total of {len(col_inps)} columns.")
-        with multiprocessing.Pool(cpus) as pool:
-            pool.map(run_part, col_inps)
-    print("Finished all calculations.")
+        print(f"Running in parallel mode with {cpus} jobs at a time. Jobs "
+               "are started as soon as their dependencies are met.")
+    mem_budget = parse_mem(args.mem_budget) if args.mem_budget else None
+    if mem_budget:
+        print(f"Splitting {mem_budget:.0f} MB between the jobs.")
+    mem = args.job_mem or os.environ.get("MOLCAS_MEM")
+    # The shares of the budget are checked instead of a fixed memory.
+    if mem_budget:
+        mem = None
+    admission = Admission(args.max_load, parse_mem(mem) if mem else None)
+    if admission.active:
+        limits = list()
+        if args.max_load is not None:
+            limits.append(f"the load stays below {args.max_load}")
+        if admission.job_mem:
+            limits.append(f"{admission.job_mem:.0f} MB are free for a job")
+        print(f"Jobs are only started while {' and '.join(limits)}.")
+    else:
+        admission = None
+    speculation = None
+    if args.speculate:
+        speculation = Speculation(job_inputs, job_deps, ledger, args.spec_de,
+                                  args.spec_dci, cutoff, args.jump,
+                                  args.max_iter)
+        print("Running jobs speculatively on idle cores. Their results are "
+              "kept when a check of their first point changes the energy by "
+              f"at most {args.spec_de} eV and the CI weights by at most "
+              f"{args.spec_dci}.")
+    if args.wavefront:
+        print(f"Running as a wavefront, seeding every point from its "
+              f"'{args.wave_seed}' converged neighbour.")
+        dispatch = wavefront(job_inputs, job_deps, cpus, run_part, ledger,
+                             poll=args.poll, seed_by=args.wave_seed,
+                             retries=args.retries, resume=args.resume,
+                             scale_cores=args.scale_cores,
+                             admission=admission, mem_budget=mem_budget,
+                             cutoff=cutoff)
+    elif args.worker:
+        dispatch = work(queue, worker, job_inputs, job_deps, cpus, run_part,
+                        poll=args.poll, lease=args.lease,
+                        scale_cores=args.scale_cores, ledger=ledger,
+                        admission=admission, mem_budget=mem_budget)
+    else:
+        dispatch = run_dag(job_inputs, job_deps, cpus, run_part,
+                           poll=args.poll, finished=finished,
+                           run_inputs=run_inputs, ready_files=ready_files,
+                           ledger=ledger, scale_cores=args.scale_cores,
+                           cost_model=cost_model, points=points,
+                           admission=admission, mem_budget=mem_budget,
+                           speculation=speculation)
+    try:
+        asyncio.run(dispatch)
+    except KeyboardInterrupt:
+        if args.worker:
+            print("Interrupted. Killed all running jobs and returned them "
+                  "to the queue.")
+        else:
+            print("Interrupted. Killed all running jobs. Continue with "
+                  "--resume.")
+    else:
+        print("Finished all calculations.")
+    if args.cache:
+        cache = ResultCache(args.cache)
+        stored = cache_points(cache, job_inputs, ledger, save_path)
+        cache.close()
+        print(f"Stored {stored} new points in the cache '{args.cache}'.")
+    counts = ledger.counts([id_ for job_input in job_inputs
+                            for id_ in job_ids(job_input, job_deps)])
+    if args.worker:
+        # The other points were run by other workers.
+        counts.pop(PENDING, None)
+        print(f"State of the points run by this worker: {counts}")
+    else:
+        print(f"State of all points: {counts}")
+    ledger.close()
+    # A non-zero exit code lets batch systems hold back dependent jobs.
+    if counts.get(FAILED, 0) or counts.get(TIMEOUT, 0):
+        sys.exit(1)
 
 
 if __name__ == "__main__":
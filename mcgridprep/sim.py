@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+
+import argparse
+import itertools as it
+import os
+from pathlib import Path
+import re
+import sys
+
+import numpy as np
+
+from mcgridprep.batch import pack_jobs
+from mcgridprep.cost import CostModel, schedule_jobs
+from mcgridprep.ledger import Ledger
+from mcgridprep.run import ID_RE, barrier_deps, chain_lengths, job_ids, \
+                           job_priorities, load_job_deps
+
+
+SCHEDULERS = ("lpt", "chain", "fifo", "barrier")
+TIME_RE = "(\d+) (hour|minute|second)s?"
+UNITS = {"hour": 3600, "minute": 60, "second": 1}
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(
+        description="Replay the jobs of a grid with per-point durations "
+                    "instead of running OpenMolcas."
+    )
+
+    parser.add_argument("job_inputs")
+    parser.add_argument("--deps", default=None,
+        help="YAML file with the dependencies of every job input. Defaults to "
+             "'job_deps.yaml' next to job_inputs, if present."
+    )
+    parser.add_argument("--cpus", type=int, nargs="+", default=[1, ],
+        help="Numbers of jobs at a time to simulate."
+    )
+    parser.add_argument("--pack", type=int, nargs="+", default=[1, ],
+        help="Numbers of jobs per array task to simulate. The jobs of a task "
+             "run one after another and a task waits for the whole tasks it "
+             "depends on, like on a batch system."
+    )
+    parser.add_argument("--scheduler", choices=SCHEDULERS, nargs="+",
+        default=SCHEDULERS,
+        help="'lpt' starts the jobs heading the most expensive chains first, "
+             "like mcgridrun with timings. 'chain' weights the chains by their "
+             "number of points, like mcgridrun on a new grid. 'fifo' starts "
+             "the jobs in the order of job_inputs. 'barrier' also uses this "
+             "order, but starts a job only after its parents finished, "
+             "without starting columns early from their seed RasOrb."
+    )
+    parser.add_argument("--logs", default=None,
+        help="Directory with the OpenMolcas logs of an earlier run, to take "
+             "the duration of every point from."
+    )
+    parser.add_argument("--ledger", action="append", default=None,
+        help="Ledger of an earlier run, to take the duration of every point "
+             "from. Can be given multiple times."
+    )
+    parser.add_argument("--dist", choices=("const", "normal", "lognormal"),
+        default="const",
+        help="Distribution the durations are drawn from, when neither "
+             "--logs nor --ledger are given."
+    )
+    parser.add_argument("--mean", type=float, default=1.,
+        help="Mean duration of a point in minutes for --dist."
+    )
+    parser.add_argument("--sigma", type=float, default=0.25,
+        help="Standard deviation relative to the mean for --dist."
+    )
+    parser.add_argument("--seed", type=int, default=None,
+        help="Seed of the random number generator for --dist."
+    )
+    parser.add_argument("--gantt", action="store_true",
+        help="Print a Gantt chart of every simulated schedule."
+    )
+    parser.add_argument("--width", type=int, default=60,
+        help="Width of the Gantt charts in characters."
+    )
+
+    return parser.parse_args(args)
+
+
+def log_durations(text):
+    """Duration in seconds of every point in an OpenMolcas log, summed up
+    from the time every module reports to have spent."""
+    durations = dict()
+    for section in text.split("Start Module: gateway")[1:]:
+        mobj = re.search(ID_RE, section)
+        if mobj is None:
+            continue
+        spent = re.findall("--- Module \w+ spent (.+?) ---", section)
+        durations[mobj[1]] = sum([
+            int(value) * UNITS[unit]
+            for value, unit in it.chain(*[re.findall(TIME_RE, time)
+                                          for time in spent])
+        ])
+    return durations
+
+
+def durations_from_logs(out_dir):
+    durations = dict()
+    # Points that were calculated several times are taken from the most
+    # recent log.
+    fns = sorted(Path(out_dir).glob("*.out"), key=os.path.getmtime)
+    for fn in fns:
+        with open(fn) as handle:
+            durations.update(log_durations(handle.read()))
+    return durations
+
+
+def sample_durations(ids, dist, mean, sigma, seed=None):
+    """Draw a duration in seconds for every point. 'mean' is given in
+    minutes, 'sigma' relative to the mean."""
+    rng = np.random.default_rng(seed)
+    mean = 60 * mean
+    if dist == "const":
+        samples = np.full(len(ids), mean)
+    elif dist == "normal":
+        samples = rng.normal(mean, sigma*mean, len(ids))
+        # Negative durations make no sense
+        samples = np.clip(samples, 0.1*mean, None)
+    elif dist == "lognormal":
+        # Parameters of the underlying normal distribution, so the
+        # lognormal one has the requested mean and standard deviation.
+        s2 = np.log(1 + sigma**2)
+        samples = rng.lognormal(np.log(mean) - s2/2, np.sqrt(s2), len(ids))
+    return dict(zip(ids, samples))
+
+
+def packed_jobs(job_inputs, job_deps, points, pack):
+    """Turn the array tasks from batch.pack_jobs into jobs of their own.
+
+    Every task computes all points of its jobs and waits for the tasks
+    it depends on to finish."""
+    arrays = pack_jobs(job_inputs, job_deps, pack)
+    task_name = lambda array, task: f"task_{array:03d}_{task}"
+    task_inputs = list()
+    task_deps = dict()
+    task_points = dict()
+    for i, array in enumerate(arrays):
+        after = [task_name(*after) for after in array["after"]]
+        for j, jobs in enumerate(array["tasks"]):
+            name = task_name(i, j)
+            task_inputs.append(name)
+            task_points[name] = [id_ for job_input in jobs
+                                 for id_ in points[job_input]]
+            task_deps[name] = {"after": after, "ids": task_points[name]}
+    return task_inputs, task_deps, task_points
+
+
+def simulate(job_inputs, job_deps, points, model, cpus, scheduler, pack=1):
+    """Start and end times of all jobs with the given scheduler. With 'pack'
+    > 1 the jobs are packed into array tasks, see packed_jobs, and the
+    times of the tasks are returned."""
+    if scheduler == "barrier":
+        # Like the runner without a 'job_deps.yaml', the columns wait for
+        # both parts of the equilibrium row.
+        job_deps = barrier_deps(job_inputs)
+        for job_input, deps in job_deps.items():
+            deps["ids"] = points[job_input]
+    # The barrier is put between the jobs before they are packed, as
+    # barrier_deps only knows the rows and columns of the grid.
+    if pack > 1:
+        job_inputs, job_deps, points = packed_jobs(job_inputs, job_deps,
+                                                   points, pack)
+    if scheduler == "lpt":
+        priority = job_priorities(job_inputs, job_deps, model, points)
+    elif scheduler == "chain":
+        priority = chain_lengths(job_inputs, job_deps)
+    else:
+        priority = {job_input: -i for i, job_input in enumerate(job_inputs)}
+    return schedule_jobs(job_inputs, job_deps, points, model, cpus, priority)
+
+
+def gantt(starts, ends, makespan, width=60, name_width=30):
+    """One bar per job, sorted by the start time."""
+    scale = width / makespan if makespan > 0 else 0.
+    lines = list()
+    for job_input in sorted(starts, key=lambda job_input: starts[job_input]):
+        begin = int(round(starts[job_input] * scale))
+        end = max(int(round(ends[job_input] * scale)), begin + 1)
+        name = job_input[:name_width]
+        lines.append(f"{name:<{name_width}} |" + " " * begin
+                     + "#" * (end - begin))
+    return "\n".join(lines)
+
+
+def run():
+    args = parse_args(sys.argv[1:])
+
+    with open(args.job_inputs) as handle:
+        job_inputs = handle.read().strip().split("\n")
+    print(f"Loaded {len(job_inputs)} job inputs.")
+    job_deps = load_job_deps(args.job_inputs, args.deps)
+    if job_deps is None:
+        job_deps = barrier_deps(job_inputs)
+    points = {job_input: job_ids(job_input, job_deps)
+              for job_input in job_inputs}
+    all_ids = [id_ for job_input in job_inputs for id_ in points[job_input]]
+
+    if args.logs or args.ledger:
+        durations = dict()
+        for fn in (args.ledger or list()):
+            ledger = Ledger(fn)
+            durations.update(ledger.durations())
+            ledger.close()
+        if args.logs:
+            durations.update(durations_from_logs(args.logs))
+        known = len(set(all_ids) & set(durations))
+        print(f"Took the durations of {known} of {len(all_ids)} points from "
+               "earlier runs. The other points take the duration of their "
+               "nearest neighbour.")
+    else:
+        durations = sample_durations(all_ids, args.dist, args.mean,
+                                     args.sigma, args.seed)
+        print(f"Drew the durations of {len(all_ids)} points from a "
+              f"'{args.dist}' distribution.")
+    model = CostModel(durations)
+    serial = model.job_cost(all_ids)
+    print(f"Running all points one after another takes {serial/60:.1f} min.")
+    print()
+
+    results = list()
+    for pack, scheduler, cpus in it.product(args.pack, args.scheduler,
+                                            args.cpus):
+        starts, ends = simulate(job_inputs, job_deps, points, model, cpus,
+                                scheduler, pack)
+        makespan = max(ends.values(), default=0.)
+        busy = sum([ends[job] - starts[job] for job in ends])
+        utilization = busy / (cpus * makespan) if makespan > 0 else 0.
+        results.append((scheduler, cpus, pack, makespan, utilization))
+        if args.gantt:
+            print(f"Scheduler '{scheduler}', --cpus {cpus}, --pack {pack}: "
+                  f"{makespan/60:.1f} min")
+            print(gantt(starts, ends, makespan, args.width))
+            print()
+
+    print(f"{'scheduler':>10} {'cpus':>5} {'pack':>5} {'makespan / min':>15} "
+          f"{'speedup':>8} {'utilization':>12}")
+    for scheduler, cpus, pack, makespan, utilization in results:
+        speedup = serial / makespan if makespan > 0 else 0.
+        print(f"{scheduler:>10} {cpus:>5d} {pack:>5d} {makespan/60:>15.1f} "
+              f"{speedup:>8.2f} {utilization:>12.0%}")
+    best = min(results, key=lambda result: result[3])
+    print(f"Shortest makespan of {best[3]/60:.1f} min with scheduler "
+          f"'{best[0]}', --cpus {best[1]} and --pack {best[2]}.")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,15 @@
+#!/bin/bash
+#PBS -N {{ name }}
+#PBS -l select=1:ncpus={{ cpus }}
+{% for opt in batch_opts %}
+#PBS {{ opt }}
+{% endfor %}
+
+cd {{ cwd }}
+{% if env_script %}
+source {{ env_script }}
+{% endif %}
+
+task_inputs={{ batch_dir }}/{{ name }}_task_${PBS_ARRAY_INDEX:-0}
+mcgridrun $task_inputs --deps {{ deps_fn }} --cpus {{ cpus }} \
+    --ledger $task_inputs.sqlite {{ run_args }}
@@ -0,0 +1,15 @@
+#!/bin/bash
+#SBATCH --job-name={{ name }}
+#SBATCH --cpus-per-task={{ cpus }}
+{% for opt in batch_opts %}
+#SBATCH {{ opt }}
+{% endfor %}
+
+cd {{ cwd }}
+{% if env_script %}
+source {{ env_script }}
+{% endif %}
+
+task_inputs={{ batch_dir }}/{{ name }}_task_${SLURM_ARRAY_TASK_ID:-0}
+mcgridrun $task_inputs --deps {{ deps_fn }} --cpus {{ cpus }} \
+    --ledger $task_inputs.sqlite {{ run_args }}
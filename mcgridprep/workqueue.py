@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+
+import os
+from pathlib import Path
+import shutil
+import socket
+import time
+from urllib.parse import quote, unquote
+
+
+QUEUE_DIR = "mcgrid_queue"
+
+
+def worker_name():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def queue_fn(job_input):
+    """File name of a job in the queue. Job inputs may be paths, so '/'
+    and '@', that separates the job from the worker in claim files, are
+    escaped."""
+    return quote(job_input, safe="")
+
+
+class WorkQueue:
+    """Queue of job inputs in a directory on a shared filesystem, that is
+    drained by any number of workers on different machines.
+
+    Every job is a file, that moves between the directories 'todo',
+    'claimed' and 'done'. Moving is done with os.rename, which is atomic,
+    so only one worker can claim a job. A claim is a lease that the
+    worker has to renew by touching its claim file. Claims that were not
+    renewed within the lease time, e.g. because the worker died, are
+    returned to 'todo' by any other worker."""
+
+    def __init__(self, queue_dir=QUEUE_DIR):
+        self.queue_dir = Path(queue_dir)
+        self.todo_dir = self.queue_dir / "todo"
+        self.claimed_dir = self.queue_dir / "claimed"
+        self.done_dir = self.queue_dir / "done"
+
+    @property
+    def created(self):
+        """Time the queue was created. Seed files older than this were
+        written by an earlier run."""
+        return os.stat(self.queue_dir / "created").st_mtime
+
+    def create(self, job_inputs):
+        """Create the queue with all job inputs in 'todo', unless another
+        worker already created it. The queue is set up in a temporary
+        directory that is renamed at the end, so other workers never see
+        a half-written queue."""
+        if self.queue_dir.exists():
+            return False
+        tmp_dir = Path(f"{self.queue_dir}.{worker_name()}")
+        for dir_ in ("todo", "claimed", "done"):
+            os.makedirs(tmp_dir / dir_)
+        (tmp_dir / "created").touch()
+        for job_input in job_inputs:
+            (tmp_dir / "todo" / queue_fn(job_input)).touch()
+        try:
+            os.rename(tmp_dir, self.queue_dir)
+        except OSError:
+            # Another worker was faster.
+            shutil.rmtree(tmp_dir)
+            return False
+        return True
+
+    def claim_fn(self, job_input, worker):
+        return self.claimed_dir / f"{queue_fn(job_input)}@{worker}"
+
+    def todo(self):
+        return set([unquote(fn) for fn in os.listdir(self.todo_dir)])
+
+    def done(self):
+        return set([unquote(fn) for fn in os.listdir(self.done_dir)])
+
+    def claimed(self):
+        """Claimed job inputs and the workers that claimed them."""
+        claims = [fn.rsplit("@", 1) for fn in os.listdir(self.claimed_dir)]
+        return {unquote(fn): worker for fn, worker in claims}
+
+    def claim(self, job_input, worker):
+        try:
+            os.rename(self.todo_dir / queue_fn(job_input),
+                      self.claim_fn(job_input, worker))
+        except FileNotFoundError:
+            return False
+        # The lease starts now, not when the job was queued.
+        self.renew(job_input, worker)
+        return True
+
+    def renew(self, job_input, worker):
+        try:
+            os.utime(self.claim_fn(job_input, worker))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def finish(self, job_input, worker, info=""):
+        """Move a claimed job to 'done'. Returns False when the claim
+        already expired and the job was returned to the queue.
+
+        'info' is written to the claim file before it is moved, so other
+        workers never read a done job without it."""
+        claim_fn = self.claim_fn(job_input, worker)
+        try:
+            with open(claim_fn, "r+") as handle:
+                handle.truncate()
+                handle.write(info)
+            os.rename(claim_fn, self.done_dir / queue_fn(job_input))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def info(self, job_input):
+        try:
+            with open(self.done_dir / queue_fn(job_input)) as handle:
+                return handle.read()
+        except FileNotFoundError:
+            return ""
+
+    def release(self, job_input, worker):
+        """Return a claimed job to the queue, e.g. when the worker was
+        interrupted."""
+        try:
+            os.rename(self.claim_fn(job_input, worker),
+                      self.todo_dir / queue_fn(job_input))
+        except FileNotFoundError:
+            pass
+
+    def release_expired(self, lease):
+        """Return all claims that were not renewed for 'lease' seconds."""
+        released = list()
+        now = time.time()
+        for job_input, worker in self.claimed().items():
+            claim_fn = self.claim_fn(job_input, worker)
+            try:
+                expired = (now - os.stat(claim_fn).st_mtime) > lease
+                if expired:
+                    os.rename(claim_fn, self.todo_dir / queue_fn(job_input))
+                    released.append((job_input, worker))
+            except FileNotFoundError:
+                pass
+        return released
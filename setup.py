@@ -27,6 +27,9 @@ setup(
         "console_scripts": [
             "mcgridprep = mcgridprep.main:run",
             "mcgridrun = mcgridprep.run:run",
+            "mcgridsim = mcgridprep.sim:run",
+            "mcgridcampaign = mcgridprep.campaign:run",
+            "mcgridcache = mcgridprep.cache:run",
             "mcgridparse = mcgridprep.parse:run",
             "mcgridplot = mcgridprep.plot:run",
             "dalgrid = mcgridprep.dalgrid:run",
@@ -0,0 +1,64 @@
+import os
+from pathlib import Path
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+
+TESTS_DIR = Path(__file__).parent
+EXAMPLE_DIR = TESTS_DIR / "01_example"
+
+
+def run_module(module, args, cwd, env=None):
+    """Run 'python -m mcgridprep.{module}' in cwd and return its output."""
+    env_ = os.environ.copy()
+    env_["PYTHONPATH"] = str(TESTS_DIR.parent)
+    env_.update(env or dict())
+    proc = subprocess.run([sys.executable, "-m", f"mcgridprep.{module}"]
+                          + list(args), cwd=cwd, env=env_, text=True,
+                          stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    assert proc.returncode == 0, proc.stdout
+    return proc.stdout
+
+
+@pytest.fixture
+def example_dir(tmp_path):
+    """Copy of tests/01_example, with the inporb in the copy."""
+    inporb = tmp_path / "water_rigid.RasOrb"
+    shutil.copy(EXAMPLE_DIR / inporb.name, inporb)
+    with open(EXAMPLE_DIR / "mcgrid.yaml") as handle:
+        lines = [f"inporb: {inporb}" if line.startswith("inporb:") else line
+                 for line in handle.read().split("\n")]
+    with open(tmp_path / "mcgrid.yaml", "w") as handle:
+        handle.write("\n".join(lines))
+    return tmp_path
+
+
+@pytest.fixture
+def example_grid(example_dir):
+    """The job inputs of tests/01_example, as written by mcgridprep."""
+    run_module("main", [], example_dir)
+    return example_dir
+
+
+@pytest.fixture
+def main(example_dir, monkeypatch):
+    """mcgridprep.main, which reads mcgrid.yaml when it is imported."""
+    monkeypatch.chdir(example_dir)
+    from mcgridprep import main
+    return main
+
+
+@pytest.fixture
+def fake_molcas(tmp_path, monkeypatch):
+    """Puts tests/fake_molcas/pymolcas first in PATH. Its behaviour is set
+    with the FAKE_* variables, see the script."""
+    marks = tmp_path / "fake_marks"
+    marks.mkdir()
+    monkeypatch.setenv("PATH", f"{TESTS_DIR / 'fake_molcas'}:"
+                               f"{os.environ['PATH']}")
+    monkeypatch.setenv("FAKE_MARKS", str(marks))
+    monkeypatch.setenv("FAKE_DELAY", "0.01")
+    return monkeypatch
@@ -0,0 +1,121 @@
+import asyncio
+
+import pytest
+
+from mcgridprep import admission as adm
+from mcgridprep.admission import Admission, load_average, meminfo, parse_mem
+from mcgridprep.run import hold_back, run_dag
+
+
+def stub_machine(monkeypatch, load=None, available=None, total=16000.):
+    """Replace /proc/loadavg and /proc/meminfo. 'load' and 'available' may
+    be lists of values, that are returned one after another."""
+    def sequence(value):
+        values = list(value) if isinstance(value, list) else [value, ]
+        return lambda: values.pop(0) if len(values) > 1 else values[0]
+    next_load = sequence(load)
+    next_available = sequence(available)
+    monkeypatch.setattr(adm, "load_average", lambda: next_load())
+
+    def meminfo():
+        available = next_available()
+        if available is None:
+            return dict()
+        return {"MemAvailable": available, "MemTotal": total}
+    monkeypatch.setattr(adm, "meminfo", meminfo)
+
+
+def test_parse_mem():
+    assert parse_mem("4000") == 4000
+    assert parse_mem(4000) == 4000
+    assert parse_mem("2Gb") == 2048
+    assert parse_mem(" 1.5 g ") == 1536
+    assert parse_mem("1T") == 1024**2
+    for value in ("", "2 x", "Gb", "-1"):
+        with pytest.raises(ValueError):
+            parse_mem(value)
+
+
+def test_proc_files(tmp_path):
+    loadavg_fn = tmp_path / "loadavg"
+    loadavg_fn.write_text("1.50 1.20 0.90 2/345 6789\n")
+    assert load_average(loadavg_fn) == 1.5
+    assert load_average(tmp_path / "missing") is None
+    meminfo_fn = tmp_path / "meminfo"
+    meminfo_fn.write_text("MemTotal:       16384000 kB\n"
+                          "MemAvailable:    2048000 kB\n")
+    assert meminfo(meminfo_fn) == {"MemTotal": 16000., "MemAvailable": 2000.}
+    assert meminfo(tmp_path / "missing") == dict()
+
+
+def test_load_hold_and_release(monkeypatch):
+    stub_machine(monkeypatch, load=2.0)
+    admission = Admission(max_load=4.)
+    assert admission.check(cores=2) is None
+    assert admission.check(cores=3) == "load 2.0 + 3 > 4.0"
+    # Jobs that were just started don't show up in the load yet.
+    admission.started("a.in", cores=3)
+    assert admission.check(cores=1) is None
+    assert admission.check(cores=2) == "load 3.0 + 2 > 4.0"
+    admission.finished("a.in")
+    assert admission.check(cores=2) is None
+    # Without a known load only memory is checked.
+    stub_machine(monkeypatch, load=None)
+    assert admission.check(cores=100) is None
+
+
+def test_memory_hold_and_release(monkeypatch):
+    stub_machine(monkeypatch, available=1500.)
+    admission = Admission(job_mem=1000.)
+    assert admission.active
+    assert admission.check() is None
+    # The memory of a settling job is not in MemAvailable yet.
+    admission.started("a.in")
+    assert admission.check() == "500 MB available < 1000 MB needed"
+    assert admission.check(mem=400.) is None
+    # Once it settled, MemAvailable is trusted.
+    admission.settle = 0.
+    assert admission.check() is None
+    admission.finished("a.in")
+    # A job that needs more than the machine has is only started alone.
+    assert admission.check(mem=20000.) is None
+    admission.started("b.in")
+    assert admission.check(mem=20000.) is not None
+    assert not Admission().active
+
+
+def test_hold_back(monkeypatch, capsys):
+    stub_machine(monkeypatch, load=8.0)
+    admission = Admission(max_load=4.)
+    assert hold_back(None, None, 1, None) is None
+    held = hold_back(admission, None, 1, None)
+    assert held == "load 8.0 + 1 > 4.0"
+    assert capsys.readouterr().out \
+           == "Holding back new jobs: load 8.0 + 1 > 4.0.\n"
+    # The message is only printed once.
+    held = hold_back(admission, held, 1, None)
+    assert capsys.readouterr().out == ""
+    stub_machine(monkeypatch, load=1.0)
+    assert hold_back(admission, held, 1, None) is None
+    assert capsys.readouterr().out == "Starting new jobs again.\n"
+
+
+def test_run_dag_waits_for_load(monkeypatch, capsys):
+    # Busy for the first checks, idle afterwards
+    stub_machine(monkeypatch, load=[8.0, 8.0, 8.0, 0.0])
+    job_inputs = ["a.in", "b.in"]
+    job_deps = {job_input: {"after": list(), "ids": [job_input, ]}
+                for job_input in job_inputs}
+    runs = list()
+
+    async def run_part(job_input, **kwargs):
+        runs.append(job_input)
+        await asyncio.sleep(0.01)
+        return {"job_input": job_input, "stopped": list()}
+
+    asyncio.run(run_dag(job_inputs, job_deps, 2, run_part, poll=0.01,
+                        admission=Admission(max_load=4.)))
+    assert sorted(runs) == job_inputs
+    out = capsys.readouterr().out
+    assert out.index("Holding back new jobs") \
+           < out.index("Starting new jobs again")
@@ -0,0 +1,103 @@
+import os
+
+import yaml
+
+from mcgridprep.batch import DEPS_FN, PBSBackend, pack_jobs, run_args_from
+from mcgridprep.run import parse_args
+
+from conftest import TESTS_DIR, run_module
+
+
+def load_grid(grid_dir):
+    with open(grid_dir / "job_inputs") as handle:
+        job_inputs = handle.read().strip().split("\n")
+    with open(grid_dir / "job_deps.yaml") as handle:
+        job_deps = yaml.safe_load(handle)
+    return job_inputs, job_deps
+
+
+def test_pack_jobs(example_grid):
+    job_inputs, job_deps = load_grid(example_grid)
+    arrays = pack_jobs(job_inputs, job_deps)
+    # The two rows first, then the columns of either row.
+    assert [len(array["tasks"]) for array in arrays] == [2, 2, 8]
+    assert arrays[0]["tasks"] == [["left_cas_aug-cc-pvtz.in"],
+                                  ["right_cas_aug-cc-pvtz.in"]]
+    assert arrays[1]["after"] == [(0, 0)]
+    assert arrays[2]["after"] == [(0, 1)]
+
+    # Jobs go into the task of their parent while there is room.
+    arrays = pack_jobs(job_inputs, job_deps, pack=6)
+    assert arrays[0]["tasks"] == [job_inputs[:6]]
+    assert arrays[1] == {"tasks": [job_inputs[6:]], "after": [(0, 0)]}
+
+
+def test_fake_slurm(example_grid):
+    fake_dir = example_grid / ".fakeslurm"
+    env = {
+        "PATH": f"{TESTS_DIR / 'fake_slurm'}:{os.environ['PATH']}",
+        "FAKESLURM_DIR": str(fake_dir),
+        # Only submit, as mcgridrun may not be installed.
+        "FAKESLURM_RUN": "0",
+    }
+    run_module("run", ["job_inputs", "--backend", "slurm", "--pack", "1"],
+               example_grid, env)
+
+    jobs = dict()
+    for fn in fake_dir.glob("*.yaml"):
+        with open(fn) as handle:
+            jobs[fn.stem] = yaml.safe_load(handle)
+    assert sorted(jobs) == ["1", "2", "3"]
+    assert [len(jobs[job_id]["tasks"]) for job_id in ("1", "2", "3")] \
+           == [2, 2, 8]
+    # The columns only wait for the task of their row.
+    assert jobs["1"]["dependency"] == []
+    assert jobs["2"]["dependency"] == ["1_0"]
+    assert jobs["3"]["dependency"] == ["1_1"]
+    with open(example_grid / "batch" / "mcgrid_002_task_0") as handle:
+        assert handle.read().split("\n") == ["down_105.0_cas_aug-cc-pvtz.in"]
+
+
+def test_backend_keeps_job_deps(example_grid):
+    """The dependencies for the tasks go to the batch folder, the
+    job_deps.yaml of the grid stays untouched."""
+    env = {
+        "PATH": f"{TESTS_DIR / 'fake_slurm'}:{os.environ['PATH']}",
+        "FAKESLURM_DIR": str(example_grid / ".fakeslurm"),
+        "FAKESLURM_RUN": "0",
+    }
+    deps_fn = example_grid / "job_deps.yaml"
+    deps_fn.write_text("# edited\n" + deps_fn.read_text())
+    job_inputs, job_deps = load_grid(example_grid)
+    run_module("run", ["job_inputs", "--backend", "slurm"], example_grid, env)
+
+    assert deps_fn.read_text().startswith("# edited\n")
+    batch_deps = example_grid / "batch" / DEPS_FN
+    with open(batch_deps) as handle:
+        assert yaml.safe_load(handle) == job_deps
+    with open(example_grid / "batch" / "mcgrid_000.sh") as handle:
+        assert f"--deps {batch_deps}" in handle.read()
+
+    # Without a job_deps.yaml none is written next to the job inputs.
+    deps_fn.unlink()
+    run_module("run", ["job_inputs", "--backend", "slurm"], example_grid, env)
+    assert not deps_fn.exists()
+    with open(batch_deps) as handle:
+        assert set(yaml.safe_load(handle)) == set(job_inputs)
+
+
+def test_pbs_dependencies():
+    backend = PBSBackend()
+    assert backend.array_args(1) == list()
+    assert backend.array_args(8) == ["-J", "0-7"]
+    # PBS waits for whole arrays.
+    assert backend.dependency_args([("12.pbs", 0), ("12.pbs", 1)]) \
+           == ["-W", "depend=afterok:12.pbs"]
+
+
+def test_run_args_from():
+    args = parse_args(["job_inputs", "--backend", "slurm", "--resume",
+                       "--mem-budget", "16G"])
+    run_args = run_args_from(args).split()
+    assert "--resume" in run_args
+    assert run_args[run_args.index("--mem-budget") + 1] == "16G"
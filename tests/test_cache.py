@@ -0,0 +1,127 @@
+import time
+
+from mcgridprep.cache import ResultCache, orbital_index, point_key
+from mcgridprep.run import split_input
+
+from conftest import EXAMPLE_DIR
+from test_batch import load_grid
+
+
+INPORB = EXAMPLE_DIR / "water_rigid.RasOrb"
+BLOCK = """
+>> echo "*# 1.00_1.00 #*"
+&gateway
+ coord
+  h2o.xyz
+ basis
+  aug-cc-pvtz
+&rasscf
+ charge
+  0
+"""
+
+
+def store_point(cache, tmp_path, id_, block=BLOCK, index=""):
+    backup = tmp_path / "stored"
+    backup.mkdir(exist_ok=True)
+    artifacts = list()
+    for ext in (".RasOrb", ".rasscf.h5"):
+        fn = backup / f"{id_}{ext}"
+        fn.write_text(f"{id_}{ext}")
+        artifacts.append(fn)
+    return cache.store(point_key(block, index), id_, artifacts, -76.,
+                       log=f"log of {id_}")
+
+
+def test_orbital_index(tmp_path):
+    assert orbital_index(INPORB) == "0/1/0/7/0/84/0"
+    # RASSCF sorts the orbitals by type, which doesn't change the index.
+    text = INPORB.read_text().replace("0 i2222222ss", "0 2222222iss")
+    (tmp_path / "sorted.RasOrb").write_text(text)
+    assert orbital_index(tmp_path / "sorted.RasOrb") == orbital_index(INPORB)
+    assert orbital_index(tmp_path / "missing.RasOrb") == ""
+
+
+def test_point_key():
+    # IDs and paths of the emil lines don't matter, the active space does.
+    other = BLOCK.replace("1.00_1.00", "other")
+    assert point_key(BLOCK) == point_key(other)
+    assert point_key(BLOCK) != point_key(BLOCK.replace("0\n", "1\n"))
+    assert point_key(BLOCK, "0/1/0/7/0/84/0") \
+           != point_key(BLOCK, "0/2/0/6/0/84/0")
+
+
+def test_store_and_restore(tmp_path):
+    cache = ResultCache(tmp_path / "cache")
+    assert store_point(cache, tmp_path, "1.00_1.00")
+    # Points are only stored once.
+    assert not store_point(cache, tmp_path, "1.00_1.00")
+
+    backup = tmp_path / "backup"
+    out = tmp_path / "out"
+    backup.mkdir()
+    out.mkdir()
+    entry = cache.restore(point_key(BLOCK), backup, "2.00_2.00", out)
+    assert entry["energy"] == -76.
+    assert (backup / "2.00_2.00.RasOrb").read_text() == "1.00_1.00.RasOrb"
+    assert (backup / "2.00_2.00.rasscf.h5").exists()
+    assert (out / "cached_2.00_2.00.out").read_text() == "log of 1.00_1.00"
+    assert cache.restore(point_key(BLOCK, "0/1/0/7/0/84/0"), backup,
+                         "2.00_2.00", out) is None
+    cache.close()
+
+
+def test_evict(tmp_path):
+    cache = ResultCache(tmp_path / "cache")
+    keys = list()
+    for i in range(3):
+        block = BLOCK.replace("charge\n  0", f"charge\n  {i}")
+        store_point(cache, tmp_path, "1.00_1.00", block)
+        keys.append(point_key(block))
+        time.sleep(0.01)
+    # Using the oldest entry keeps it.
+    cache.get(keys[0])
+    num, size = cache.size()
+    assert num == 3
+    evicted, freed = cache.evict(max_size=size - 1)
+    assert (evicted, freed) == (1, size / 3)
+    assert cache.get(keys[1]) is None
+    assert not cache.entry_dir(keys[1]).exists()
+    assert cache.get(keys[0]) and cache.get(keys[2])
+    assert cache.evict(max_age=0.) == (2, 2 * size / 3)
+    assert cache.size() == (0, 0)
+    cache.close()
+
+
+def test_use_cache_dependencies(main, example_grid, tmp_path):
+    job_fns, job_deps = load_grid(example_grid)
+    jobs = [(example_grid / fn).read_text() for fn in job_fns]
+    index = orbital_index(INPORB)
+    # Cache the point at 100 deg of the right half of the row.
+    right = jobs[job_fns.index("right_cas_aug-cc-pvtz.in")]
+    block = dict(split_input(right)[1])["100.00_1.00"]
+    cache = ResultCache(tmp_path / "cache")
+    store_point(cache, tmp_path, "100.00_1.00", block, index)
+
+    backup = example_grid / "backup"
+    backup.mkdir(exist_ok=True)
+    indices = {id_: index for deps in job_deps.values() for id_ in deps["ids"]}
+    jobs, job_fns, job_deps = main.use_cache(
+        cache, jobs, job_fns, job_deps, backup, example_grid / "out", indices
+    )
+    cache.close()
+    assert (backup / "100.00_1.00.RasOrb").exists()
+    # The row is split after the cached point.
+    assert job_deps["right_cas_aug-cc-pvtz.in"]["ids"] == ["105.00_1.00", ]
+    rest = "right_cas_aug-cc-pvtz.95.00_1.00.in"
+    assert job_deps[rest]["ids"] == ["95.00_1.00", "90.00_1.00"]
+    assert job_deps[rest]["after"] == list()
+    # Columns wait for the part that computes their seed ...
+    for col in ("down_105.0", "up_105.0"):
+        assert job_deps[f"{col}_cas_aug-cc-pvtz.in"]["after"] \
+               == ["right_cas_aug-cc-pvtz.in", ]
+    for col in ("down_95.0", "up_90.0"):
+        assert job_deps[f"{col}_cas_aug-cc-pvtz.in"]["after"] == [rest, ]
+    # ... or not at all, when it was restored.
+    for col in ("down_100.0", "up_100.0"):
+        assert job_deps[f"{col}_cas_aug-cc-pvtz.in"]["after"] == list()
@@ -0,0 +1,94 @@
+from mcgridprep import ledger as ledger_mod
+from mcgridprep.cost import CostModel, predict_makespan, schedule_jobs
+from mcgridprep.ledger import Ledger, DONE, RC_OK
+
+
+class Clock:
+    now = 0.
+
+    @classmethod
+    def time(cls):
+        return cls.now
+
+
+def timed_ledger(db_fn, monkeypatch, runs):
+    """Ledger in which the jobs in 'runs' ran one after another. Every job
+    maps the IDs of its points to their runtimes in seconds."""
+    monkeypatch.setattr(ledger_mod, "time", Clock)
+    ledger = Ledger(db_fn)
+    for job_input, points in runs.items():
+        ledger.register(job_input, list(points))
+        ledger.set_running(job_input, list(points))
+        for id_, seconds in points.items():
+            Clock.now += seconds
+            ledger.set_finished(id_, DONE, RC_OK)
+    return ledger
+
+
+def test_nearest_timed_point(tmp_path, monkeypatch):
+    ledger = timed_ledger(tmp_path / "ledger.sqlite", monkeypatch, {
+        "row.in": {"105.00_1.00": 10., "110.00_1.00": 20.},
+        "col.in": {"105.00_0.90": 40.},
+    })
+    model = CostModel.from_ledgers([ledger, ])
+
+    assert model.timed
+    # The runtime of a job is split evenly between its points.
+    assert model.point_cost("105.00_1.00") == 15.
+    assert model.point_cost("105.00_0.90") == 40.
+    # Both coordinates are scaled by the range of the timed points, so
+    # 0.2 Å count more than 5°.
+    assert model.point_cost("110.00_0.80") == 40.
+    assert model.point_cost("100.00_1.00") == 15.
+    # IDs that are no grid coordinates get the mean runtime.
+    assert model.point_cost("foo") == (15. + 15. + 40.) / 3
+    assert model.job_cost(["105.00_0.90", "110.00_0.80"]) == 80.
+
+    untimed = CostModel()
+    assert not untimed.timed
+    assert untimed.point_cost("105.00_1.00") == 1.
+    assert untimed.job_cost(["a", "b", "c"]) == 3.
+
+
+def make_grid():
+    """A row of two points and a column started from each of them."""
+    points = {
+        "row.in": ["105.00_1.00", "100.00_1.00"],
+        "col_a.in": ["105.00_0.90", ],
+        "col_b.in": ["100.00_0.90", ],
+    }
+    job_deps = {
+        "row.in": {"after": list()},
+        "col_a.in": {"after": ["row.in", ],
+                     "needs": ["backup/105.00_1.00.RasOrb", ]},
+        "col_b.in": {"after": ["row.in", ],
+                     "needs": ["backup/100.00_1.00.RasOrb", ]},
+    }
+    model = CostModel({"105.00_1.00": 10., "100.00_1.00": 10.,
+                       "105.00_0.90": 40., "100.00_0.90": 5.})
+    priority = {"row.in": 60., "col_a.in": 40., "col_b.in": 5.}
+    return list(points), job_deps, points, model, priority
+
+
+def test_predict_makespan():
+    job_inputs, job_deps, points, model, priority = make_grid()
+
+    # The columns start as soon as their seed point is done.
+    starts, ends = schedule_jobs(job_inputs, job_deps, points, model, 3,
+                                 priority)
+    assert starts == {"row.in": 0., "col_a.in": 10., "col_b.in": 20.}
+    assert ends == {"row.in": 20., "col_a.in": 50., "col_b.in": 25.}
+    assert predict_makespan(job_inputs, job_deps, points, model, 3,
+                            priority) == 50.
+    # With one core the jobs run one after another.
+    assert predict_makespan(job_inputs, job_deps, points, model, 1,
+                            priority) == 65.
+    # Finished jobs are not run again and their points are available.
+    assert predict_makespan(job_inputs, job_deps, points, model, 2,
+                            priority, finished=["row.in", ]) == 40.
+    # Without the seeds the columns wait for the whole row.
+    barrier = {job_input: {"after": deps["after"]}
+               for job_input, deps in job_deps.items()}
+    assert predict_makespan(job_inputs, barrier, points, model, 3,
+                            priority) == 60.
+    assert predict_makespan(list(), dict(), dict(), model, 1, dict()) == 0.
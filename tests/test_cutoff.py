@@ -0,0 +1,87 @@
+from mcgridprep.ledger import Ledger, LEDGER_FN, DONE, SKIPPED, RC_OK
+from mcgridprep.run import EnergyCutoff, check_cutoff, skip_orphans
+
+from conftest import run_module
+
+
+def test_energy_cutoff():
+    cutoff = EnergyCutoff(cutoff=1.0, energies={"a": -76.0})
+    cutoff.add({"b": -75.99, "c": -75.9})
+    assert cutoff.minimum == -76.0
+    # 0.01 Eh are 0.27 eV and 0.1 Eh are 2.72 eV.
+    assert cutoff.check("b") is None
+    assert cutoff.check("c") == "2.72 eV above the grid minimum"
+    # Points without an energy are never cut off.
+    assert cutoff.check("d") is None
+
+
+def test_energy_rise():
+    prevs = {"b": "a", "c": "b", "d": "c"}
+    energies = {"a": -76.0, "b": -76.05, "c": -76.02, "d": -75.99}
+    cutoff = EnergyCutoff(rise=1.0, prevs=prevs, energies=energies)
+    # The chain rises from its lowest point b, not from its start a.
+    assert abs(cutoff.rising("d") - 0.06) < 1e-10
+    assert cutoff.check("c") is None
+    assert cutoff.check("d") == "energy rose by 1.63 eV"
+    assert cutoff.check("b") is None
+
+
+def test_check_cutoff():
+    cutoff = EnergyCutoff(cutoff=1.0)
+    states = {"a": (DONE, RC_OK), "b": ("failed", "RC_NOT_CONVERGED"),
+              "c": (DONE, RC_OK)}
+    energies = {"a": -76.0, "b": -70.0, "c": -75.9}
+    checked = set()
+    # The failed point b is neither checked nor part of the minimum.
+    assert check_cutoff(cutoff, states, energies, checked) \
+           == ("c", "2.72 eV above the grid minimum")
+    assert checked == {"a", "c"}
+    assert cutoff.minimum == -76.0
+    assert check_cutoff(cutoff, states, energies, checked) is None
+
+
+def test_skip_orphans(tmp_path):
+    """Jobs started from a stopped point are skipped, and so are the jobs
+    started from their points."""
+    job_deps = {
+        "row.in": {"ids": ["r1", "r2"], "needs": list()},
+        "col1.in": {"ids": ["c1"], "needs": ["backup/r1.RasOrb"]},
+        "col2.in": {"ids": ["c2"], "needs": ["backup/r2.RasOrb"]},
+        "tail.in": {"ids": ["t2"], "needs": ["backup/c2.RasOrb"]},
+    }
+    ledger = Ledger(tmp_path / "ledger.sqlite")
+    for job_input, deps in job_deps.items():
+        ledger.register(job_input, deps["ids"])
+    stopped = {"r2", }
+    skipped = skip_orphans(["col1.in", "col2.in", "tail.in"], job_deps,
+                           stopped, ledger)
+
+    assert skipped == ["col2.in", "tail.in"]
+    assert stopped == {"r2", "c2", "t2"}
+    assert sorted(ledger.ids_in_state(SKIPPED)) == ["c2", "t2"]
+    assert ledger.get("c1")["state"] == "pending"
+
+
+def test_cutoff_and_resume(example_grid, fake_molcas):
+    args = ["job_inputs", "--poll", "0.05", "--cpus", "4"]
+    out = run_module("run", args + ["--cutoff", "1.5"], example_grid)
+
+    # 90.00_1.00, the last point of the right row, is 2.65 eV above the
+    # minimum, so both columns at 90° are skipped.
+    assert "Point 90.00_1.00 in right_cas_aug-cc-pvtz.in: 2.65 eV" in out
+    assert "Skipping down_90.0_cas_aug-cc-pvtz.in" in out
+    assert "Skipping up_90.0_cas_aug-cc-pvtz.in" in out
+    ledger = Ledger(example_grid / LEDGER_FN)
+    skipped = set(ledger.ids_in_state(SKIPPED))
+    assert {"90.00_1.10", "90.00_0.90", "90.00_0.80", "90.00_0.70"} <= skipped
+    assert ledger.get("90.00_1.00")["state"] == DONE
+
+    # With a cutoff the skipped points stay skipped.
+    out = run_module("run", args + ["--cutoff", "1.5", "--resume"],
+                     example_grid)
+    assert "Skipping 12 jobs that already finished." in out
+    assert set(ledger.ids_in_state(SKIPPED)) == skipped
+
+    # Without, they are computed.
+    run_module("run", args + ["--resume"], example_grid)
+    assert ledger.counts() == {DONE: 25}
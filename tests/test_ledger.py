@@ -0,0 +1,69 @@
+from mcgridprep.ledger import Ledger, DONE, FAILED, SKIPPED, RC_OK
+from mcgridprep.run import job_ids, resume_jobs, split_input
+
+from test_batch import load_grid
+
+
+LEFT = "left_cas_aug-cc-pvtz.in"
+RIGHT = "right_cas_aug-cc-pvtz.in"
+
+
+def grid_ledger(grid_dir, states):
+    """Ledger of the example grid with the points in 'states' finished.
+    Done points get their RasOrb and HDF5 file."""
+    job_inputs, job_deps = load_grid(grid_dir)
+    ledger = Ledger(grid_dir / "ledger.sqlite")
+    for job_input in job_inputs:
+        ledger.register(job_input, job_ids(job_input, job_deps))
+    backup = grid_dir / "backup"
+    for id_, state in states.items():
+        ledger.set_finished(id_, state, RC_OK)
+        if state == DONE:
+            for ext in (".RasOrb", ".rasscf.h5"):
+                (backup / f"{id_}{ext}").write_text(id_)
+    return job_inputs, job_deps, ledger
+
+
+def test_resume(example_grid, monkeypatch):
+    monkeypatch.chdir(example_grid)
+    job_inputs, job_deps, ledger = grid_ledger(example_grid, {
+        "110.00_1.00": DONE,
+        "105.00_1.00": DONE,
+        "100.00_1.00": DONE,
+        "95.00_1.00": FAILED,
+    })
+    # Without its HDF5 file a point is computed again.
+    (example_grid / "backup" / "105.00_0.90.RasOrb").write_text("")
+    ledger.set_finished("105.00_0.90", DONE, RC_OK)
+
+    finished, run_inputs, ready_files = resume_jobs(job_inputs, job_deps,
+                                                    ledger)
+    assert finished == {LEFT, }
+    # The row continues after the last good point.
+    resume_input = run_inputs.pop(RIGHT)
+    with open(resume_input) as handle:
+        header, blocks = split_input(handle.read())
+    backup = example_grid / "backup"
+    assert f">> copy {backup}/100.00_1.00.RasOrb $Project.RasOrb" in header
+    assert [id_ for id_, _ in blocks] == ["95.00_1.00", "90.00_1.00"]
+    assert run_inputs == dict()
+    # Columns can start from the points that are done right away.
+    assert ready_files == set([str(backup / f"{id_}.RasOrb")
+                               for id_ in ("110.00_1.00", "105.00_1.00",
+                                           "100.00_1.00")])
+    ledger.close()
+
+
+def test_resume_keeps_skipped(example_grid, monkeypatch):
+    monkeypatch.chdir(example_grid)
+    states = {id_: DONE for id_ in ("110.00_1.00", "105.00_1.00")}
+    states.update({id_: SKIPPED for id_ in ("100.00_1.00", "95.00_1.00",
+                                            "90.00_1.00")})
+    job_inputs, job_deps, ledger = grid_ledger(example_grid, states)
+    finished, run_inputs, _ = resume_jobs(job_inputs, job_deps, ledger)
+    assert RIGHT in run_inputs
+    # With a cutoff the skipped points stay skipped.
+    finished, run_inputs, _ = resume_jobs(job_inputs, job_deps, ledger,
+                                          keep_skipped=True)
+    assert finished == {LEFT, RIGHT}
+    ledger.close()
@@ -0,0 +1,111 @@
+import os
+from pathlib import Path
+import subprocess
+import sys
+
+import pytest
+
+from conftest import EXAMPLE_DIR, TESTS_DIR, run_module
+from test_batch import load_grid
+
+
+def test_mst_tree_max_depth(main):
+    points = [(float(c1), 1.) for c1 in range(90, 115, 5)]
+    tree = main.mst_tree(points, [(100., 1.), ], "{:.2f}_{:.2f}", 1)
+    # Every point is started from the seed.
+    assert [prev for _, prev, _, _ in tree] \
+           == [None, ] + [(100., 1.), ] * (len(points) - 1)
+    with pytest.raises(ValueError):
+        main.mst_tree(points, [(100., 1.), ], "{:.2f}_{:.2f}", 0)
+
+
+def test_max_depth_is_checked(example_dir):
+    proc = subprocess.run(
+        [sys.executable, "-m", "mcgridprep.main", "--max-depth", "0"],
+        cwd=example_dir, env=dict(os.environ, PYTHONPATH=str(TESTS_DIR.parent)),
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
+    )
+    assert proc.returncode == 2
+    assert "--max-depth must be at least 1" in proc.stderr
+
+
+def write_seeds(example_dir, seeds):
+    inporb = example_dir / "water_rigid.RasOrb"
+    lines = ["seeds:", ]
+    for coord in seeds:
+        lines += [f"  - coord: {list(coord)}", f"    inporb: {inporb}"]
+    with open(example_dir / "mcgrid.yaml", "a") as handle:
+        handle.write("\n" + "\n".join(lines) + "\n")
+
+
+def test_single_seed_inputs_unchanged(example_grid):
+    # Inputs as written before seeds and job dependencies were added
+    with open(EXAMPLE_DIR / "expected_inputs") as handle:
+        expected = handle.read().replace("{root}", str(example_grid))
+    job_fns, _ = load_grid(example_grid)
+    inputs = "".join([f"### {fn}\n" + (example_grid / fn).read_text()
+                      for fn in job_fns])
+    assert inputs == expected
+
+
+def test_multiple_seeds(example_dir):
+    write_seeds(example_dir, [(95, 0.8), (105, 1.0)])
+    run_module("main", [], example_dir)
+    job_fns, job_deps = load_grid(example_dir)
+    inporb = str(example_dir / "water_rigid.RasOrb")
+    ids = [id_ for fn in job_fns for id_ in job_deps[fn]["ids"]]
+    # Every point is computed exactly once.
+    assert len(ids) == len(set(ids)) == 25
+    computed_by = {id_: fn for fn in job_fns for id_ in job_deps[fn]["ids"]}
+    for fn in job_fns:
+        deps = job_deps[fn]
+        assert fn.startswith(("seed1_", "seed2_"))
+        header = (example_dir / fn).read_text().split("&gateway")[0]
+        needs, = deps["needs"]
+        assert f">> copy {needs} $Project.RasOrb" in header
+        if needs == inporb:
+            # The rows start from the INPORB at their seed.
+            assert deps["after"] == list()
+        else:
+            # The columns start from a point of the row of their seed.
+            parent = computed_by[Path(needs).name[:-len(".RasOrb")]]
+            assert deps["after"] == [parent, ]
+            assert parent.split("_")[0] == fn.split("_")[0]
+    # Both rows start at their seed.
+    assert job_deps["seed1_right_cas_aug-cc-pvtz.in"]["ids"][0] \
+           == "95.00_0.80"
+    assert job_deps["seed2_right_cas_aug-cc-pvtz.in"]["ids"][0] \
+           == "105.00_1.00"
+
+
+def test_extend(example_grid):
+    # All points of the first grid were computed.
+    _, job_deps = load_grid(example_grid)
+    backup = example_grid / "backup"
+    old_ids = set([id_ for deps in job_deps.values() for id_ in deps["ids"]])
+    for id_ in old_ids:
+        (backup / f"{id_}.RasOrb").write_text(id_)
+    # Longer bonds
+    yaml_fn = example_grid / "mcgrid.yaml"
+    yaml_fn.write_text(yaml_fn.read_text().replace("coord2: [0.7, 1.1, 0.1]",
+                                                   "coord2: [0.7, 1.3, 0.1]"))
+    run_module("main", ["--extend", ], example_grid)
+
+    job_fns, job_deps = load_grid(example_grid)
+    computed_by = {id_: fn for fn in job_fns for id_ in job_deps[fn]["ids"]}
+    new_ids = set([f"{c1:.2f}_{c2:.2f}" for c1 in range(90, 115, 5)
+                   for c2 in (1.2, 1.3)])
+    assert set(computed_by) == new_ids
+    for fn in job_fns:
+        deps = job_deps[fn]
+        needs, = deps["needs"]
+        seed = Path(needs).name[:-len(".RasOrb")]
+        if seed in old_ids:
+            # Computed points are present already.
+            assert deps["after"] == list()
+        else:
+            assert deps["after"] == [computed_by[seed], ]
+    # New points start from the closest computed point.
+    for c1 in range(90, 115, 5):
+        fn = computed_by[f"{c1:.2f}_1.20"]
+        assert job_deps[fn]["needs"] == [str(backup / f"{c1:.2f}_1.10.RasOrb")]
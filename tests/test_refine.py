@@ -0,0 +1,123 @@
+import asyncio
+import re
+
+from mcgridprep.ledger import Ledger, LEDGER_FN, DONE
+from mcgridprep import run
+from mcgridprep.run import ID_RE, refine_job, rough_step, split_input, \
+                           step_blocks
+
+from conftest import run_module
+
+
+COLUMN = "down_100.0_cas_aug-cc-pvtz.in"
+
+
+def column_blocks(grid_dir):
+    with open(grid_dir / COLUMN) as handle:
+        return split_input(handle.read())
+
+
+def h_coords(block):
+    return [float(num) for num in
+            re.search("H\s+\S+\s+(\S+)\s+(\S+)", block).groups()]
+
+
+def test_step_blocks(example_grid):
+    _, blocks = column_blocks(example_grid)
+    (_, block_a), (_, block_b) = blocks[:2]
+    steps = step_blocks(block_a, block_b, 2)
+
+    assert len(steps) == 2
+    y_a, z_a = h_coords(block_a)
+    y_b, z_b = h_coords(block_b)
+    for i, step in enumerate(steps, 1):
+        y, z = h_coords(step)
+        assert abs(y - (y_a + i/3*(y_b - y_a))) < 1e-6
+        assert abs(z - (z_a + i/3*(z_b - z_a))) < 1e-6
+        assert f">> echo \"step {i}/2\"" in step
+        assert "&rasscf" in step
+        # Steps are not points of the grid.
+        assert re.search(ID_RE, step) is None
+        assert "$backup_path" not in step
+    # Identical geometries and blocks without &rasscf can't be stepped.
+    assert step_blocks(block_a, block_a, 2) is None
+    assert step_blocks(block_a, block_b.split("&rasscf")[0], 2) is None
+
+
+def test_rough_step():
+    ids = ["a", "b", "c"]
+    states = {id_: (DONE, "RC_ALL_IS_WELL") for id_ in ids}
+    energies = {"a": -76.0, "b": -76.01, "c": -75.9}
+    iterations = {"a": 10, "b": 60, "c": 20}
+
+    # 0.11 Eh between b and c are 3 eV.
+    assert rough_step(ids, states, energies, iterations, set(),
+                      jump=1.0) == ("c", "energy changed by 2.99 eV")
+    assert rough_step(ids, states, energies, iterations, set(),
+                      jump=5.0) is None
+    assert rough_step(ids, states, energies, iterations, set(),
+                      max_iter=50) == ("b", "RASSCF needed 60 iterations")
+    # Points already checked or refined are not reported again.
+    checked = set()
+    assert rough_step(ids, states, energies, iterations, checked,
+                      max_iter=50)[0] == "b"
+    assert rough_step(ids, states, energies, iterations, checked,
+                      max_iter=50) is None
+    assert rough_step(ids, states, energies, iterations, set(),
+                      max_iter=50, refined={"b", }) is None
+    # Points still running are not checked.
+    assert rough_step(ids, {"a": states["a"]}, energies, iterations,
+                      set(), max_iter=50) is None
+
+
+def test_refine_without_steps_when_they_fail(example_grid, monkeypatch):
+    """Without a ledger the steps count as failed when they did not write
+    the RasOrb of the point, even when there is none at all."""
+    monkeypatch.chdir(example_grid)
+    _, blocks = column_blocks(example_grid)
+    ids = [id_ for id_, _ in blocks]
+    (example_grid / "backup" / f"{ids[0]}.RasOrb").write_text("")
+    runs = list()
+
+    async def run_job(job_input, **kwargs):
+        runs.append(job_input)
+        return {"job_input": job_input}
+
+    monkeypatch.setattr(run, "run_job", run_job)
+    result = asyncio.run(refine_job(COLUMN, ids[1], set(), steps=2))
+
+    stem = COLUMN[:-len(".in")]
+    assert runs == [f"{stem}.steps.in", f"{stem}.nosteps.in"]
+    assert result == {"job_input": f"{stem}.nosteps.in"}
+    with open(f"{stem}.nosteps.in") as handle:
+        _, blocks = split_input(handle.read())
+    assert [id_ for id_, _ in blocks] == ids[1:]
+    assert "step 1/2" not in blocks[0][1]
+
+
+def test_jump_with_failing_steps(example_grid, fake_molcas):
+    """Points down the columns change by more than 1 eV. The steps
+    inserted in front of them fail, so they are run again without."""
+    fake_molcas.setenv("FAKE_STEP_FAIL", "1")
+    out = run_module("run", ["job_inputs", "--poll", "0.05", "--cpus", "4",
+                             "--jump", "1.0"], example_grid)
+
+    assert "Inserting 2 steps between 100.00_0.90 and 100.00_0.80" in out
+    assert "Rerunning 100.00_0.80 without them" in out
+    assert (example_grid / "down_100.0_cas_aug-cc-pvtz.nosteps.in").exists()
+    ledger = Ledger(example_grid / LEDGER_FN)
+    assert ledger.counts() == {DONE: 25}
+    assert ledger.get("100.00_0.80")["job"] \
+           == "down_100.0_cas_aug-cc-pvtz.nosteps.in"
+
+
+def test_jump_with_steps(example_grid, fake_molcas):
+    out = run_module("run", ["job_inputs", "--poll", "0.05", "--cpus", "4",
+                             "--jump", "1.0"], example_grid)
+
+    assert "Inserting 2 steps between 100.00_0.90 and 100.00_0.80" in out
+    assert "without them" not in out
+    ledger = Ledger(example_grid / LEDGER_FN)
+    assert ledger.counts() == {DONE: 25}
+    assert ledger.get("100.00_0.80")["job"] \
+           == "down_100.0_cas_aug-cc-pvtz.steps.in"
@@ -0,0 +1,94 @@
+import asyncio
+
+from mcgridprep.ledger import Ledger, DONE, FAILED
+from mcgridprep.run import job_ids, run_job
+
+from test_batch import load_grid
+
+
+COLUMN = "down_100.0_cas_aug-cc-pvtz.in"
+
+
+def run_column(grid_dir, ledger_cls=Ledger, **run_kwargs):
+    """Run the column down from 100° alone, with the points of the
+    neighbouring column and the row already computed. 'run_kwargs' are
+    passed on to run_job."""
+    job_inputs, job_deps = load_grid(grid_dir)
+    backup = grid_dir / "backup"
+    for id_ in ("100.00_1.00", "105.00_1.00", "105.00_0.90", "105.00_0.80",
+                "105.00_0.70"):
+        c1, c2 = id_.split("_")
+        (backup / f"{id_}.RasOrb").write_text(f"{c1} {c2} -76.0\n")
+    seeds = dict()
+    for deps in job_deps.values():
+        seeds.update(deps.get("seeds", dict()))
+    ledger = ledger_cls(grid_dir / "ledger.sqlite")
+    ids = job_ids(COLUMN, job_deps)
+    ledger.register(COLUMN, ids)
+    save_path = grid_dir / "out"
+    save_path.mkdir()
+    result = asyncio.run(run_job(COLUMN, save_path, ledger, poll=0.05,
+                                 seeds=seeds, **run_kwargs))
+    return result, ledger, ids
+
+
+def copied_orbitals(input_fn):
+    with open(input_fn) as handle:
+        return [line.split()[2] for line in handle
+                if line.startswith(">> copy ")
+                and line.strip().endswith(" $Project.RasOrb")]
+
+
+def test_retry_order(example_grid, fake_molcas, monkeypatch):
+    """The same-row neighbour is tried first, then the diagonal
+    neighbour and at last the INPORB."""
+    monkeypatch.chdir(example_grid)
+    fake_molcas.setenv("FAKE_FAIL", "100.00_0.70:3")
+    result, ledger, ids = run_column(example_grid, retries=3)
+
+    backup = example_grid / "backup"
+    stem = COLUMN[:-len(".in")]
+    # Every retry is named after the input it retries.
+    retries = [f"{stem}.retry1.in", f"{stem}.retry1.retry2.in",
+               f"{stem}.retry1.retry2.retry3.in"]
+    assert [copied_orbitals(retry) for retry in retries] == [
+        [str(backup / "105.00_0.70.RasOrb"), ],
+        [str(backup / "105.00_0.80.RasOrb"), ],
+        [str(example_grid / "water_rigid.RasOrb"), ],
+    ]
+    assert result["job_input"] == retries[-1]
+    assert ledger.counts(ids) == {DONE: 3}
+    assert ledger.get("100.00_0.70")["job"] == retries[-1]
+
+
+def test_retry_continues_the_job(example_grid, fake_molcas, monkeypatch):
+    """After the retry of a point in the middle of the job succeeded, the
+    rest of the job is run from it."""
+    monkeypatch.chdir(example_grid)
+    fake_molcas.setenv("FAKE_FAIL", "100.00_0.80")
+    result, ledger, ids = run_column(example_grid, retries=1)
+
+    stem = COLUMN[:-len(".in")]
+    assert copied_orbitals(f"{stem}.retry1.in") \
+           == [str(example_grid / "backup" / "105.00_0.80.RasOrb"), ]
+    assert ledger.counts(ids) == {DONE: 3}
+    assert ledger.get("100.00_0.90")["job"] == COLUMN
+    assert ledger.get("100.00_0.80")["job"] == f"{stem}.retry1.in"
+    assert ledger.get("100.00_0.70")["job"] == f"{stem}.retry1.in"
+    # 100.00_0.70 was started from the retried point, not from the INPORB.
+    with open(example_grid / "out" / f"{stem}.retry1.out") as handle:
+        assert handle.read().count("Convergence after 20 iterations") == 2
+
+
+def test_no_seeds_left(example_grid, fake_molcas, monkeypatch):
+    """Without retries left, the points after the failed one are continued
+    from its orbitals."""
+    monkeypatch.chdir(example_grid)
+    fake_molcas.setenv("FAKE_FAIL", "100.00_0.80:2")
+    result, ledger, ids = run_column(example_grid, retries=1)
+
+    stem = COLUMN[:-len(".in")]
+    assert result["job_input"] == f"{stem}.retry1.cont.in"
+    assert ledger.get("100.00_0.80")["state"] == FAILED
+    assert ledger.get("100.00_0.70")["state"] == DONE
+    assert ledger.get("100.00_0.70")["job"] == f"{stem}.retry1.cont.in"
@@ -0,0 +1,156 @@
+import asyncio
+
+from mcgridprep.ledger import Ledger, DONE, FAILED, RC_OK
+from mcgridprep.run import job_is_ready, run_dag
+
+
+def chain_deps(job_inputs):
+    """Every job waits for the job before it."""
+    job_deps = dict()
+    for i, job_input in enumerate(job_inputs):
+        job_deps[job_input] = {
+            "after": job_inputs[i-1:i],
+            "ids": [job_input, ],
+            "needs": list(),
+        }
+    return job_deps
+
+
+def record_runs(runs):
+    async def run_part(job_input, env=None, **kwargs):
+        runs.append((job_input, env))
+        await asyncio.sleep(0.01)
+        return {"job_input": job_input, "stopped": list()}
+    return run_part
+
+
+def test_free_cores_go_to_the_last_jobs():
+    job_inputs = ["a.in", "b.in", "c.in", "d.in"]
+    runs = list()
+    asyncio.run(run_dag(job_inputs, chain_deps(job_inputs), 4,
+                        record_runs(runs), poll=0.01, scale_cores="omp"))
+    # The cores are split between all unfinished jobs, so extra threads
+    # only go out once fewer jobs than cores are left.
+    threads = [env["OMP_NUM_THREADS"] for _, env in runs]
+    assert [job_input for job_input, _ in runs] == job_inputs
+    assert threads == ["1", "1", "2", "4"]
+
+
+def test_columns_start_on_seed_with_scaled_cores(tmp_path):
+    rows = ["left.in", "right.in"]
+    cols = [f"col_{i}.in" for i in range(6)]
+    rasorbs = {row: tmp_path / f"{row}.RasOrb" for row in rows}
+    job_deps = {row: {"after": list(), "ids": [row, ], "needs": list()}
+                for row in rows}
+    job_deps.update({col: {"after": [rows[i % 2], ], "ids": [col, ],
+                           "needs": [str(rasorbs[rows[i % 2]]), ]}
+                     for i, col in enumerate(cols)})
+    runs = list()
+
+    async def run_part(job_input, env=None, **kwargs):
+        runs.append((f"start {job_input}", env["OMP_NUM_THREADS"]))
+        if job_input in rows:
+            # The seed lands right away, the row keeps running.
+            rasorbs[job_input].write_text("orbitals")
+            await asyncio.sleep(0.5)
+        runs.append((f"end {job_input}", None))
+        return dict()
+
+    asyncio.run(run_dag(rows + cols, job_deps, 8, run_part, poll=0.01,
+                        scale_cores="omp"))
+    events = [event for event, _ in runs]
+    for col in cols:
+        assert events.index(f"start {col}") < events.index("end left.in")
+    # With 8 jobs for 8 cores every job runs on one core.
+    assert all([threads == "1" for event, threads in runs
+                if event.startswith("start")])
+def test_seeds_are_checked_in_the_ledger_of_their_project(tmp_path):
+    # Two projects with the same point IDs. The row of 'a' failed a first
+    # time and is retried, so its seed RasOrb must not be used yet.
+    job_inputs = list()
+    job_deps = dict()
+    ledgers = dict()
+    rasorbs = dict()
+    for project, state in (("a", FAILED), ("b", DONE)):
+        row, col = [str(tmp_path / project / name)
+                    for name in ("row.in", "col.in")]
+        rasorb = tmp_path / project / "1.00_1.00.RasOrb"
+        ledger = Ledger(tmp_path / f"{project}.sqlite")
+        ledger.register(row, ["1.00_1.00", ])
+        ledger.register(col, ["1.00_0.90", ])
+        ledger.set_finished("1.00_1.00", state, RC_OK)
+        job_inputs += [row, col]
+        job_deps[row] = {"after": list(), "ids": ["1.00_1.00", ],
+                         "needs": list()}
+        rasorbs[row] = rasorb
+        job_deps[col] = {"after": [row, ], "ids": ["1.00_0.90", ],
+                         "needs": [str(rasorb), ]}
+        ledgers.update({row: ledger, col: ledger})
+
+    runs = list()
+
+    async def run_part(job_input, **kwargs):
+        runs.append(f"start {job_input}")
+        rasorb = rasorbs.get(job_input)
+        if rasorb:
+            rasorb.parent.mkdir(exist_ok=True)
+            rasorb.write_text("orbitals")
+            await asyncio.sleep(0.3)
+        runs.append(f"end {job_input}")
+        return dict()
+
+    asyncio.run(run_dag(job_inputs, job_deps, 4, run_part, poll=0.01,
+                        ledgers=ledgers))
+    a_row, a_col, b_row, b_col = job_inputs
+    # 'b' starts its column from the seed file, 'a' waits for its row.
+    assert runs.index(f"start {b_col}") < runs.index(f"end {b_row}")
+    assert runs.index(f"start {a_col}") > runs.index(f"end {a_row}")
+
+
+def test_job_is_ready(tmp_path):
+    rasorb = tmp_path / "1.00_1.00.RasOrb"
+    deps = {"after": ["row.in", ], "needs": [str(rasorb), ]}
+    sizes = dict()
+    assert not job_is_ready(deps, set(), 0., sizes)
+    # Ready when the parent finished, ...
+    assert job_is_ready(deps, {"row.in", }, 0., sizes)
+    # ... or when the seed was written and its size didn't change since
+    # the last check.
+    rasorb.write_text("orbitals")
+    assert not job_is_ready(deps, set(), 0., sizes)
+    assert job_is_ready(deps, set(), 0., sizes)
+    rasorb.write_text("more orbitals")
+    assert not job_is_ready(deps, set(), 0., sizes)
+    # Files from before the start of the runner are from an earlier run,
+    # unless they are known to be ready.
+    sizes = dict()
+    not_before = rasorb.stat().st_mtime + 1
+    for _ in range(2):
+        assert not job_is_ready(deps, set(), not_before, sizes)
+    assert job_is_ready(deps, set(), not_before, sizes, {str(rasorb), })
+    # Jobs without parents start from the INPORB right away.
+    assert job_is_ready({"after": [], "needs": [str(tmp_path / "x")]},
+                        set(), 0., dict())
+
+
+def test_columns_start_before_row_finished(tmp_path):
+    rasorb = tmp_path / "1.00_1.00.RasOrb"
+    job_deps = {
+        "row.in": {"after": [], "ids": ["1.00_1.00", "2.00_1.00"],
+                   "needs": []},
+        "col.in": {"after": ["row.in", ], "ids": ["1.00_0.90", ],
+                   "needs": [str(rasorb), ]},
+    }
+    runs = list()
+
+    async def run_part(job_input, **kwargs):
+        runs.append(f"start {job_input}")
+        if job_input == "row.in":
+            rasorb.write_text("orbitals")
+            await asyncio.sleep(0.3)
+        runs.append(f"end {job_input}")
+        return dict()
+
+    asyncio.run(run_dag(["row.in", "col.in"], job_deps, 2, run_part,
+                        poll=0.01))
+    assert runs.index("start col.in") < runs.index("end row.in")
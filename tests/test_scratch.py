@@ -0,0 +1,95 @@
+from collections import namedtuple
+import errno
+import os
+
+from mcgridprep import run
+from mcgridprep.run import place_file, scratch_root
+
+from test_retry import COLUMN, run_column
+
+
+Usage = namedtuple("Usage", "total used free")
+
+
+def stub_free_space(monkeypatch, free_gb):
+    monkeypatch.setattr(run.shutil, "disk_usage",
+                        lambda dir_: Usage(0, 0, free_gb[dir_] * 1024**3))
+
+
+def test_scratch_root(monkeypatch, capsys):
+    assert scratch_root(None) is None
+    assert scratch_root(list()) is None
+    stub_free_space(monkeypatch, {"/small": 0.5, "/fast": 2., "/big": 5.})
+    scratch = ["/small", "/fast", "/big"]
+    # The first directory with enough space is used.
+    assert scratch_root(scratch, min_free=1.) == "/fast"
+    assert scratch_root(scratch, min_free=0.) == "/small"
+    assert capsys.readouterr().out == ""
+    # Without enough space anywhere the emptiest directory is used.
+    assert scratch_root(scratch, min_free=10.) == "/big"
+    assert "Using '/big' with 5.0 GB" in capsys.readouterr().out
+
+
+def test_place_file_links(tmp_path):
+    src = tmp_path / "job.in"
+    src.write_text("input")
+    dst = tmp_path / "sub" / "job.in"
+    dst.parent.mkdir()
+    dst.write_text("old")
+    place_file(src, dst)
+    assert os.path.samefile(src, dst)
+    assert dst.read_text() == "input"
+
+    moved = tmp_path / "moved.in"
+    place_file(src, moved, move=True)
+    assert not src.exists()
+    assert moved.read_text() == "input"
+
+
+def fail_exdev(*args):
+    raise OSError(errno.EXDEV, "Invalid cross-device link")
+
+
+def test_place_file_across_devices(tmp_path, monkeypatch):
+    src = tmp_path / "job.out"
+    src.write_text("output")
+    dst = tmp_path / "out" / "job.out"
+    dst.parent.mkdir()
+
+    # Different devices are copied right away.
+    monkeypatch.setattr(run, "same_filesystem", lambda src, dst_dir: False)
+    place_file(src, dst)
+    assert dst.read_text() == "output"
+    assert not os.path.samefile(src, dst)
+    place_file(src, dst, move=True)
+    assert not src.exists()
+    assert dst.read_text() == "output"
+
+    # Linking and renaming can fail on the same device, e.g. across bind
+    # mounts.
+    src.write_text("output 2")
+    monkeypatch.setattr(run, "same_filesystem", lambda src, dst_dir: True)
+    monkeypatch.setattr(run.os, "link", fail_exdev)
+    monkeypatch.setattr(run.os, "replace", fail_exdev)
+    place_file(src, dst)
+    assert dst.read_text() == "output 2"
+    assert src.exists()
+    place_file(src, dst, move=True)
+    assert not src.exists()
+    assert dst.read_text() == "output 2"
+
+
+def test_jobs_run_in_scratch(example_grid, fake_molcas, monkeypatch, capsys):
+    monkeypatch.chdir(example_grid)
+    scratch = example_grid / "scratch"
+    scratch.mkdir()
+    stub_free_space(monkeypatch, {str(scratch): 0.5})
+    result, ledger, ids = run_column(example_grid, scratch=[str(scratch), ],
+                                     min_free=1.)
+
+    out = capsys.readouterr().out
+    assert f"Using '{scratch}' with 0.5 GB" in out
+    assert f"Running {COLUMN} in {scratch}{os.sep}" in out
+    # The job directory is removed and the output lands in ./out.
+    assert list(scratch.iterdir()) == list()
+    assert (example_grid / "out" / COLUMN).with_suffix(".out").exists()
@@ -0,0 +1,41 @@
+from mcgridprep.cost import CostModel
+from mcgridprep.run import job_ids
+from mcgridprep.sim import sample_durations, simulate
+
+from test_batch import load_grid
+
+
+def test_barrier_waits_for_both_rows(example_grid):
+    job_inputs, job_deps = load_grid(example_grid)
+    points = {job_input: job_ids(job_input, job_deps)
+              for job_input in job_inputs}
+    starts, ends = simulate(job_inputs, job_deps, points, CostModel(), 12,
+                            "barrier")
+    rows_done = max(ends[job_input] for job_input in job_inputs[:2])
+    assert all([starts[job_input] >= rows_done
+                for job_input in job_inputs[2:]])
+    # With the dependencies from mcgridprep the columns start early.
+    starts, ends = simulate(job_inputs, job_deps, points, CostModel(), 12,
+                            "fifo")
+    assert min(starts[job_input] for job_input in job_inputs[2:]) \
+           < rows_done
+
+
+def test_barrier_with_pack_is_never_faster(example_grid):
+    job_inputs, job_deps = load_grid(example_grid)
+    points = {job_input: job_ids(job_input, job_deps)
+              for job_input in job_inputs}
+    all_ids = [id_ for ids in points.values() for id_ in ids]
+    for seed in range(5):
+        model = CostModel(sample_durations(all_ids, "lognormal", 1., 0.5,
+                                           seed))
+        for pack in (2, 3):
+            for cpus in (2, 4, 8):
+                makespans = dict()
+                for scheduler in ("fifo", "barrier"):
+                    starts, ends = simulate(job_inputs, job_deps, points,
+                                            model, cpus, scheduler, pack)
+                    # Every task of the first array holds a row.
+                    assert min(starts.values()) == 0.
+                    makespans[scheduler] = max(ends.values())
+                assert makespans["barrier"] >= makespans["fifo"] - 1e-6
@@ -0,0 +1,61 @@
+from mcgridprep.ledger import Ledger, LEDGER_FN, DONE
+
+from conftest import run_module
+
+
+COLUMN = "down_90.0_cas_aug-cc-pvtz"
+FIRST = "90.00_0.90"
+# The column down from 90° starts from the last point of the right row.
+# With 0.2 s per point the row takes 0.8 s and the speculative run of the
+# three points of the column, started from the INPORB, lands before.
+SPEC_ARGS = ["job_inputs", "--poll", "0.05", "--cpus", "12", "--speculate"]
+
+
+def rasorb_energy(fn):
+    with open(fn) as handle:
+        return float(handle.read().split()[2])
+
+
+def test_speculation_accepted(example_grid, fake_molcas):
+    fake_molcas.setenv("FAKE_DELAY", "0.2")
+    out = run_module("run", SPEC_ARGS, example_grid)
+
+    assert f"Accepted the speculative run of {COLUMN}.in." in out
+    assert "Rejecting" not in out
+    backup = example_grid / "backup"
+    # The first point was checked, the rest is taken from the spec folder.
+    assert (backup / "spec" / f"{FIRST}.RasOrb").exists()
+    assert not (backup / "spec" / "90.00_0.80.RasOrb").exists()
+    assert (backup / "90.00_0.80.RasOrb").exists()
+    assert not (example_grid / f"{COLUMN}.rerun.in").exists()
+    ledger = Ledger(example_grid / LEDGER_FN)
+    assert ledger.counts() == {DONE: 25}
+    assert ledger.energies()["90.00_0.70"] == \
+           rasorb_energy(backup / "90.00_0.70.RasOrb")
+
+
+def test_speculation_rejected(example_grid, fake_molcas):
+    fake_molcas.setenv("FAKE_DELAY", "0.2")
+    # Started from the INPORB the first point converges to another root.
+    fake_molcas.setenv("FAKE_FLIP", FIRST)
+    out = run_module("run", SPEC_ARGS, example_grid)
+
+    assert f"Rejecting the speculative run of {COLUMN}.in" in out
+    assert f"Running {COLUMN}.rerun.in" in out
+    backup = example_grid / "backup"
+    spec_energy = rasorb_energy(backup / "spec" / f"{FIRST}.RasOrb")
+    ledger = Ledger(example_grid / LEDGER_FN)
+    energies = ledger.energies()
+    assert abs(spec_energy - energies[FIRST] - 0.1) < 1e-6
+    assert energies[FIRST] == rasorb_energy(backup / f"{FIRST}.RasOrb")
+
+    # The rest of the column is run again from the checked point.
+    with open(example_grid / f"{COLUMN}.rerun.in") as handle:
+        rerun = handle.read()
+    assert f">> copy {backup}/{FIRST}.RasOrb $Project.RasOrb" in rerun
+    assert f"*# {FIRST} #*" not in rerun
+    assert "*# 90.00_0.70 #*" in rerun
+    for id_ in ("90.00_0.80", "90.00_0.70"):
+        assert ledger.get(id_)["job"].endswith(f"{COLUMN}.rerun.in")
+        assert energies[id_] == rasorb_energy(backup / f"{id_}.RasOrb")
+    assert ledger.counts() == {DONE: 25}
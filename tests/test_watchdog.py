@@ -0,0 +1,117 @@
+import asyncio
+import signal
+import sys
+
+from mcgridprep.ledger import Ledger, DONE, TIMEOUT
+from mcgridprep.run import Watchdog, kill_job, point_timeout
+
+from test_retry import COLUMN, run_column
+
+
+HUNG = "100.00_0.80"
+
+
+class RecordingLedger(Ledger):
+    """Ledger that remembers every state a point was finished with."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.finished = list()
+
+    def set_finished(self, id_, state, rc, *args, **kwargs):
+        self.finished.append((id_, state, rc))
+        super().set_finished(id_, state, rc, *args, **kwargs)
+
+
+def test_watchdog(tmp_path):
+    out_fn = tmp_path / "job.out"
+    assert Watchdog().check(out_fn, 0) is None
+
+    watchdog = Watchdog(timeout=60.)
+    assert watchdog.check(out_fn, 0) is None
+    watchdog.start -= 61.
+    assert watchdog.check(out_fn, 0) == "wall time exceeded"
+
+    watchdog = Watchdog(stall=10.)
+    watchdog.grown -= 11.
+    out_fn.write_text("more output")
+    # The output grew since the last check.
+    assert watchdog.check(out_fn, 0) is None
+    watchdog.grown -= 11.
+    assert watchdog.check(out_fn, 0) == "output stalled"
+
+    watchdog = Watchdog(point_timeout=10.)
+    watchdog.point_start -= 11.
+    # A point finished since the last check.
+    assert watchdog.check(out_fn, 1) is None
+    watchdog.point_start -= 11.
+    assert watchdog.check(out_fn, 1) == "point time exceeded"
+
+
+def test_point_timeout(tmp_path, monkeypatch):
+    ledger = Ledger(tmp_path / "ledger.sqlite")
+    assert point_timeout(None, 3.) is None
+    assert point_timeout(ledger, None) is None
+    monkeypatch.setattr(ledger, "durations", lambda: {"a": 1., "b": 2.})
+    # Too few points to trust the median
+    assert point_timeout(ledger, 3.) is None
+    monkeypatch.setattr(ledger, "durations",
+                        lambda: {"a": 1., "b": 2., "c": 10.})
+    assert point_timeout(ledger, 3.) == 6.
+
+
+def test_kill_job():
+    async def kill(code, grace):
+        proc = await asyncio.create_subprocess_exec(
+            sys.executable, "-c", code, start_new_session=True
+        )
+        # Give the process time to install its signal handler.
+        await asyncio.sleep(0.5)
+        await kill_job(proc, grace=grace)
+        return proc.returncode
+
+    sleep = "import time; time.sleep(100)"
+    assert asyncio.run(kill(sleep, 10.)) == -signal.SIGTERM
+    # Processes that ignore SIGTERM are killed after the grace period.
+    ignore = "import signal; signal.signal(signal.SIGTERM, signal.SIG_IGN); "
+    assert asyncio.run(kill(ignore + sleep, 0.5)) == -signal.SIGKILL
+
+
+def test_timeout_is_retried(example_grid, fake_molcas, monkeypatch):
+    """A hanging point is killed, recorded as timed out and retried."""
+    monkeypatch.chdir(example_grid)
+    fake_molcas.setenv("FAKE_HANG", HUNG)
+    result, ledger, ids = run_column(example_grid, RecordingLedger,
+                                     retries=1, timeout=1.)
+
+    assert (HUNG, TIMEOUT, "wall time exceeded") in ledger.finished
+    stem = COLUMN[:-len(".in")]
+    assert result["job_input"] == f"{stem}.retry1.in"
+    assert ledger.counts(ids) == {DONE: 3}
+    assert ledger.get(HUNG)["job"] == f"{stem}.retry1.in"
+
+
+def test_timeout_without_retries(example_grid, fake_molcas, monkeypatch):
+    """Without retries the points after the timed out point are still
+    continued, as they never ran."""
+    monkeypatch.chdir(example_grid)
+    fake_molcas.setenv("FAKE_HANG", HUNG)
+    result, ledger, ids = run_column(example_grid, retries=0, stall=0.5)
+
+    assert ledger.get(HUNG)["state"] == TIMEOUT
+    assert ledger.get(HUNG)["rc"] == "output stalled"
+    assert ledger.get("100.00_0.70")["state"] == DONE
+    assert ledger.get("100.00_0.90")["state"] == DONE
+
+
+def test_point_factor(example_grid, fake_molcas, monkeypatch):
+    monkeypatch.chdir(example_grid)
+    fake_molcas.setenv("FAKE_HANG", HUNG)
+    # A median point runtime of 0.2 s lets a point take 0.6 s.
+    monkeypatch.setattr(Ledger, "durations",
+                        lambda self: {"a": 0.1, "b": 0.2, "c": 0.3})
+    result, ledger, ids = run_column(example_grid, RecordingLedger,
+                                     retries=1, point_factor=3.)
+
+    assert (HUNG, TIMEOUT, "point time exceeded") in ledger.finished
+    assert ledger.counts(ids) == {DONE: 3}
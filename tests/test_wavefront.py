@@ -0,0 +1,53 @@
+import asyncio
+import re
+
+import pytest
+
+from mcgridprep.ledger import Ledger, DONE, SKIPPED, RC_OK
+from mcgridprep.run import job_ids, wavefront
+
+from conftest import run_module
+from test_batch import load_grid
+
+
+@pytest.fixture
+def point_grid(example_dir):
+    """tests/01_example with one job per point."""
+    run_module("main", ["--points", ], example_dir)
+    return example_dir
+
+
+def test_wavefront_stops_at_cutoff(point_grid, monkeypatch):
+    monkeypatch.chdir(point_grid)
+    job_inputs, job_deps = load_grid(point_grid)
+    ledger = Ledger(point_grid / "ledger.sqlite")
+    for job_input in job_inputs:
+        ledger.register(job_input, job_ids(job_input, job_deps))
+    seeds = dict()
+    mems = list()
+
+    async def run_part(job_input, mem=None, **kwargs):
+        with open(job_input) as handle:
+            text = handle.read()
+        id_, = job_ids(job_input, job_deps) if job_input in job_deps \
+               else re.findall(r"\*# (\S+) #\*", text)
+        seeds[id_] = re.search(r"^>> copy (\S+) \$Project.RasOrb", text,
+                               re.MULTILINE)[1]
+        mems.append(mem)
+        ledger.set_finished(id_, DONE, RC_OK, energy=-76.)
+        # The column at 95 deg lies beyond the cutoff.
+        return {"stopped": [id_, ] if id_.startswith("95.00") else list()}
+
+    asyncio.run(wavefront(job_inputs, job_deps, 4, run_part, ledger,
+                          poll=0.01, mem_budget=4000.))
+    # Nothing was started from the stopped points, so the column at 90 deg
+    # could not be reached.
+    assert not [seed for seed in seeds.values() if "/95.00_" in seed]
+    col_90 = [id_ for job_input in job_inputs
+              for id_ in job_ids(job_input, job_deps)
+              if id_.startswith("90.00")]
+    assert col_90 and not (set(col_90) & set(seeds))
+    assert all([ledger.get(id_)["state"] == SKIPPED for id_ in col_90])
+    assert len(seeds) == len(job_inputs) - len(col_90)
+    # The memory budget is split between the jobs.
+    assert mems and all([0 < mem <= 4000. for mem in mems])
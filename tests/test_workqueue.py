@@ -0,0 +1,75 @@
+import asyncio
+import multiprocessing
+import os
+import subprocess
+import sys
+
+from mcgridprep.run import work
+from mcgridprep.workqueue import WorkQueue, QUEUE_DIR
+
+from conftest import TESTS_DIR
+
+
+# Job inputs in subfolders, so their names contain a '/'.
+ROWS = ["rows/left.in", "rows/right.in"]
+COLS = [f"cols/col_{i}.in" for i in range(8)]
+
+
+def grid_deps():
+    job_deps = {job_input: {"after": list(), "ids": [job_input, ]}
+                for job_input in ROWS}
+    job_deps.update({job_input: {"after": [ROWS[i % 2], ],
+                                 "ids": [job_input, ]}
+                     for i, job_input in enumerate(COLS)})
+    return job_deps
+
+
+def run_worker(queue_dir, worker, log_fn):
+    async def run_part(job_input, **kwargs):
+        with open(log_fn, "a") as handle:
+            handle.write(f"{job_input} {worker}\n")
+        await asyncio.sleep(0.05)
+        return {"returncode": 0, "duration": 0.05}
+
+    queue = WorkQueue(queue_dir)
+    queue.create(ROWS + COLS)
+    asyncio.run(work(queue, worker, ROWS + COLS, grid_deps(), 2, run_part,
+                     poll=0.01, lease=60.))
+
+
+def test_workers_run_every_job_once(tmp_path):
+    queue_dir = tmp_path / "queue"
+    log_fn = tmp_path / "runs"
+    ctx = multiprocessing.get_context("fork")
+    workers = [ctx.Process(target=run_worker,
+                           args=(queue_dir, f"worker{i}", log_fn))
+               for i in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join(timeout=60)
+        assert worker.exitcode == 0
+
+    with open(log_fn) as handle:
+        runs = [line.split()[0] for line in handle.read().strip().split("\n")]
+    assert sorted(runs) == sorted(ROWS + COLS)
+    queue = WorkQueue(queue_dir)
+    assert queue.done() == set(ROWS + COLS)
+    assert queue.todo() == set()
+    assert queue.claimed() == dict()
+    # Columns only start after their row.
+    for i, col in enumerate(COLS):
+        assert runs.index(ROWS[i % 2]) < runs.index(col)
+
+
+def test_worker_cant_resume(example_grid):
+    proc = subprocess.run(
+        [sys.executable, "-m", "mcgridprep.run", "job_inputs", "--worker",
+         "--resume"],
+        cwd=example_grid, env=dict(os.environ, PYTHONPATH=str(TESTS_DIR.parent)),
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
+    )
+    assert proc.returncode == 1
+    assert "--worker can't be combined with --resume" in proc.stderr
+    # Nothing was started.
+    assert not (example_grid / QUEUE_DIR).exists()